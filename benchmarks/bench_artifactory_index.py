@@ -0,0 +1,163 @@
+"""
+Benchmark for resolving the latest downstream RPM from an Artifactory
+directory listing.
+
+Serves a generated fixture listing with thousands of entries from a local
+HTTP server and compares the legacy BeautifulSoup parsing against the
+ArtifactoryResolver backends (HTML streaming, storage list API, disk cache).
+
+Usage:
+    python benchmarks/bench_artifactory_index.py --entries 5000 --repeat 5
+"""
+
+import argparse
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deployment.artifactory import ArtifactoryResolver  # noqa: E402
+
+REPO_PATH = "/artifactory/rpm-local/unsigned/"
+
+
+def build_fixture(entries):
+    """
+    Builds the HTML listing and the storage list API answer of a directory
+
+    Args:
+        entries (int): number of build folders in the directory
+
+    Returns:
+        tuple: (html listing, storage list JSON)
+
+    """
+    start = datetime(2020, 1, 1)
+    html = [f"<html><body><h1>Index of {REPO_PATH}</h1><pre>Name</pre><hr/><pre>"]
+    html.append('<a href="../">../</a>')
+    files = []
+    for num in range(entries):
+        name = f"noobaa-core-5.{num // 100}.{num % 100}-{num:06d}.el9"
+        date = start + timedelta(hours=num * 7 % (entries * 3))
+        html.append(
+            f'<a href="{name}/">{name}/</a>  {date.strftime("%d-%b-%Y %H:%M")}    -'
+        )
+        files.append(
+            {
+                "uri": f"/{name}",
+                "folder": True,
+                "size": -1,
+                "lastModified": date.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            }
+        )
+    html.append("</pre><hr/></body></html>")
+    return "\n".join(html), json.dumps({"uri": REPO_PATH, "files": files})
+
+
+def legacy_latest(html):
+    """
+    Latest folder lookup as done before with BeautifulSoup
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    latest_package = latest_date = None
+    for a_tag in soup.find_all("pre")[1].find_all("a"):
+        href = a_tag.get("href")
+        text = a_tag.next_sibling.strip()
+        if "noobaa-core" in href and "el9" in href:
+            date_obj = datetime.strptime(" ".join(text.split()[:2]), "%d-%b-%Y %H:%M")
+            if latest_date is None or date_obj > latest_date:
+                latest_date = date_obj
+                latest_package = href
+    return latest_package
+
+
+def serve(html, storage_list):
+    """
+    Starts a local HTTP server answering the HTML listing and the API
+
+    Returns:
+        str: URL of the directory
+
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/artifactory/api/storage/"):
+                body, content_type = storage_list, "application/json"
+            else:
+                body, content_type = html, "text/html"
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}{REPO_PATH}"
+
+
+def timed(func, repeat):
+    """
+    Returns the best wall clock time of func over repeat runs and its result
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    html, storage_list = build_fixture(args.entries)
+    url = serve(html, storage_list)
+
+    def name_filter(name):
+        return "noobaa-core" in name and "el9" in name
+
+    def resolve(**kwargs):
+        return lambda: ArtifactoryResolver(**kwargs).latest_folder(url, name_filter)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # warm up the cache once, the benchmark then measures cache hits
+        resolve(cache_dir=cache_dir)()
+        cases = {
+            "legacy bs4 html.parser": lambda: legacy_latest(
+                ArtifactoryResolver().session.get(url).text
+            ),
+            "html streaming": resolve(backend="html"),
+            "storage list api": resolve(backend="api"),
+            "disk cache hit": resolve(cache_dir=cache_dir),
+        }
+        results = {}
+        for name, func in cases.items():
+            elapsed, latest = timed(func, args.repeat)
+            results[name] = elapsed
+            latest = latest.rstrip("/").split("/")[-1]
+            print(f"{name:<24} {elapsed * 1000:10.2f} ms  {latest}")
+    baseline = results["legacy bs4 html.parser"]
+    for name, elapsed in results.items():
+        print(f"{name:<24} {baseline / elapsed:8.1f}x speedup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Benchmark and checks for the parallel ranged RPM downloader.
+
+Serves a generated file from a local HTTP stand-in with Range, If-Range,
+per-request latency and a per-connection bandwidth cap, like a remote
+Artifactory or S3, compares a single stream against parallel ranges, and
+checks that an interrupted download resumes from its .progress sidecar and
+that servers ignoring or not advertising Range fall back to a single stream.
+Fails when a download is wrong or a check doesn't hold.
+
+Usage:
+    python benchmarks/bench_ranged_download.py --size-mb 32 --connection-mbps 100
+"""
+
+import argparse
+import hashlib
+import http.server
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deployment.downloader import RangedDownloader  # noqa: E402
+
+RANGE_REGEX = re.compile(r"bytes=(\d+)-(\d+)")
+
+
+class RangeStandIn(http.server.BaseHTTPRequestHandler):
+    """
+    Serves one file, the class attributes set the behavior of the server
+    """
+
+    protocol_version = "HTTP/1.1"
+    body = b""
+    etag = '"0"'
+    # advertise Accept-Ranges, answer Range requests with 206
+    advertise_ranges = True
+    honor_ranges = True
+    latency = 0
+    # bytes per second of a single connection, 0 for no limit
+    connection_rate = 0
+    # range starts answered with 500, e.g: to interrupt a download
+    failing_starts = set()
+    requests = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _write(self, data):
+        """
+        Writes the data at most at the connection rate
+        """
+        piece = 64 * 1024
+        for offset in range(0, len(data), piece):
+            self.wfile.write(data[offset : offset + piece])
+            if self.connection_rate:
+                time.sleep(piece / self.connection_rate)
+
+    def _headers(self, status, length, content_range=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", self.etag)
+        if self.advertise_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(self.body))
+
+    def do_GET(self):
+        requested = RANGE_REGEX.fullmatch(self.headers.get("Range", ""))
+        with self.lock:
+            self.requests.append(requested.group(0) if requested else None)
+        time.sleep(self.latency)
+        if_range = self.headers.get("If-Range")
+        if requested and self.honor_ranges and if_range in (None, self.etag):
+            start, end = int(requested[1]), min(int(requested[2]), len(self.body) - 1)
+            if start in self.failing_starts:
+                self._headers(500, 0)
+                return
+            self._headers(206, end - start + 1, f"bytes {start}-{end}/{len(self.body)}")
+            self._write(self.body[start : end + 1])
+            return
+        self._headers(200, len(self.body))
+        self._write(self.body)
+
+
+def serve(body):
+    """
+    Starts the stand-in serving the body
+
+    Returns:
+        str: URL of the file
+
+    """
+    RangeStandIn.body = body
+    RangeStandIn.etag = f'"{hashlib.md5(body).hexdigest()}"'
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeStandIn)
+    # clients close the whole file answers to range requests they ignore
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/noobaa-core.rpm"
+
+
+def reset_server(**behavior):
+    RangeStandIn.advertise_ranges = True
+    RangeStandIn.honor_ranges = True
+    RangeStandIn.failing_starts = set()
+    RangeStandIn.requests = []
+    for name, value in behavior.items():
+        setattr(RangeStandIn, name, value)
+
+
+def download(url, dest, workers, chunk_size, checksum):
+    """
+    Returns:
+        tuple: (seconds the download took, sha256 of the downloaded file)
+
+    """
+    downloader = RangedDownloader(url, dest, workers=workers, chunk_size=chunk_size)
+    start = time.perf_counter()
+    sha256 = downloader.download(checksum=checksum)
+    return time.perf_counter() - start, sha256
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--chunk-mb", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--latency-ms", type=float, default=20, help="latency of every request"
+    )
+    parser.add_argument(
+        "--connection-mbps",
+        type=float,
+        default=100,
+        help="bandwidth of a single connection in MB/s, 0 for no limit",
+    )
+    args = parser.parse_args()
+
+    body = os.urandom(args.size_mb * 1024 * 1024)
+    checksum = hashlib.sha256(body).hexdigest()
+    chunk_size = args.chunk_mb * 1024 * 1024
+    chunks = (len(body) + chunk_size - 1) // chunk_size
+    url = serve(body)
+    RangeStandIn.latency = args.latency_ms / 1000
+    RangeStandIn.connection_rate = args.connection_mbps * 1024 * 1024
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok' if condition else 'FAIL'}: {message}")
+        if not condition:
+            failures.append(message)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dest = os.path.join(tmp_dir, "noobaa-core.rpm")
+
+        reset_server()
+        single, _ = download(url, dest, 1, chunk_size, checksum)
+        reset_server()
+        parallel, _ = download(url, dest, args.workers, chunk_size, checksum)
+        check(
+            len(RangeStandIn.requests) == chunks and all(RangeStandIn.requests),
+            f"parallel download fetched {len(RangeStandIn.requests)} ranges "
+            f"of {chunks}",
+        )
+        print(
+            f"single stream {single * 1000:10.1f} ms\n"
+            f"{args.workers} workers     {parallel * 1000:10.1f} ms  "
+            f"{single / parallel:.1f}x speedup"
+        )
+
+        # the second half of the ranges fails, the first half is kept
+        os.remove(dest)
+        failing = {index * chunk_size for index in range(chunks // 2, chunks)}
+        reset_server(failing_starts=failing)
+        try:
+            download(url, dest, args.workers, chunk_size, checksum)
+            check(False, "interrupted download raised")
+        except Exception:
+            check(os.path.exists(f"{dest}.progress"), "progress sidecar is kept")
+        reset_server()
+        download(url, dest, args.workers, chunk_size, checksum)
+        check(
+            len(RangeStandIn.requests) == len(failing),
+            f"resumed download fetched {len(RangeStandIn.requests)} ranges, "
+            f"{len(failing)} were missing",
+        )
+        check(
+            not os.path.exists(f"{dest}.progress"), "progress sidecar is dropped"
+        )
+
+        for name, behavior in (
+            ("server without Accept-Ranges", {"advertise_ranges": False}),
+            ("server ignoring Range", {"honor_ranges": False}),
+        ):
+            os.remove(dest)
+            reset_server(**behavior)
+            elapsed, _ = download(url, dest, args.workers, chunk_size, checksum)
+            whole = [r for r in RangeStandIn.requests if r is None]
+            check(
+                len(whole) == 1,
+                f"{name} downloaded with a single stream in "
+                f"{elapsed * 1000:.1f} ms",
+            )
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
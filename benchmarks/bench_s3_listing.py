@@ -0,0 +1,221 @@
+"""
+Benchmark for finding the latest upstream RPM in a large S3 bucket listing.
+
+Serves a generated bucket with tens of thousands of keys from a local
+ListObjectsV2 stand-in with prefix, start-after, max-keys and continuation
+tokens, and compares the legacy single response ElementTree parsing with
+the paginated streaming listing. Reports wall time and peak Python memory,
+and fails when the two don't find the same RPM.
+
+Usage:
+    python benchmarks/bench_s3_listing.py --keys 50000 --repeat 3
+"""
+
+import argparse
+import http.server
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from deployment.s3_listing import (  # noqa: E402
+    S3_NAMESPACE,
+    find_latest,
+    list_objects_v2,
+    literal_prefix,
+)
+
+RPM_PATTERN = re.compile(r"noobaa-core-.*\.el9\.x86_64\.rpm")
+PAGE_SIZE = 1000
+
+
+def build_fixture(count):
+    """
+    Builds the keys of the bucket, RPMs of several distributions and arches
+    and unrelated build logs, sorted like S3 lists them
+
+    Returns:
+        list: (key, last modified) of every object
+
+    """
+    start = datetime(2020, 1, 1)
+    objects = []
+    for num in range(count):
+        modified = start + timedelta(minutes=num * 7919 % (count * 3))
+        if num % 2:
+            key = f"logs/build-{num:08d}.log"
+        else:
+            dist = ("el8", "el9")[num % 4 // 2]
+            arch = ("x86_64", "aarch64", "ppc64le")[num % 3]
+            version = f"5.{num // 1000}.{num % 1000}-{num:08d}"
+            key = f"noobaa-core-{version}.{dist}.{arch}.rpm"
+        objects.append((key, modified.strftime("%Y-%m-%dT%H:%M:%S.000Z")))
+    return sorted(objects)
+
+
+def render(objects, truncated=False, token=None):
+    contents = "".join(
+        f"<Contents><Key>{escape(key)}</Key>"
+        f"<LastModified>{modified}</LastModified></Contents>"
+        for key, modified in objects
+    )
+    pagination = f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+    if token:
+        pagination += f"<NextContinuationToken>{token}</NextContinuationToken>"
+    return (
+        '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+        f"<Name>rpms</Name>{pagination}{contents}</ListBucketResult>"
+    ).encode()
+
+
+def serve(objects):
+    """
+    Starts the ListObjectsV2 stand-in, rendered pages are cached so the
+    measured runs only pay for the client
+
+    Returns:
+        str: URL of the bucket
+
+    """
+    keys = [key for key, _ in objects]
+    cache = {}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            query = urlsplit(self.path).query
+            if query not in cache:
+                cache[query] = self._listing(parse_qs(query))
+            body = cache[query]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _listing(self, params):
+            if params.get("list-type") != ["2"]:
+                # legacy listing, the whole bucket in one response
+                return render(objects)
+            prefix = params.get("prefix", [""])[0]
+            after = params.get("continuation-token", params.get("start-after", [""]))
+            max_keys = int(params.get("max-keys", [PAGE_SIZE])[0])
+            selected = []
+            for index in range(_bisect(keys, after[0]), len(keys)):
+                if not keys[index].startswith(prefix):
+                    if keys[index] > prefix:
+                        break
+                    continue
+                if keys[index] == after[0]:
+                    continue
+                selected.append(objects[index])
+                if len(selected) == max_keys:
+                    truncated = index + 1 < len(keys) and keys[index + 1].startswith(
+                        prefix
+                    )
+                    return render(selected, truncated, selected[-1][0])
+            return render(selected)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _bisect(keys, key):
+    low, high = 0, len(keys)
+    while low < high:
+        mid = (low + high) // 2
+        if keys[mid] < key:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+def legacy_latest(url, session):
+    """
+    Latest RPM lookup as done before, one response parsed as a whole
+    """
+    response = session.get(url)
+    root = ET.fromstring(response.content)
+    latest_key = None
+    latest_date = datetime.min
+    for content in root.findall(f"{S3_NAMESPACE}Contents"):
+        key = content.find(f"{S3_NAMESPACE}Key").text
+        last_modified = content.find(f"{S3_NAMESPACE}LastModified").text
+        if RPM_PATTERN.match(key):
+            date = datetime.strptime(last_modified, "%Y-%m-%dT%H:%M:%S.%fZ")
+            if date > latest_date:
+                latest_key, latest_date = key, date
+    return latest_key
+
+
+def streaming_latest(url, session):
+    objects = list_objects_v2(
+        url, prefix=literal_prefix(RPM_PATTERN.pattern), session=session
+    )
+    return find_latest(objects, RPM_PATTERN)
+
+
+def measure(func, repeat):
+    """
+    Returns:
+        tuple: (best wall time, peak traced memory in bytes, result)
+
+    """
+    best = None
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--keys", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    url = serve(build_fixture(args.keys))
+    session = requests.Session()
+    cases = {
+        "legacy single response": lambda: legacy_latest(url, session),
+        "paginated streaming": lambda: streaming_latest(url, session),
+    }
+    results = {}
+    print(f"{'listing':<24}{'wall ms':>10}{'peak MB':>10}  latest")
+    for name, func in cases.items():
+        # renders and caches the pages of the stand-in
+        func()
+        elapsed, peak, latest = measure(func, args.repeat)
+        results[name] = (elapsed, peak, latest)
+        print(f"{name:<24}{elapsed * 1000:>10.1f}{peak / 2**20:>10.1f}  {latest}")
+
+    latest = {result[2] for result in results.values()}
+    if len(latest) != 1:
+        print(f"FAIL: the listings found different RPMs {sorted(latest)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Benchmark for the startup time of the noobaa-sa-* entry points.
+
+Runs the --help path of every entry point in a fresh interpreter with
+-X importtime, reports the wall time, the import time and the slowest
+imports, and fails when a path exceeds the budget or loads one of the
+heavy dependencies which only deployments need. The modules an NSFS
+deployment loads are checked for the DB mode dependencies too.
+
+Usage:
+    python benchmarks/bench_startup.py --repeat 5 --budget-ms 200
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entry point paths, run as: <entry point> --help
+ENTRY_POINTS = (
+    "noobaa_sa_install",
+    "noobaa_sa_bench",
+    "noobaa_sa_teardown",
+    "noobaa_sa_metrics",
+)
+# dependencies which must not be loaded by --help and argument errors
+HEAVY_MODULES = ("requests", "urllib3", "jinja2", "paramiko", "bs4", "yaml")
+
+RUNNER = """
+import json, sys
+sys.argv = ["{entry_point}", "--help"]
+from deployment.main import {entry_point}
+try:
+    {entry_point}()
+except SystemExit:
+    pass
+heavy = [m for m in {heavy!r} if m in sys.modules]
+sys.stderr.write("HEAVY " + json.dumps(heavy) + "\\n")
+"""
+# modules an NSFS deployment loads before it runs
+NSFS_RUNNER = """
+import json, sys
+from deployment.main import noobaa_sa_install
+from deployment.deployment import DeploymentNSFS, deploy
+heavy = [m for m in {heavy!r} if m in sys.modules]
+sys.stderr.write("HEAVY " + json.dumps(heavy) + "\\n")
+"""
+# DB mode dependencies which an NSFS deployment must not load
+DB_MODULES = (
+    "pynpm",
+    "deployment.npm",
+    "deployment.health",
+    "deployment.backingstore",
+    "deployment.pg_tuning",
+    "deployment.readiness",
+    "deployment.scheduler",
+    "deployment.supervisor",
+    "deployment.snapshot",
+)
+
+
+def parse_importtime(stderr):
+    """
+    Parses the -X importtime output
+
+    Args:
+        stderr (str): stderr of the interpreter
+
+    Returns:
+        tuple: (total import microseconds, dict of module to its cumulative
+            microseconds), both without the interpreter startup (site)
+
+    """
+    total = 0
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        if not cumulative_us.strip().isdigit():
+            continue
+        module = name.rstrip()
+        depth = len(module) - len(module.lstrip())
+        module = module.strip()
+        # imports are listed after their dependencies, so everything up to
+        # site was imported by the interpreter startup
+        if depth == 1 and module == "site":
+            total = 0
+            cumulative = {}
+            continue
+        cumulative[module] = int(cumulative_us)
+        if depth == 1:
+            total += int(cumulative_us)
+    return total, cumulative
+
+
+def run_once(entry_point):
+    """
+    Runs the --help path of an entry point in a fresh interpreter
+
+    Returns:
+        dict: wall_ms, import_ms, cumulative import microseconds by module
+            and the heavy modules which were loaded
+
+    """
+    return run_code(RUNNER.format(entry_point=entry_point, heavy=HEAVY_MODULES))
+
+
+def run_code(code):
+    """
+    Runs a runner in a fresh interpreter, see run_once
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=TOP_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    wall = time.perf_counter() - start
+    total, cumulative = parse_importtime(result.stderr)
+    heavy = []
+    for line in result.stderr.splitlines():
+        if line.startswith("HEAVY "):
+            heavy = json.loads(line[len("HEAVY ") :])
+    return {
+        "wall_ms": wall * 1000,
+        "import_ms": total / 1000,
+        "cumulative": cumulative,
+        "heavy": heavy,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=200,
+        help="max median wall time of an entry point's --help",
+    )
+    parser.add_argument("--top", type=int, default=5, help="slowest imports shown")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'entry point':<22}{'wall ms':>10}{'import ms':>12}  slowest imports")
+    for entry_point in ENTRY_POINTS:
+        runs = [run_once(entry_point) for _ in range(args.repeat)]
+        wall = statistics.median(run["wall_ms"] for run in runs)
+        imports = statistics.median(run["import_ms"] for run in runs)
+        slowest = sorted(
+            (
+                (us, module)
+                for module, us in runs[-1]["cumulative"].items()
+                if not module.startswith(("deployment", "framework"))
+            ),
+            reverse=True,
+        )[: args.top]
+        print(
+            f"{entry_point:<22}{wall:>10.1f}{imports:>12.1f}  "
+            + ", ".join(f"{module} {us / 1000:.1f}" for us, module in slowest)
+        )
+        if wall > args.budget_ms:
+            failures.append(
+                f"{entry_point} --help took {wall:.1f}ms, budget {args.budget_ms}ms"
+            )
+        if runs[-1]["heavy"]:
+            failures.append(f"{entry_point} --help loaded {runs[-1]['heavy']}")
+
+    # a deployment reads the yaml config
+    nsfs_heavy = tuple(m for m in HEAVY_MODULES if m != "yaml") + DB_MODULES
+    nsfs = run_code(NSFS_RUNNER.format(heavy=nsfs_heavy))
+    print(f"{'nsfs deployment':<22}{nsfs['wall_ms']:>10.1f}{nsfs['import_ms']:>12.1f}")
+    if nsfs["heavy"]:
+        failures.append(f"an NSFS deployment loaded {nsfs['heavy']}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
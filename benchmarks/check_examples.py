@@ -0,0 +1,32 @@
+"""
+Runs the Examples sections of the deployment docstrings.
+
+The examples pin behavior which is easy to break and hard to reach on a
+real host, e.g: PostgreSQL reporting a setting under another name.
+Fails when an example doesn't hold.
+
+Usage:
+    python benchmarks/check_examples.py
+"""
+
+import doctest
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODULES = ("deployment.pg_tuning", "deployment.nsfs_tuning")
+
+
+def main():
+    failed = 0
+    for name in MODULES:
+        result = doctest.testmod(importlib.import_module(name))
+        print(f"{name:<32}{result.attempted:>4} examples {result.failed:>4} failed")
+        failed += result.failed
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
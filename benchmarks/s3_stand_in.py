@@ -0,0 +1,154 @@
+"""
+In-memory S3 stand-in for trying noobaa-sa-bench without a deployment.
+
+Serves path style bucket create, object PUT/GET/DELETE and ListObjectsV2,
+and verifies the Signature Version 4 of every request.
+
+Usage:
+    python benchmarks/s3_stand_in.py --port 6001 &
+    AWS_ACCESS_KEY_ID=bench AWS_SECRET_ACCESS_KEY=bench \\
+        noobaa-sa-bench --endpoint http://localhost:6001 --duration 5
+"""
+
+import argparse
+import hashlib
+import hmac
+import http.server
+import re
+import threading
+from urllib.parse import unquote, urlsplit
+from xml.sax.saxutils import escape
+
+AUTH_REGEX = re.compile(
+    r"AWS4-HMAC-SHA256 Credential=(?P<key>[^/]+)/(?P<scope>[^,]+), "
+    r"SignedHeaders=(?P<headers>[^,]+), Signature=(?P<signature>\w+)"
+)
+
+
+def expected_signature(secret_key, method, url, headers, auth):
+    """
+    Recomputes the signature of a request from what the server received
+    """
+    signed_headers = auth["headers"].split(";")
+    canonical_headers = "".join(
+        f"{name}:{headers[name].strip()}\n" for name in signed_headers
+    )
+    query = sorted(pair.partition("=")[::2] for pair in url.query.split("&") if pair)
+    canonical_request = "\n".join(
+        [
+            method,
+            url.path,
+            "&".join(f"{name}={value}" for name, value in query),
+            canonical_headers,
+            auth["headers"],
+            headers["x-amz-content-sha256"],
+        ]
+    )
+    string_to_sign = "\n".join(
+        [
+            "AWS4-HMAC-SHA256",
+            headers["x-amz-date"],
+            auth["scope"],
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ]
+    )
+    key = f"AWS4{secret_key}".encode()
+    for part in auth["scope"].split("/"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+class S3StandIn(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    credentials = {}
+    buckets = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b"", content_type="application/xml"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        body = f"<Error><Code>{code}</Code></Error>".encode()
+        self._reply(status, body)
+
+    def _authorized(self):
+        auth = AUTH_REGEX.match(self.headers.get("Authorization", ""))
+        if not auth or auth["key"] not in self.credentials:
+            return False
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        signature = expected_signature(
+            self.credentials[auth["key"]],
+            self.command,
+            urlsplit(self.path),
+            headers,
+            auth,
+        )
+        return hmac.compare_digest(signature, auth["signature"])
+
+    def _route(self):
+        body = b""
+        if "Content-Length" in self.headers:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        if not self._authorized():
+            return self._error(403, "SignatureDoesNotMatch")
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+        with self.lock:
+            objects = self.buckets.get(bucket)
+            if self.command == "PUT" and not key:
+                if objects is not None:
+                    return self._error(409, "BucketAlreadyOwnedByYou")
+                self.buckets[bucket] = {}
+                return self._reply(200)
+            if objects is None:
+                return self._error(404, "NoSuchBucket")
+            if self.command == "PUT":
+                objects[key] = body
+                return self._reply(200)
+            if self.command == "DELETE":
+                objects.pop(key, None)
+                return self._reply(204)
+            if key:
+                if key not in objects:
+                    return self._error(404, "NoSuchKey")
+                return self._reply(200, objects[key], "application/octet-stream")
+            params = dict(
+                pair.partition("=")[::2] for pair in url.query.split("&") if pair
+            )
+            prefix = unquote(params.get("prefix", ""))
+            max_keys = int(params.get("max-keys", 1000))
+            keys = sorted(k for k in objects if k.startswith(prefix))[:max_keys]
+        contents = "".join(f"<Contents><Key>{escape(k)}</Key></Contents>" for k in keys)
+        body = (
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{bucket}</Name><KeyCount>{len(keys)}</KeyCount>"
+            f"{contents}</ListBucketResult>"
+        ).encode()
+        return self._reply(200, body)
+
+    do_GET = do_PUT = do_DELETE = do_HEAD = _route
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=6001)
+    parser.add_argument("--access-key", default="bench")
+    parser.add_argument("--secret-key", default="bench")
+    args = parser.parse_args()
+    S3StandIn.credentials = {args.access_key: args.secret_key}
+    server = http.server.ThreadingHTTPServer(("localhost", args.port), S3StandIn)
+    print(f"S3 stand-in listening on http://localhost:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
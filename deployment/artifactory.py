@@ -0,0 +1,283 @@
+"""
+This module resolves RPMs in Artifactory directories. Directories are listed
+with the Artifactory storage list JSON API when it is available, otherwise
+the HTML directory listing is parsed line by line while it streams in.
+Listings are cached on disk for a TTL, so repeated deployments within the
+window don't list anything over the network.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import urljoin, urlparse, urlunparse
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# e.g: <a href="noobaa-core-5.15.el9/">noobaa-core-5.15.el9/</a>  06-Nov-2023 10:11  -
+HTML_ENTRY_REGEX = re.compile(
+    r'<a href="(?P<href>[^"]+)">[^<]*</a>\s*'
+    r"(?P<date>\d{2}-[A-Za-z]{3}-\d{4} \d{2}:\d{2})?"
+)
+HTML_DATE_FORMAT = "%d-%b-%Y %H:%M"
+
+IndexEntry = namedtuple("IndexEntry", ["name", "last_modified", "folder"])
+
+
+def entry_href(entry):
+    """
+    Returns the href of an index entry relative to its directory
+    """
+    return f"{entry.name}/" if entry.folder else entry.name
+
+
+def parse_html_index(lines):
+    """
+    Parses an HTML directory listing
+
+    Args:
+        lines (iterable): lines of the HTML listing
+
+    Yields:
+        IndexEntry: entry for every file and folder of the listing
+
+    """
+    for line in lines:
+        for match in HTML_ENTRY_REGEX.finditer(line):
+            href = match.group("href")
+            if href.startswith(("../", "/", "?", "http:", "https:")):
+                continue
+            date = match.group("date")
+            yield IndexEntry(
+                name=href.rstrip("/"),
+                last_modified=datetime.strptime(date, HTML_DATE_FORMAT)
+                if date
+                else None,
+                folder=href.endswith("/"),
+            )
+
+
+def parse_storage_list(data):
+    """
+    Parses the answer of the Artifactory storage list API
+
+    Args:
+        data (dict): JSON answer, e.g:
+            {"files": [{"uri": "/a.rpm", "lastModified": "...", "folder": false}]}
+
+    Returns:
+        list: IndexEntry for every file and folder
+
+    """
+    entries = []
+    for item in data.get("files", []):
+        last_modified = item.get("lastModified")
+        if last_modified:
+            # e.g: 2023-11-06T10:11:12.345Z or 2023-11-06T10:11:12.345+0000
+            last_modified = datetime.strptime(
+                last_modified.replace("Z", "+0000"), "%Y-%m-%dT%H:%M:%S.%f%z"
+            )
+            last_modified = last_modified.astimezone(timezone.utc).replace(
+                tzinfo=None
+            )
+        entries.append(
+            IndexEntry(
+                name=item["uri"].strip("/"),
+                last_modified=last_modified,
+                folder=item.get("folder", False),
+            )
+        )
+    return entries
+
+
+def storage_list_url(url):
+    """
+    Converts a directory URL to the storage list API URL of the directory, e.g:
+    https://host/artifactory/repo/dir/ ->
+    https://host/artifactory/api/storage/repo/dir?list&deep=0&listFolders=1
+
+    Args:
+        url (str): directory URL
+
+    Returns:
+        str: storage list API URL
+
+    """
+    parsed = urlparse(url)
+    parts = parsed.path.strip("/").split("/")
+    if "artifactory" in parts:
+        position = parts.index("artifactory") + 1
+        parts = parts[:position] + ["api", "storage"] + parts[position:]
+    else:
+        parts = ["api", "storage"] + parts
+    path = "/" + "/".join(parts)
+    return urlunparse(parsed._replace(path=path, query="list&deep=0&listFolders=1"))
+
+
+class ArtifactoryResolver(object):
+    """
+    Resolves files in Artifactory directories with a cached directory index
+    """
+
+    def __init__(
+        self, auth=None, backend="auto", cache_dir=None, cache_ttl=900, session=None
+    ):
+        """
+        Args:
+            auth (tuple): (username, password) when authentication is required
+            backend (str): "api" for the storage list API, "html" for the HTML
+                listing, "auto" tries the API first and falls back to HTML
+            cache_dir (str): directory holding the cached listings,
+                None disables the cache
+            cache_ttl (int): seconds a cached listing stays valid
+            session (requests.Session): session used for the requests
+
+        """
+        self.auth = auth
+        self.backend = backend
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self.cache_ttl = cache_ttl
+        self.session = session or requests.Session()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _cache_file(self, url):
+        return os.path.join(
+            self.cache_dir, f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+        )
+
+    def _load_cached(self, url):
+        if not self.cache_dir:
+            return None
+        cache_file = self._cache_file(url)
+        if not os.path.exists(cache_file):
+            return None
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if time.time() - cached["fetched_at"] > self.cache_ttl:
+            return None
+        log.info(f"Using cached directory index of {url}")
+        return [
+            IndexEntry(
+                name,
+                datetime.fromisoformat(last_modified) if last_modified else None,
+                folder,
+            )
+            for name, last_modified, folder in cached["entries"]
+        ]
+
+    def _save_cached(self, url, entries):
+        if not self.cache_dir:
+            return
+        cached = {
+            "url": url,
+            "fetched_at": time.time(),
+            "entries": [
+                [
+                    entry.name,
+                    entry.last_modified.isoformat() if entry.last_modified else None,
+                    entry.folder,
+                ]
+                for entry in entries
+            ],
+        }
+        cache_file = self._cache_file(url)
+        with open(f"{cache_file}.tmp", "w") as f:
+            json.dump(cached, f)
+        os.replace(f"{cache_file}.tmp", cache_file)
+
+    def list_directory(self, url):
+        """
+        Lists a directory, from the cache when it is fresh
+
+        Args:
+            url (str): directory URL
+
+        Returns:
+            list: IndexEntry for every file and folder
+
+        """
+        entries = self._load_cached(url)
+        if entries is not None:
+            return entries
+        if self.backend in ("auto", "api"):
+            entries = self._list_api(url)
+        if entries is None:
+            entries = self._list_html(url)
+        self._save_cached(url, entries)
+        return entries
+
+    def _list_api(self, url):
+        """
+        Lists a directory with the storage list API
+
+        Returns:
+            list: IndexEntry for every file and folder, None when the API is
+                not available and the backend is "auto"
+
+        """
+        response = self.session.get(storage_list_url(url), auth=self.auth)
+        try:
+            response.raise_for_status()
+            return parse_storage_list(response.json())
+        except (requests.HTTPError, ValueError) as ex:
+            if self.backend == "api":
+                raise
+            log.info(f"Storage list API not available for {url}: {ex}")
+            return None
+
+    def _list_html(self, url):
+        """
+        Lists a directory by parsing its HTML listing while it streams in
+
+        Returns:
+            list: IndexEntry for every file and folder
+
+        """
+        with self.session.get(url, auth=self.auth, stream=True) as response:
+            response.raise_for_status()
+            lines = response.iter_lines(decode_unicode=True)
+            return list(parse_html_index(lines))
+
+    def latest_folder(self, url, name_filter):
+        """
+        Finds the latest modified folder
+
+        Args:
+            url (str): directory URL
+            name_filter (callable): returns True for folder names to consider
+
+        Returns:
+            str: URL of the latest folder, None if no folder matches
+
+        """
+        latest = None
+        for entry in self.list_directory(url):
+            if not (entry.folder and entry.last_modified and name_filter(entry.name)):
+                continue
+            if latest is None or entry.last_modified > latest.last_modified:
+                latest = entry
+        return urljoin(url, entry_href(latest)) if latest else None
+
+    def find_file(self, url, regex):
+        """
+        Finds a file matching the regex
+
+        Args:
+            url (str): directory URL
+            regex (re.Pattern): pattern to search in the file names
+
+        Returns:
+            str: URL of the file, None if no file matches
+
+        """
+        for entry in self.list_directory(url):
+            if not entry.folder and regex.search(entry.name):
+                return urljoin(url, entry.name)
+        return None
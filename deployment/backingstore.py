@@ -0,0 +1,244 @@
+"""
+This module launches backingstore agents in bulk: drives are created up
+front, optionally spread over several filesystems, ports are allocated
+without collisions, agents are launched concurrently and their RPC ports
+are waited for in a single pass.
+"""
+
+import logging
+import os
+import socket
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from common_ci_utils.file_system_utils import create_directory
+from deployment.readiness import build_probe, wait_for_all_ready
+from framework import exceptions
+from framework.tracing import bind_context, tracer
+
+log = logging.getLogger(__name__)
+
+MAX_PORT = 65535
+
+# numa_node is the NUMA node of the drive's device, None if unknown
+BackingStoreDrive = namedtuple(
+    "BackingStoreDrive", ["path", "port", "numa_node"], defaults=(None,)
+)
+
+
+def is_port_free(port, host=""):
+    """
+    Checks whether a TCP port can be bound on the host
+
+    Args:
+        port (int): port to check
+        host (str): address to bind, all addresses by default
+
+    Returns:
+        bool: True if the port is free, False otherwise
+
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+            return True
+        except OSError:
+            return False
+
+
+def allocate_ports(count, base_port, reserved_ports=(), is_free=is_port_free):
+    """
+    Allocates ports after base_port, skipping reserved ports and ports
+    which are already bound on the host
+
+    Args:
+        count (int): number of ports to allocate
+        base_port (int): ports are allocated starting at base_port + 1
+        reserved_ports (iterable): ports used by other services
+        is_free (callable): checks whether a port is free on the host the
+            agents run on, this host by default
+
+    Returns:
+        list: allocated ports
+
+    Raises:
+        PortAllocationFailed: In case there are not enough free ports
+
+    """
+    reserved = set(reserved_ports)
+    ports = []
+    port = base_port
+    while len(ports) < count:
+        port += 1
+        if port > MAX_PORT:
+            raise exceptions.PortAllocationFailed(
+                f"Allocated only {len(ports)} of {count} ports after {base_port}"
+            )
+        if port in reserved:
+            continue
+        if not is_free(port):
+            log.warning(f"Port {port} is already in use, skipping it")
+            continue
+        ports.append(port)
+    return ports
+
+
+class BackingStoreLauncher(object):
+    """
+    Creates and launches many backingstore agents at once
+    """
+
+    def __init__(
+        self,
+        run_backingstore,
+        drive_path,
+        drive_prefix,
+        count,
+        base_port,
+        parallelism=8,
+        reserved_ports=(),
+        placement=None,
+        stop_backingstore=None,
+    ):
+        """
+        Args:
+            run_backingstore (callable): launches one agent without waiting,
+                called as run_backingstore(backingstore_path=..., port=...,
+                numa_node=...)
+            drive_path (str): directory holding the backingstore drives
+            drive_prefix (str): prefix of every drive directory name
+            count (int): number of backingstores
+            base_port (int): ports are allocated starting at base_port + 1
+            parallelism (int): max number of agents launched at the same time
+            reserved_ports (iterable): ports used by other services
+            placement (list): (path, NUMA node) of every drive, see
+                placement.spread_drives, drives are under drive_path if None
+            stop_backingstore (callable): stops the agent of a previous run,
+                called as stop_backingstore(port)
+
+        """
+        self.run_backingstore = run_backingstore
+        self.drive_path = drive_path
+        self.drive_prefix = drive_prefix
+        self.count = count
+        self.base_port = base_port
+        self.parallelism = parallelism
+        self.reserved_ports = reserved_ports
+        self.placement = placement
+        self.stop_backingstore = stop_backingstore
+        self.drives = []
+
+    def plan(self, previous=None):
+        """
+        Assigns a path and a port to every drive. Drives of a previous run
+        keep their ports, agents of previous drives which are no longer
+        planned are stopped, and new drives get free ports.
+
+        Args:
+            previous (dict): port of every drive path of a previous run
+
+        Returns:
+            list: BackingStoreDrive for every drive
+
+        """
+        previous = previous or {}
+        placement = self.placement or [
+            (os.path.join(self.drive_path, f"{self.drive_prefix}{num}"), None)
+            for num in range(self.count)
+        ]
+        paths = {path for path, _ in placement}
+        dropped = {path: port for path, port in previous.items() if path not in paths}
+        for path, port in dropped.items():
+            log.info(f"stopping the backingstore of dropped drive {path} at {port}")
+            if self.stop_backingstore is not None:
+                self.stop_backingstore(port)
+        kept = [previous[path] for path, _ in placement if path in previous]
+        new_ports = iter(
+            allocate_ports(
+                len(placement) - len(kept),
+                self.base_port,
+                list(self.reserved_ports) + kept,
+            )
+        )
+        self.drives = [
+            BackingStoreDrive(
+                path, previous[path] if path in previous else next(new_ports), numa_node
+            )
+            for path, numa_node in placement
+        ]
+        return self.drives
+
+    def create_drives(self):
+        """
+        Creates all drive directories
+        """
+        for drive in self.drives:
+            create_directory(name=drive.path)
+
+    def launch(self, drives=None):
+        """
+        Launches agents concurrently
+
+        Args:
+            drives (list): drives to launch, all drives by default
+
+        """
+        drives = self.drives if drives is None else drives
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            futures = [
+                executor.submit(bind_context(self._launch_one, drive))
+                for drive in drives
+            ]
+            for future in futures:
+                future.result()
+
+    def _launch_one(self, drive):
+        with tracer.span("backingstore launch", path=drive.path, port=drive.port):
+            self.run_backingstore(
+                backingstore_path=drive.path,
+                port=drive.port,
+                numa_node=drive.numa_node,
+            )
+
+    def wait_ready(self, probe_spec, **wait_kwargs):
+        """
+        Waits for the RPC ports of all agents in one pass
+
+        Args:
+            probe_spec (dict): readiness probe spec of a backingstore
+            wait_kwargs: timeout and backoff passed to wait_for_all_ready
+
+        """
+        probes = [build_probe(probe_spec, port=drive.port) for drive in self.drives]
+        with tracer.span("backingstores wait", count=len(probes)):
+            wait_for_all_ready(probes, **wait_kwargs)
+
+    def run(self, probe_spec, previous=None, **wait_kwargs):
+        """
+        Plans, creates, launches and waits for all backingstores.
+        Agents of a previous run which are still running on the ports of
+        their drives are not launched again.
+
+        Args:
+            probe_spec (dict): readiness probe spec of a backingstore
+            previous (dict): port of every drive path of a previous run
+            wait_kwargs: timeout and backoff passed to wait_for_all_ready
+
+        Returns:
+            list: BackingStoreDrive for every drive
+
+        """
+        previous = previous or {}
+        self.plan(previous)
+        self.create_drives()
+        drives = [
+            drive
+            for drive in self.drives
+            if previous.get(drive.path) != drive.port
+            or not build_probe(probe_spec, port=drive.port).check()
+        ]
+        log.info(f"launching {len(drives)} of {self.count} backingstores")
+        self.launch(drives)
+        self.wait_ready(probe_spec, **wait_kwargs)
+        return self.drives
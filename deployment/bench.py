@@ -0,0 +1,356 @@
+"""
+This module benchmarks the deployed S3 endpoint. Every object size is run
+through a sweep of concurrency levels with a weighted mix of PUT, GET, LIST
+and DELETE operations, the latency percentiles and throughput of every run
+are reported as JSON and compared against a stored baseline.
+"""
+
+import json
+import logging
+import os
+import platform
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+OPERATIONS = ("PUT", "GET", "LIST", "DELETE")
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+SIZE_REGEX = re.compile(r"^\s*(\d+)\s*([KMG]?B?)\s*$", re.IGNORECASE)
+MB = 1024 * 1024
+# workers uploading and deleting the objects around the measured runs
+HOUSEKEEPING_WORKERS = 16
+# metric compared against the baseline and whether higher values are better
+COMPARED_METRICS = (("mb_per_s", True), ("ops_per_s", True), ("p99_ms", False))
+
+
+def parse_size(size):
+    """
+    Parses a human readable size
+
+    Args:
+        size (str|int): e.g: "4KB", "64MB", 1024
+
+    Returns:
+        int: size in bytes
+
+    Raises:
+        ValueError: In case the size can't be parsed
+
+    """
+    if isinstance(size, int):
+        return size
+    match = SIZE_REGEX.match(size)
+    if not match:
+        raise ValueError(f"Invalid size '{size}'")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+
+def parse_mix(mix):
+    """
+    Parses an operation mix
+
+    Args:
+        mix (str|dict): e.g: "put=1,get=4,list=1,delete=1"
+
+    Returns:
+        dict: operation to weight, operations without weight are omitted
+
+    Raises:
+        ValueError: In case of an unknown operation
+
+    """
+    if isinstance(mix, str):
+        mix = dict(item.split("=", 1) for item in mix.split(",") if item)
+    weights = {}
+    for op, weight in mix.items():
+        if op.upper() not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{op}', expected {OPERATIONS}")
+        if float(weight) > 0:
+            weights[op.upper()] = float(weight)
+    if not weights:
+        raise ValueError("The operation mix is empty")
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest rank percentile
+
+    Args:
+        sorted_values (list): sorted samples
+        fraction (float): e.g: 0.99
+
+    Returns:
+        float: the percentile, None without samples
+
+    """
+    if not sorted_values:
+        return None
+    index = max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def summarize(latencies, transferred, errors, elapsed):
+    """
+    Summarizes the samples of an operation
+
+    Args:
+        latencies (list): seconds of every successful operation
+        transferred (int): bytes transferred by the successful operations
+        errors (int): number of failed operations
+        elapsed (float): wall clock seconds of the run
+
+    Returns:
+        dict: count, errors, ops/s, MB/s and latency percentiles in ms
+
+    """
+    latencies = sorted(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "ops_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "mb_per_s": round(transferred / MB / elapsed, 2) if elapsed else 0,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+class S3Bench(object):
+    """
+    Runs the size and concurrency sweep against an S3 endpoint
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket,
+        sizes,
+        concurrencies,
+        mix,
+        duration=30,
+        prefill=16,
+        prefix="noobaa-sa-bench",
+        seed=None,
+    ):
+        """
+        Args:
+            client (S3Client): client of the endpoint, shared by all workers
+            bucket (str): bucket to run in, created when missing
+            sizes (list): object sizes in bytes
+            concurrencies (list): numbers of concurrent workers
+            mix (dict): operation to weight
+            duration (float): seconds of every (size, concurrency) run
+            prefill (int): objects uploaded per size before the runs, read
+                by GET when a worker has no objects of its own
+            prefix (str): key prefix of all benchmark objects
+            seed (int): random seed of the operation choice
+
+        """
+        self.client = client
+        self.bucket = bucket
+        self.sizes = sizes
+        self.concurrencies = concurrencies
+        self.mix = mix
+        self.duration = duration
+        self.prefill = prefill
+        self.prefix = prefix
+        self.seed = seed
+
+    def _payload(self, size):
+        return os.urandom(size)
+
+    def _prefill(self, size, payload):
+        keys = [f"{self.prefix}/{size}/prefill-{i}" for i in range(self.prefill)]
+        with ThreadPoolExecutor(max_workers=HOUSEKEEPING_WORKERS) as executor:
+            list(
+                executor.map(
+                    lambda key: self.client.put_object(self.bucket, key, payload),
+                    keys,
+                )
+            )
+        return keys
+
+    def _worker(self, worker_id, size, payload, shared_keys, deadline, samples):
+        rng = random.Random(None if self.seed is None else self.seed + worker_id)
+        ops, weights = zip(*self.mix.items())
+        own_keys = []
+        counter = 0
+        while time.monotonic() < deadline:
+            op = rng.choices(ops, weights)[0]
+            if op == "DELETE" and not own_keys:
+                op = "PUT"
+            elif op == "GET" and not (own_keys or shared_keys):
+                op = "PUT"
+            start = time.perf_counter()
+            try:
+                if op == "PUT":
+                    key = f"{self.prefix}/{size}/w{worker_id}-{counter}"
+                    counter += 1
+                    transferred = self.client.put_object(self.bucket, key, payload)
+                    own_keys.append(key)
+                elif op == "GET":
+                    key = rng.choice(own_keys or shared_keys)
+                    transferred = self.client.get_object(self.bucket, key)
+                elif op == "LIST":
+                    self.client.list_objects(self.bucket, f"{self.prefix}/{size}/")
+                    transferred = 0
+                else:
+                    key = own_keys.pop(rng.randrange(len(own_keys)))
+                    self.client.delete_object(self.bucket, key)
+                    transferred = 0
+            except Exception as ex:
+                log.debug(f"{op} failed: {ex}")
+                samples[op]["errors"] += 1
+                continue
+            samples[op]["latencies"].append(time.perf_counter() - start)
+            samples[op]["bytes"] += transferred
+        return own_keys
+
+    def run_one(self, size, concurrency, payload, shared_keys):
+        """
+        Runs the mix with a number of workers for the configured duration
+
+        Returns:
+            dict: per operation and total summaries of the run
+
+        """
+        per_worker = [
+            {op: {"latencies": [], "bytes": 0, "errors": 0} for op in OPERATIONS}
+            for _ in range(concurrency)
+        ]
+        start = time.monotonic()
+        deadline = start + self.duration
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(
+                    self._worker,
+                    worker_id,
+                    size,
+                    payload,
+                    shared_keys,
+                    deadline,
+                    per_worker[worker_id],
+                )
+                for worker_id in range(concurrency)
+            ]
+            leftovers = [key for future in futures for key in future.result()]
+        elapsed = time.monotonic() - start
+
+        result = {"size": size, "concurrency": concurrency, "ops": {}}
+        all_latencies, all_bytes, all_errors = [], 0, 0
+        for op in self.mix:
+            latencies = [s for w in per_worker for s in w[op]["latencies"]]
+            transferred = sum(w[op]["bytes"] for w in per_worker)
+            errors = sum(w[op]["errors"] for w in per_worker)
+            result["ops"][op] = summarize(latencies, transferred, errors, elapsed)
+            all_latencies += latencies
+            all_bytes += transferred
+            all_errors += errors
+        result["total"] = summarize(all_latencies, all_bytes, all_errors, elapsed)
+        log.info(
+            f"size={size} concurrency={concurrency}: "
+            f"{result['total']['ops_per_s']} ops/s, "
+            f"{result['total']['mb_per_s']} MB/s, "
+            f"p50={result['total']['p50_ms']}ms p99={result['total']['p99_ms']}ms"
+        )
+        self._cleanup(leftovers)
+        return result
+
+    def _cleanup(self, keys):
+        def delete(key):
+            try:
+                self.client.delete_object(self.bucket, key)
+            except Exception as ex:
+                log.warning(f"failed to delete benchmark object {key}: {ex}")
+
+        with ThreadPoolExecutor(max_workers=HOUSEKEEPING_WORKERS) as executor:
+            list(executor.map(delete, keys))
+
+    def run(self):
+        """
+        Runs every (size, concurrency) combination
+
+        Returns:
+            dict: report with the run parameters and the results
+
+        """
+        self.client.create_bucket(self.bucket)
+        results = []
+        for size in self.sizes:
+            payload = self._payload(size)
+            shared_keys = self._prefill(size, payload)
+            for concurrency in self.concurrencies:
+                results.append(self.run_one(size, concurrency, payload, shared_keys))
+            self._cleanup(shared_keys)
+        return {
+            "meta": {
+                "endpoint": self.client.endpoint,
+                "host": platform.node(),
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "duration": self.duration,
+                "mix": self.mix,
+            },
+            "results": results,
+        }
+
+
+def compare(report, baseline, tolerance=0.1):
+    """
+    Compares the results against a baseline report
+
+    Args:
+        report (dict): current report
+        baseline (dict): baseline report
+        tolerance (float): allowed relative regression, e.g: 0.1 for 10%
+
+    Returns:
+        list: regressions, human readable
+
+    """
+    baseline_results = {
+        (result["size"], result["concurrency"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        base = baseline_results.get((result["size"], result["concurrency"]))
+        if base is None:
+            continue
+        for op, current in [*result["ops"].items(), ("total", result["total"])]:
+            previous = base["ops"].get(op) if op != "total" else base["total"]
+            if not previous:
+                continue
+            where = f"size={result['size']} concurrency={result['concurrency']} {op}"
+            for metric, higher_is_better in COMPARED_METRICS:
+                old, new = previous.get(metric), current.get(metric)
+                if not old or new is None:
+                    continue
+                if higher_is_better:
+                    regressed = new < old * (1 - tolerance)
+                else:
+                    regressed = new > old * (1 + tolerance)
+                if regressed:
+                    regressions.append(f"{where}: {metric} {new}, baseline {old}")
+    return regressions
+
+
+def write_report(report, path):
+    """
+    Writes the report as JSON
+
+    Args:
+        report (dict): benchmark report
+        path (str): path of the report
+
+    """
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    log.info(f"Benchmark report written to {path}")
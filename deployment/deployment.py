@@ -1,33 +1,46 @@
+import hashlib
+import json
 import logging
 import os
 import re
-import requests
-import time
-from datetime import datetime
+import tempfile
+import threading
+from functools import partial
 
-import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 
 from common_ci_utils.command_runner import exec_cmd
-from common_ci_utils.exceptions import (
-    AggregateNodeStatusCheckFailed,
-    ServiceRunningFailed,
-    StorageStatusCheckFailed,
-)
-from common_ci_utils.file_system_utils import create_directory, set_permissions
-from common_ci_utils.host_info import get_ip_address
-from common_ci_utils.package_fetcher import download_rpm
-from common_ci_utils.postgres_utils import enable_postgresql_version
+from common_ci_utils.exceptions import ServiceRunningFailed
 from common_ci_utils.rpm_manager import install_rpm
 from common_ci_utils.service_manager import is_service_running, start_service
-from common_ci_utils.templating import Templating
-from common_ci_utils.url_utils import get_html_content
-from deployment.npm import NPM
+from deployment.ledger import StepLedger, fingerprint
+from deployment.nsfs_tuning import (
+    ENV_MARKER,
+    TUNED_RECORD,
+    compute_nsfs_tuning,
+    fs_class,
+    merge_env,
+    mount_of,
+    record_tuned_settings,
+)
+from deployment.tuning import (
+    GB,
+    compute_tuning,
+    detect_host,
+    explain,
+    tuning_values,
+)
 from framework import config, exceptions
+from framework.tracing import tracer
 
 log = logging.getLogger(__name__)
 
+# yum/dnf hold the RPM database lock for a whole transaction, concurrent
+# transactions of the same process are serialized instead of failing
+rpm_transaction_lock = threading.Lock()
+# .env lines db:create reads, the DB connection and the created system
+DB_CREATE_ENV_PREFIXES = ("POSTGRES_", "CREATE_SYS_")
+
 
 class Deployment(object):
     """
@@ -53,59 +66,172 @@ class Deployment(object):
         else:
             self.username = config.DEPLOYMENT["rpm_auth_username"]
             self.password = config.DEPLOYMENT["rpm_auth_password"]
-        if not self.rpm_url:
+        self._http = None
+        node_rel_path = "node/bin/node"
+        self.node_path = os.path.join(config.ENV_DATA["noobaa_core_dir"], node_rel_path)
+        self.ledger = StepLedger(
+            config.DEPLOYMENT["ledger_file"], force=config.DEPLOYMENT["ledger_force"]
+        )
+        self.rpm_path = None
+
+    @property
+    def http(self):
+        """
+        HTTP client shared by RPM resolution and download, created on first
+        use so deployments of an installed or local RPM don't load requests
+
+        Returns:
+            HTTPClient: pooled session with retries
+
+        """
+        if self._http is None:
+            from deployment.http_client import HTTPClient
+
+            self._http = HTTPClient(
+                auth=(self.username, self.password) if self.username else None,
+                pool_size=config.DEPLOYMENT["http_pool_size"],
+                retries=config.DEPLOYMENT["http_retries"],
+                backoff_factor=config.DEPLOYMENT["http_backoff_factor"],
+                backoff_jitter=config.DEPLOYMENT["http_backoff_jitter"],
+                timeout=(
+                    config.DEPLOYMENT["http_connect_timeout"],
+                    config.DEPLOYMENT["http_read_timeout"],
+                ),
+            )
+        return self._http
+
+    def resolve_rpm(self):
+        """
+        Resolves the latest RPM URL unless one was given
+        """
+        if self.rpm_url:
+            return
+        with tracer.span("rpm resolve", upstream=config.DEPLOYMENT["upstream"]):
             if config.DEPLOYMENT["upstream"]:
                 self.rpm_url = self.get_latest_upstream_rpm()
             else:
                 self.rpm_url = self.get_latest_downstream_rpm()
 
+    @property
+    def rpm_nevra(self):
+        """
+        NEVRA of the noobaa-core RPM, taken from the RPM file name
+
+        Returns:
+            str: e.g: noobaa-core-5.15.0-20231106.el9.x86_64
+
+        """
+        rpm_name = os.path.basename(self.rpm_url.split("?")[0])
+        return rpm_name[: -len(".rpm")] if rpm_name.endswith(".rpm") else rpm_name
 
     def install_rpm(self):
         """
-        Install rpm
+        Install rpm, skipped when the same RPM is already installed
+        """
+        self.resolve_rpm()
+        nevra = self.rpm_nevra
+        self.ledger.run(
+            "rpm install",
+            {"nevra": nevra},
+            self._download_and_install_rpm,
+            check=lambda: is_rpm_installed(nevra),
+        )
+
+    def prefetch_rpm(self):
+        """
+        Resolves and downloads the RPM ahead of installing it, nothing is
+        downloaded when the same RPM is already installed
+        """
+        self.resolve_rpm()
+        nevra = self.rpm_nevra
+        if self.ledger.is_done("rpm install", {"nevra": nevra}) and (
+            is_rpm_installed(nevra)
+        ):
+            return
+        with tracer.span("rpm download", url=self.rpm_url):
+            self.rpm_path = self.download_rpm()
+
+    def _download_and_install_rpm(self):
         """
-        rpm_path = download_rpm(self.rpm_url, self.username, self.password)
-        install_rpm(rpm_path=rpm_path)
+        Downloads the noobaa-core RPM unless it was prefetched and installs it
+        """
+        if self.rpm_path is None:
+            with tracer.span("rpm download", url=self.rpm_url):
+                self.rpm_path = self.download_rpm()
+        with rpm_transaction_lock, tracer.span("rpm install", path=self.rpm_path):
+            install_rpm(rpm_path=self.rpm_path)
+
+    def download_rpm(self):
+        """
+        Downloads the RPM, through the local RPM cache when it is enabled
+
+        Returns:
+            str: Path to RPM file
+
+        """
+        from deployment.downloader import RangedDownloader
+        from deployment.rpm_cache import RPMCache
+
+        checksum = config.DEPLOYMENT.get("rpm_sha256")
+        workers = config.DEPLOYMENT["rpm_download_workers"]
+        chunk_size_mb = config.DEPLOYMENT["rpm_download_chunk_size_mb"]
+        if config.DEPLOYMENT["rpm_cache_enabled"]:
+            rpm_cache = RPMCache(
+                cache_dir=config.DEPLOYMENT["rpm_cache_dir"],
+                max_size_mb=config.DEPLOYMENT["rpm_cache_max_size_mb"],
+                download_workers=workers,
+                chunk_size_mb=chunk_size_mb,
+                session=self.http,
+            )
+            return rpm_cache.fetch(
+                self.rpm_url, self.username, self.password, checksum=checksum
+            )
+        # stable path, so an interrupted download is resumed by the next run
+        rpm_path = os.path.join(
+            tempfile.gettempdir(), os.path.basename(self.rpm_url.split("?")[0])
+        )
+        downloader = RangedDownloader(
+            self.rpm_url,
+            rpm_path,
+            workers=workers,
+            chunk_size=chunk_size_mb * 1024 * 1024,
+            session=self.http,
+        )
+        downloader.download(checksum=checksum)
+        return rpm_path
 
 
     def get_latest_downstream_rpm(self):
         """
         Fetch latest downstream RPM for Noobaa SA
         """
-        # Parse the HTML content
+        from deployment.artifactory import ArtifactoryResolver
+
         url = urljoin(
             config.DEPLOYMENT["downstream_rpm_base_url"],
             config.DEPLOYMENT["downstream_rpm_artifactory_path"]
         )
-        html_content = get_html_content(url, self.username, self.password)
-        soup = BeautifulSoup(html_content, 'html.parser')
-        latest_package = None
-        latest_date = None
-
-        # Find all <a> tags within the <pre> tag
-        for a_tag in soup.find_all('pre')[1].find_all('a'):
-            href = a_tag.get('href')
-            text = a_tag.next_sibling.strip()
-            # Check if the href contains 'noobaa-core'
-            if 'noobaa-core' in href and f"el9" in href:
-                # Extract the date from the text
-                date_str = ' '.join(text.split()[:2])
-                date_obj = datetime.strptime(date_str, '%d-%b-%Y %H:%M')
-                # Update the latest package and date if this one is newer
-                if latest_date is None or date_obj > latest_date:
-                    latest_date = date_obj
-                    latest_package = href
-        rpm_base_url = urljoin(url, latest_package)
-        all_rpms_html = get_html_content(rpm_base_url, self.username, self.password)
-        soup = BeautifulSoup(all_rpms_html, 'html.parser')
-        regex = self.get_rpm_pattern()
-        rpm_name = soup.find('a', href=regex)
-        if rpm_name:
-            package_url = rpm_name['href']
-            return urljoin(rpm_base_url, package_url)
+        resolver = ArtifactoryResolver(
+            backend=config.DEPLOYMENT["downstream_rpm_index_backend"],
+            cache_dir=config.DEPLOYMENT["downstream_rpm_index_cache_dir"],
+            cache_ttl=config.DEPLOYMENT["downstream_rpm_index_cache_ttl"],
+            session=self.http,
+        )
+        # latest noobaa-core build folder for the RHEL version
+        rhel_version = f'el{config.DEPLOYMENT["rpm_rhel_version"]}'
+        rpm_base_url = resolver.latest_folder(
+            url, lambda name: "noobaa-core" in name and rhel_version in name
+        )
+        if not rpm_base_url:
+            raise exceptions.rpmNotFoundError(
+                f"noobaa-core build folder not found in URL: {url}!"
+            )
+        rpm_url = resolver.find_file(rpm_base_url, self.get_rpm_pattern())
+        if rpm_url:
+            return rpm_url
         else:
             raise exceptions.rpmNotFoundError(
-                f"noobaa-core RPM not found in URL: {package_url}!"
+                f"noobaa-core RPM not found in URL: {rpm_base_url}!"
             )
 
 
@@ -125,37 +251,34 @@ class Deployment(object):
     def get_latest_upstream_rpm(self):
         """
         Fetch latest upstream RPM for Noobaa SA
+
+        The bucket is listed page by page with ListObjectsV2, narrowed
+        server side by the literal prefix of rpm_pattern
         """
-        # Fetch XML content from the URL
+        import requests
+
+        from deployment.s3_listing import find_latest, list_objects_v2, literal_prefix
+
         s3_rpm_base_url = config.DEPLOYMENT["upstream_rpm_s3_base_url"]
-        response = requests.get(s3_rpm_base_url)
-
-        if response.status_code == 200:
-            root = ET.fromstring(response.content)
-            latest_file_name = ""
-            latest_file_date = datetime.min
-            regex = self.get_rpm_pattern()
-            query_base = "{http://s3.amazonaws.com/doc/2006-03-01/}"
-            for content in root.findall(f"{query_base}Contents"):
-                key = content.find(f"{query_base}Key").text
-                last_modified = content.find(f"{query_base}LastModified").text
-                if regex.match(key):
-                    last_modified_date = datetime.strptime(
-                        last_modified, "%Y-%m-%dT%H:%M:%S.%fZ"
-                    )
-                    if last_modified_date > latest_file_date:
-                        latest_file_name = key
-                        latest_file_date = last_modified_date
-            if latest_file_name:
-                log.info(f"Latest RPM: {latest_file_name}")
-                return f"{s3_rpm_base_url}/{latest_file_name}"
-            else:
-                raise exceptions.rpmNotFoundError(
-                    f"No RPM matching expression: {pattern}"
-                )
+        regex = self.get_rpm_pattern()
+        objects = list_objects_v2(
+            s3_rpm_base_url,
+            prefix=literal_prefix(regex.pattern),
+            start_after=config.DEPLOYMENT.get("upstream_rpm_start_after"),
+            session=self.http,
+        )
+        try:
+            latest_file_name = find_latest(objects, regex)
+        except requests.RequestException as ex:
+            raise exceptions.rpmNotFoundError(
+                f"Failed to list RPMs in the URL: {s3_rpm_base_url}: {ex}"
+            )
+        if latest_file_name:
+            log.info(f"Latest RPM: {latest_file_name}")
+            return f"{s3_rpm_base_url}/{latest_file_name}"
         else:
             raise exceptions.rpmNotFoundError(
-                f"Failed to fetch XML content from the URL: {s3_rpm_base_url}"
+                f"No RPM matching expression: {regex.pattern}"
             )
 
 
@@ -172,8 +295,6 @@ class DeploymentNSFS(Deployment):
         super().__init__()
         self.install_rpm()
         self.noobaa_nsfs_service = "noobaa"
-        node_rel_path = "node/bin/node"
-        self.node_path = os.path.join(config.ENV_DATA["noobaa_core_dir"], node_rel_path)
 
     def install_noobaa_sa_nsfs(self):
         """
@@ -186,19 +307,23 @@ class DeploymentNSFS(Deployment):
         cmd = f"mkdir -p {noobaa_conf_dir}"
         exec_cmd(cmd=cmd, use_sudo=True)
 
-        # create symbolic link
-        source_path = config.ENV_DATA["nsfs_env"]
-        target_path = os.path.join(noobaa_conf_dir, ".env")
-        cmd = f"ln -s {source_path} {target_path}"
-        exec_cmd(cmd=cmd, use_sudo=True)
-
-        # start noobaa_nsfs service
-        start_service(name=self.noobaa_nsfs_service, use_sudo=True)
-
-        # checks noobaa_nsfs service
-        is_nsfs_running = is_service_running(
-            name=self.noobaa_nsfs_service, use_sudo=True
-        )
+        if config.DEPLOYMENT["nsfs_tuning"]:
+            self.generate_nsfs_config()
+        else:
+            # create symbolic link
+            source_path = config.ENV_DATA["nsfs_env"]
+            target_path = os.path.join(noobaa_conf_dir, ".env")
+            cmd = f"ln -sfn {source_path} {target_path}"
+            exec_cmd(cmd=cmd, use_sudo=True)
+
+        with tracer.span("nsfs service start"):
+            # start noobaa_nsfs service
+            start_service(name=self.noobaa_nsfs_service, use_sudo=True)
+
+            # checks noobaa_nsfs service
+            is_nsfs_running = is_service_running(
+                name=self.noobaa_nsfs_service, use_sudo=True
+            )
         if not is_nsfs_running:
             raise ServiceRunningFailed("noobaa nsfs service is not running")
 
@@ -207,9 +332,92 @@ class DeploymentNSFS(Deployment):
         target_node_path = os.path.join(
             config.ENV_DATA["bin_dir"], config.ENV_DATA["node_cmd"]
         )
-        cmd = f"ln -s {source_node_path} {target_node_path}"
+        cmd = f"ln -sfn {source_node_path} {target_node_path}"
         exec_cmd(cmd=cmd, use_sudo=True)
 
+        if config.DEPLOYMENT["nsfs_provisioning"]["accounts"]:
+            self.provision_nsfs()
+
+    def generate_nsfs_config(self):
+        """
+        Generates the NSFS .env and config.json tuned for the host and the
+        filesystem of the exported paths. The .env keeps the content of the
+        RPM nsfs_env, settings of an existing config.json are kept unless
+        they are tuned.
+        """
+        paths = config.DEPLOYMENT.get("nsfs_exported_paths") or [
+            config.DEPLOYMENT["nsfs_provisioning"]["base_path"]
+        ]
+        mounts = [mount_of(path) for path in paths]
+        fs = fs_class([fs_type for _, fs_type in mounts])
+        host = detect_host(drives=len(paths))
+        tuning = compute_nsfs_tuning(
+            host, fs, overrides=config.DEPLOYMENT.get("nsfs_tuning_overrides")
+        )
+        reasons = "\n".join(
+            f"  {name} = {item.value}  # {item.reason}" for name, item in tuning.items()
+        )
+        log.info(
+            f"NSFS tuning for {host.cpus} CPUs, {host.memory // 2**20}MB memory "
+            f"and {fs} exported paths {mounts}:\n{reasons}"
+        )
+        values = tuning_values(tuning)
+        from common_ci_utils.templating import Templating
+
+        templating = Templating(base_path=config.ENV_DATA["template_dir"])
+
+        base_env = ""
+        if os.path.exists(config.ENV_DATA["nsfs_env"]):
+            with open(config.ENV_DATA["nsfs_env"]) as f:
+                base_env = merge_env(f.read(), values)
+        env_str = templating.render_template(
+            "nsfs_env.j2",
+            {"base_env": base_env, "marker": ENV_MARKER, "tuning": values},
+        )
+
+        conf_dir = config.ENV_DATA["noobaa_conf_dir"]
+        config_json = os.path.join(conf_dir, "config.json")
+        record_path = os.path.join(conf_dir, TUNED_RECORD)
+        existing = record = None
+        if os.path.exists(config_json):
+            with open(config_json) as f:
+                existing = json.load(f)
+        if os.path.exists(record_path):
+            with open(record_path) as f:
+                record = json.load(f)
+        # the teardown reverts the settings added or replaced here
+        record = record_tuned_settings(existing, values, record)
+        settings = {**(existing or {}), **values}
+        config_str = templating.render_template(
+            "nsfs_config.json.j2", {"settings": settings}
+        )
+        install_file(env_str, os.path.join(conf_dir, ".env"))
+        install_file(config_str, config_json)
+        install_file(json.dumps(record, indent=2), record_path)
+
+    def provision_nsfs(self):
+        """
+        Creates the NSFS accounts, buckets and their directories declared by
+        DEPLOYMENT["nsfs_provisioning"]
+
+        Returns:
+            dict: created, skipped and failed counts and the achieved rate
+
+        """
+        from deployment.nsfs_provisioning import NSFSProvisioner
+
+        cli = config.DEPLOYMENT["nsfs_cli"].format(
+            node=self.node_path, noobaa_core_dir=config.ENV_DATA["noobaa_core_dir"]
+        )
+        provisioner = NSFSProvisioner(
+            config.DEPLOYMENT["nsfs_provisioning"],
+            cli,
+            config.ENV_DATA["noobaa_conf_dir"],
+            workers=config.DEPLOYMENT["nsfs_provisioning_workers"],
+        )
+        with tracer.span("nsfs provisioning"):
+            return provisioner.run()
+
 
 class DeploymentDB(Deployment):
     """
@@ -218,102 +426,188 @@ class DeploymentDB(Deployment):
 
     def __init__(self):
         """
-        Initializes the necessary variables and install rpm needed for
-        Noobaa SA Deployment with DB
+        Initializes the necessary variables needed for Noobaa SA Deployment
+        with DB, the RPM is installed by install_noobaa_sa_db
         """
+        from common_ci_utils.host_info import get_ip_address
+
         super().__init__()
         self.postgres_repo = config.ENV_DATA["postgres_repo"]
         self.packages = config.ENV_DATA["db_packages"]
         self.postgresql_version = config.ENV_DATA["postgresql_version"]
         self.package = config.ENV_DATA["package_json"]
-        self.npm = NPM(self.package)
+        self.supervisor = self.create_supervisor()
         config.ENV_DATA["ip_address"] = get_ip_address()
-        self.install_rpm()
-        self.sleep = 10
+        # set up once the RPM providing package.json is installed
+        self.npm = None
+        self.health_checker = None
+        self.cluster_health = None
+        self.host, profile, tuning = host_tuning()
+        log.info(explain(self.host, profile, tuning))
+        self.tuning = tuning_values(tuning)
+        self.pg_tuning = None
+        self._drive_placement = None
 
     def install_noobaa_sa_db(self):
         """
         Installs Noobaa Standalone deployment with DB
         """
+        from deployment.transport import LocalTransport
+
         log.info("Installing Noobaa Standalone with DB")
 
-        # enable postgres repo
-        install_rpm(rpm_path=self.postgres_repo)
+        self.build_provisioning_graph().run()
+        self.setup_launcher()
 
-        # enable postgresql version to default
-        enable_postgresql_version(self.postgresql_version)
+        prepare_host(LocalTransport())
+        previous_dir = os.getcwd()
+        os.chdir(config.ENV_DATA["noobaa_core_dir"])
 
-        # install postgresql
-        install_rpm(packages=self.packages)
+        restore = config.DEPLOYMENT["restore_snapshot"]
+        restored = restore and self.restore_snapshot()
 
-        # set permissions
-        noobaa_core_dir = config.ENV_DATA["noobaa_core_dir"]
-        set_permissions(directory_path=noobaa_core_dir, permissions=777, use_sudo=True)
+        # initialize DB, start the services and backingstores
+        scheduler = self.build_service_graph()
+        scheduler.run()
 
-        # create storage directory
-        previous_dir = os.getcwd()
-        storage_dir = config.ENV_DATA["storage_dir"]
-        noobaa_core_dir = config.ENV_DATA["noobaa_core_dir"]
-        os.chdir(noobaa_core_dir)
-        create_directory(name=storage_dir)
+        # a missing snapshot is created for the next restore
+        if config.DEPLOYMENT["create_snapshot"] or (restore and not restored):
+            self.create_snapshot()
 
-        # set permissions to postgresql
-        postgresql_dir = config.ENV_DATA["postgresql_dir"]
-        set_permissions(directory_path=postgresql_dir, permissions=777, use_sudo=True)
+        # switch to original directory
+        os.chdir(previous_dir)
 
-        # initialize database directory
-        self.initialize_db()
+    def build_provisioning_graph(self):
+        """
+        Declares the package provisioning steps. In pipelined mode the
+        noobaa-core RPM is resolved and downloaded while the postgres packages
+        are installed, otherwise the steps run one after the other. The yum
+        transactions themselves are serialized by rpm_transaction_lock.
 
-        # run database
-        self.run_db()
+        Returns:
+            DependencyScheduler: scheduler holding the provisioning steps
 
-        # creates DB
-        self.create_db()
+        """
+        from deployment.scheduler import DependencyScheduler
+
+        pipelined = config.DEPLOYMENT["pipelined_provisioning"]
+        scheduler = DependencyScheduler(max_workers=2 if pipelined else 1)
+        postgres_inputs = {
+            "repo": self.postgres_repo,
+            "version": self.postgresql_version,
+            "packages": self.packages,
+        }
+        scheduler.add_step("rpm prefetched", self.prefetch_rpm)
+        scheduler.add_step("rpm installed", self.install_rpm, ["rpm prefetched"])
+        scheduler.add_step(
+            "postgres installed",
+            self.ledger.step(
+                "postgres install",
+                postgres_inputs,
+                self.install_postgres,
+                check=lambda: is_rpm_installed(" ".join(map(str, self.packages))),
+            ),
+            [] if pipelined else ["rpm installed"],
+        )
+        return scheduler
 
-        # create .env file
-        self.generate_env_file()
+    def install_postgres(self):
+        """
+        Installs postgresql packages
+        """
+        from common_ci_utils.postgres_utils import enable_postgresql_version
 
-        # create config-local.js
-        self.generate_config_local()
+        with tracer.span("postgres install", version=self.postgresql_version):
+            # enable postgres repo
+            with rpm_transaction_lock:
+                install_rpm(rpm_path=self.postgres_repo)
 
-        # run web service
-        self.run_web_service()
+            # enable postgresql version to default
+            with rpm_transaction_lock:
+                enable_postgresql_version(self.postgresql_version)
 
-        # run bg service
-        self.run_bg_service()
+            # install postgresql
+            with rpm_transaction_lock:
+                install_rpm(packages=self.packages)
 
-        # run hosted agents
-        self.run_hosted_agents()
+    def setup_launcher(self):
+        """
+        Sets up the package script launcher and the health checker using it,
+        package.json is installed by the RPM
+        """
+        from deployment.health import HealthChecker
+        from deployment.npm import NPM, DirectLauncher
 
-        # run s3 endpoint
-        self.run_s3_service()
+        if config.DEPLOYMENT["script_launcher"] == "direct":
+            self.npm = DirectLauncher(self.package, self.node_path)
+        else:
+            self.npm = NPM(self.package)
+        expected_nodes = config.DEPLOYMENT.get("health_expected_nodes")
+        if expected_nodes is None:
+            expected_nodes = config.DEPLOYMENT["backing_stores"]
+        self.health_checker = HealthChecker(
+            self.npm,
+            expected_nodes=expected_nodes,
+            min_capacity=config.DEPLOYMENT["health_min_capacity_gb"] * 2**30,
+            timeout=config.DEPLOYMENT["health_timeout"],
+            node=self.node_path,
+        )
 
-        # create backingstore drives
-        backing_stores = config.DEPLOYMENT["backing_stores"]
-        backing_store_drive_port = config.DEPLOYMENT["backing_store_drive_port"]
-        for num in range(backing_stores):
-            backing_store_path = config.DEPLOYMENT["backing_store_drive_path"]
-            backing_store_drive = os.path.join(
-                backing_store_path,
-                f'{config.DEPLOYMENT["backing_store_drive_prefix"]}{num}',
-            )
-            create_directory(name=backing_store_drive)
+    def build_service_graph(self):
+        """
+        Declares the DB mode provisioning steps as a dependency graph.
+        The DB and web service gate everything else, bg, hosted agents,
+        s3 endpoint and backingstores only depend on them and start in parallel.
 
-            # run backingstore
-            backing_store_drive_port += 1
-            self.run_backingstore(
-                backingstore_path=backing_store_drive, port=backing_store_drive_port
-            )
-            time.sleep(self.sleep)
+        Returns:
+            DependencyScheduler: scheduler holding all the steps
 
-        # check storage status
-        self.check_storage_status()
+        """
+        from deployment.scheduler import DependencyScheduler
 
-        # check node status
-        self.check_node_status()
+        scheduler = DependencyScheduler(
+            max_workers=config.DEPLOYMENT["scheduler_max_workers"]
+        )
+        # db:init and db:create are done once per RPM and env
+        scheduler.add_step(
+            "db initialized",
+            self.ledger.step("db init", self.db_init_inputs(), self.initialize_db),
+        )
+        scheduler.add_step("db tuned", self.tune_db, ["db initialized"])
+        scheduler.add_step("db ready", self.run_db, ["db tuned"])
+        scheduler.add_step("db tuning verified", self.verify_db_tuning, ["db ready"])
+        scheduler.add_step(
+            "db created",
+            self.ledger.step("db create", self.db_create_inputs(), self.create_db),
+            ["db ready"],
+        )
+        scheduler.add_step("env file", self.generate_env_file)
+        scheduler.add_step("config-local", self.generate_config_local)
+        scheduler.add_step(
+            "web ready",
+            self.run_web_service,
+            ["db created", "db tuning verified", "env file", "config-local"],
+        )
+        services = {
+            "bg ready": self.run_bg_service,
+            "hosted agents ready": self.run_hosted_agents,
+            "s3 ready": self.run_s3_service,
+        }
+        for name, func in services.items():
+            scheduler.add_step(name, func, ["web ready"])
+        service_steps = list(services)
+
+        scheduler.add_step(
+            "backingstores ready", self.run_backingstores, ["web ready"]
+        )
+        service_steps.append("backingstores ready")
 
-        # switch to original directory
-        os.chdir(previous_dir)
+        # status checks once everything is up
+        scheduler.add_step(
+            "storage status", self.check_storage_status, service_steps
+        )
+        scheduler.add_step("node status", self.check_node_status, ["storage status"])
+        return scheduler
 
     def initialize_db(self):
         """
@@ -322,13 +616,248 @@ class DeploymentDB(Deployment):
         log.info("Initializing DB")
         self.npm.run_script(cmd="db:init")
 
+    def db_init_inputs(self):
+        """
+        Returns:
+            dict: inputs of db:init, it is done once per RPM and postgres
+
+        """
+        return {"nevra": self.rpm_nevra, "postgresql_version": self.postgresql_version}
+
+    def db_create_inputs(self):
+        """
+        Returns:
+            dict: inputs of db:create, it is done once per RPM and DB
+                connection, the tuning and addresses in the .env don't
+                create the DB again
+
+        """
+        db_env = [
+            line
+            for line in self.render_env().splitlines()
+            if line.startswith(DB_CREATE_ENV_PREFIXES)
+        ]
+        # the lines hold the DB and system credentials
+        return {"nevra": self.rpm_nevra, "env": fingerprint(db_env)}
+
+    def postgres_data_dir(self):
+        """
+        Returns:
+            str: PostgreSQL data directory
+
+        Raises:
+            PostgresTuningFailed: In case the data directory is not found
+
+        """
+        from deployment.pg_tuning import find_data_dir
+
+        data_dir = config.ENV_DATA.get("postgres_data_dir") or find_data_dir(
+            self.package
+        )
+        if not data_dir:
+            raise exceptions.PostgresTuningFailed(
+                "PostgreSQL data directory not found in the db:init script, "
+                "set ENV_DATA postgres_data_dir"
+            )
+        return data_dir
+
+    def create_supervisor(self):
+        """
+        Returns:
+            Supervisor: supervisor of the DB mode services
+
+        """
+        from deployment.supervisor import Supervisor
+
+        return Supervisor(
+            log_dir=config.DEPLOYMENT["service_log_dir"],
+            max_log_bytes=config.DEPLOYMENT["service_log_max_mb"] * 1024 * 1024,
+            log_backups=config.DEPLOYMENT["service_log_backups"],
+            max_restarts=config.DEPLOYMENT["service_max_restarts"],
+            capture=config.DEPLOYMENT["supervise_services"],
+        )
+
+    def snapshot_store(self):
+        """
+        Returns:
+            tuple: (SnapshotStore, snapshot key of this RPM and config)
+
+        """
+        from deployment.snapshot import SnapshotStore, snapshot_key
+
+        store = SnapshotStore(
+            config.DEPLOYMENT["snapshot_dir"],
+            keep=config.DEPLOYMENT["snapshot_keep"],
+            timeout=config.DEPLOYMENT["snapshot_timeout"],
+        )
+        config_hash = fingerprint(
+            {
+                "env": self.env_hash(),
+                "postgresql_version": self.postgresql_version,
+                "paths": self.snapshot_paths(),
+                "backing_stores": config.DEPLOYMENT["backing_stores"],
+                "drive_prefix": config.DEPLOYMENT["backing_store_drive_prefix"],
+            }
+        )
+        return store, snapshot_key(self.rpm_nevra, config_hash)
+
+    def snapshot_paths(self):
+        """
+        Returns:
+            list: paths holding the bootstrapped state
+
+        """
+        return [
+            config.ENV_DATA["storage_dir"],
+            self.postgres_data_dir(),
+            *self.backing_store_dirs(),
+        ]
+
+    def restore_snapshot(self):
+        """
+        Restores the snapshot of this RPM and config, db:init and db:create
+        are marked done so the deployment continues with starting services
+
+        Returns:
+            bool: True if a snapshot was restored
+
+        Raises:
+            SnapshotPathsInUse: In case PostgreSQL is running, it would keep
+                writing the data directory being replaced
+
+        """
+        from deployment.readiness import build_probe
+
+        store, key = self.snapshot_store()
+        manifest = store.find(key)
+        if manifest is None:
+            log.info(f"No snapshot {key} to restore, bootstrapping")
+            return False
+        spec = config.DEPLOYMENT["readiness_probes"]["db"]
+        if build_probe(spec).check():
+            raise exceptions.SnapshotPathsInUse(
+                f"PostgreSQL is running on port {spec['port']}, stop it to "
+                f"restore snapshot {key}"
+            )
+        with tracer.span("snapshot restore", key=key):
+            store.restore(manifest)
+        self.ledger.mark_done("db init", self.db_init_inputs())
+        self.ledger.mark_done("db create", self.db_create_inputs())
+        return True
+
+    def create_snapshot(self):
+        """
+        Stops the services for a consistent copy, snapshots the bootstrapped
+        state and starts the services again
+
+        Raises:
+            SnapshotPathsInUse: In case a foreground supervisor of another run
+                keeps the services running, or a process still uses the
+                snapshot paths after the services are stopped
+
+        """
+        from deployment.snapshot import processes_using
+        from deployment.supervisor import (
+            SUPERVISOR_PID_FILE,
+            read_pid_file,
+            stop_recorded_services,
+        )
+
+        store, key = self.snapshot_store()
+        paths = self.snapshot_paths()
+        log_dir = self.supervisor.log_dir
+        other = read_pid_file(os.path.join(log_dir, SUPERVISOR_PID_FILE))
+        if other is not None:
+            raise exceptions.SnapshotPathsInUse(
+                f"Supervisor with pid {other} keeps the services running, "
+                "not snapshotting"
+            )
+        self.supervisor.stop_all()
+        # services which were already running were started by an earlier run,
+        # they are stopped through their pid files
+        stop_recorded_services(log_dir)
+        try:
+            pids = processes_using(paths)
+            if pids:
+                raise exceptions.SnapshotPathsInUse(
+                    f"Processes {pids} still use {paths}, not snapshotting"
+                )
+            with tracer.span("snapshot create", key=key):
+                store.create(key, paths, metadata={"nevra": self.rpm_nevra})
+        finally:
+            self.supervisor = self.create_supervisor()
+            self.build_service_graph().run()
+
+    def tune_db(self):
+        """
+        Writes the PostgreSQL settings derived from the host resources as
+        a config include of the data directory
+        """
+        from deployment.pg_tuning import compute_pg_tuning, is_rotational, write_conf
+
+        if not config.DEPLOYMENT["postgres_tuning"]:
+            log.info("PostgreSQL tuning is disabled")
+            self.pg_tuning = None
+            return
+        data_dir = self.postgres_data_dir()
+        self.pg_tuning = compute_pg_tuning(
+            self.host,
+            endpoint_forks=self.tuning["ENDPOINT_FORKS"],
+            memory_fraction=config.DEPLOYMENT["postgres_memory_fraction"],
+            clients_per_process=config.DEPLOYMENT["postgres_clients_per_process"],
+            ssd=not is_rotational(data_dir),
+        )
+        for name, item in self.pg_tuning.items():
+            log.info(f"PostgreSQL {name} = {item.value} ({item.reason})")
+        write_conf(data_dir, self.pg_tuning)
+
+    def verify_db_tuning(self):
+        """
+        Verifies that the PostgreSQL settings took effect on the running DB
+
+        Raises:
+            PostgresTuningFailed: In case the settings can't be read or any
+                of them has a different value
+
+        """
+        from deployment.pg_tuning import mismatches
+
+        if not self.pg_tuning:
+            return
+        names = ",".join(f"'{name}'" for name in self.pg_tuning)
+        query = (
+            "SELECT name, current_setting(name) "
+            f"FROM unnest(ARRAY[{names}]) AS name"
+        )
+        port = config.DEPLOYMENT["readiness_probes"]["db"]["port"]
+        cmd = f'psql -h localhost -p {port} -d postgres -At -F "|" -c "{query}"'
+        if config.ENV_DATA.get("postgres_user"):
+            cmd += f' -U {config.ENV_DATA["postgres_user"]}'
+        completed_process = exec_cmd(cmd=cmd)
+        if completed_process.returncode != 0:
+            raise exceptions.PostgresTuningFailed(
+                f"Failed to read PostgreSQL settings: "
+                f"{completed_process.stderr.decode()}"
+            )
+        current = dict(
+            line.split("|", 1)
+            for line in completed_process.stdout.decode().splitlines()
+            if "|" in line
+        )
+        wrong = mismatches(self.pg_tuning, current)
+        if wrong:
+            raise exceptions.PostgresTuningFailed(
+                "PostgreSQL settings didn't take effect, a DB started before "
+                f"the tuning needs a restart: {'; '.join(wrong)}"
+            )
+        log.info("PostgreSQL tuning verified")
+
     def run_db(self):
         """
         Runs the database
         """
         log.info("starting the DB")
-        self.npm.run_script("db", wait=False)
-        time.sleep(self.sleep)
+        self.run_service("db", "db")
 
     def create_db(self):
         """
@@ -336,53 +865,214 @@ class DeploymentDB(Deployment):
         """
         log.info("Creating DB, users and permissions")
         self.npm.run_script(cmd="db:create")
-        time.sleep(self.sleep)
 
     def run_web_service(self):
         """
         Runs the web service
         """
         log.info("starting the web service")
-        self.npm.run_script("web", wait=False)
-        time.sleep(self.sleep)
+        self.run_service("web", "web")
 
     def run_bg_service(self):
         """
         Runs the bg service
         """
         log.info("starting the bg service")
-        self.npm.run_script("bg", wait=False)
-        time.sleep(self.sleep)
+        self.run_service("bg", "bg")
 
     def run_s3_service(self):
         """
         Runs the bg service
         """
         log.info("starting the s3 endpoint service")
-        self.npm.run_script("s3", wait=False)
-        time.sleep(self.sleep)
+        self.run_service("s3", "s3")
 
     def run_hosted_agents(self):
         """
         Runs hosted agent service
         """
         log.info("starting the hosted agent service")
-        self.npm.run_script("hosted_agents", wait=False)
-        time.sleep(self.sleep)
+        self.run_service("hosted_agents", "hosted_agents")
+
+    def drive_placement(self):
+        """
+        Plans the backingstore drives over DEPLOYMENT backing_store_targets,
+        once per deployment
+
+        Returns:
+            list: (path, NUMA node) of every drive, None when all drives are
+                under backing_store_drive_path
+
+        Raises:
+            DrivePlacementError: In case the targets can't be resolved
+
+        """
+        from deployment.placement import resolve_targets, spread_drives
+
+        targets = config.DEPLOYMENT["backing_store_targets"]
+        if targets and self._drive_placement is None:
+            resolved = resolve_targets(
+                targets,
+                config.DEPLOYMENT["backing_store_subdir"],
+                min_free=config.DEPLOYMENT["backing_store_min_free_gb"] * GB,
+            )
+            self._drive_placement = spread_drives(
+                resolved,
+                config.DEPLOYMENT["backing_stores"],
+                config.DEPLOYMENT["backing_store_drive_prefix"],
+            )
+        return self._drive_placement
+
+    def backing_store_dirs(self):
+        """
+        Returns:
+            list: directories holding the backingstore drives
+
+        """
+        placement = self.drive_placement()
+        if not placement:
+            return [config.DEPLOYMENT["backing_store_drive_path"]]
+        return sorted({os.path.dirname(path) for path, _ in placement})
+
+    def run_backingstores(self):
+        """
+        Creates all backingstore drives, launches their agents concurrently
+        and waits till all of them are ready
+
+        Returns:
+            list: BackingStoreDrive for every drive
+
+        """
+        from deployment.backingstore import BackingStoreLauncher
+
+        probes = config.DEPLOYMENT["readiness_probes"]
+        reserved_ports = [spec["port"] for spec in probes.values() if "port" in spec]
+        launcher = BackingStoreLauncher(
+            run_backingstore=partial(self.run_backingstore, wait=False),
+            drive_path=config.DEPLOYMENT["backing_store_drive_path"],
+            drive_prefix=config.DEPLOYMENT["backing_store_drive_prefix"],
+            count=config.DEPLOYMENT["backing_stores"],
+            base_port=config.DEPLOYMENT["backing_store_drive_port"],
+            parallelism=config.DEPLOYMENT["backing_store_parallelism"],
+            reserved_ports=reserved_ports,
+            placement=self.drive_placement(),
+            stop_backingstore=self.stop_backingstore,
+        )
+        spec = probes["backingstore"]
+        inputs = {
+            "nevra": self.rpm_nevra,
+            "pinning": config.DEPLOYMENT["backing_store_pinning"],
+        }
+        # agents of a previous run keep the ports of their drives, only dead
+        # ones are relaunched, agents of another RPM or pinning are replaced
+        previous = self.ledger.outputs("backingstores") or {}
+        if not self.ledger.is_done("backingstores", inputs):
+            for port in previous.values():
+                self.stop_backingstore(port)
+            previous = {}
+        drives = launcher.run(
+            spec, previous=previous, **self._readiness_wait_kwargs(spec)
+        )
+        self.ledger.mark_done(
+            "backingstores",
+            inputs,
+            outputs={drive.path: drive.port for drive in drives},
+        )
+        return drives
+
+    def stop_backingstore(self, port):
+        """
+        Stops the backingstore agent of a previous run by its pid file
+
+        Args:
+            port (int): port of the agent
+
+        """
+        from deployment.supervisor import stop_recorded_services
+
+        stop_recorded_services(
+            config.DEPLOYMENT["service_log_dir"], names=[f"backingstore-{port}"]
+        )
 
-    def run_backingstore(self, backingstore_path, port):
+    def run_backingstore(self, backingstore_path, port, wait=True, numa_node=None):
         """
         Runs the backingstore
 
         Args:
             backingstore_path (str): path to backingstore drive
             port (int): Port number to start the backingstore drive
+            wait (bool): If True, waits till the backingstore is ready
+            numa_node (int): NUMA node of the drive's device, the agent is
+                pinned to it with DEPLOYMENT backing_store_pinning
 
         """
+        from deployment.placement import pin_command
+
         log.info(f"running backing store '{backingstore_path}' at port {port}")
         args = "--", f"{backingstore_path}", "--port", f"{port}"
         script_name = "backingstore"
-        self.npm.run_script(cmd=script_name, args=args, wait=False)
+        prefix = pin_command(config.DEPLOYMENT["backing_store_pinning"], numa_node)
+        if prefix:
+            log.info(f"pinning backing store at port {port}: {' '.join(prefix)}")
+        self.supervisor.start(
+            f"backingstore-{port}",
+            partial(
+                self.npm.run_script,
+                cmd=script_name,
+                args=args,
+                wait=False,
+                prefix=prefix,
+            ),
+        )
+        if wait:
+            self.wait_for_service("backingstore", port=port)
+
+    def run_service(self, service, script):
+        """
+        Runs the npm script of a service and waits till it is ready,
+        a service which is already running is not started again
+
+        Args:
+            service (str): service name as in DEPLOYMENT["readiness_probes"]
+            script (str): npm script which runs the service
+
+        """
+        from deployment.readiness import build_probe
+
+        spec = config.DEPLOYMENT["readiness_probes"][service]
+        if build_probe(spec).check():
+            log.info(f"{service} is already running, not starting it again")
+            return
+        self.supervisor.start(
+            service, partial(self.npm.run_script, script, wait=False)
+        )
+        self.wait_for_service(service)
+
+    def wait_for_service(self, service, **overrides):
+        """
+        Waits till the service passes its readiness probe
+
+        Args:
+            service (str): service name as in DEPLOYMENT["readiness_probes"]
+            overrides: values which override the probe spec, e.g: port=9991
+
+        Raises:
+            ReadinessTimeout: In case the service is not ready in time
+
+        """
+        from deployment.readiness import build_probe, wait_for_ready
+
+        spec = config.DEPLOYMENT["readiness_probes"][service]
+        probe = build_probe(spec, **overrides)
+        wait_for_ready(probe, **self._readiness_wait_kwargs(spec))
+
+    @staticmethod
+    def _readiness_wait_kwargs(spec):
+        return {
+            "timeout": spec.get("timeout", config.DEPLOYMENT["readiness_timeout"]),
+            "interval": config.DEPLOYMENT["readiness_interval"],
+            "max_interval": config.DEPLOYMENT["readiness_max_interval"],
+        }
 
     def check_storage_status(self):
         """
@@ -393,39 +1083,54 @@ class DeploymentDB(Deployment):
 
         """
         log.info("checking storage status")
-        script_name = "api"
-        args = "--", "node", "sync_monitor_to_store"
-        op = self.npm.run_script(cmd=script_name, args=args)
-        if op != 0:
-            raise StorageStatusCheckFailed
-        else:
-            log.info("Storage Check successfully passed")
+        self.health_checker.sync_monitor()
+        log.info("Storage Check successfully passed")
 
     def check_node_status(self):
         """
-        Checks aggregate node status
+        Waits till the expected nodes are online with the expected capacity
+
+        Returns:
+            ClusterHealth: converged cluster health snapshot
 
         Raises:
-            StorageCheckFailed: In case storage check failed
+            AggregateNodeStatusCheckFailed: In case the cluster didn't converge
 
         """
         log.info("checking aggregate node status")
-        script_name = "api"
-        args = "--", "node", "aggregate_nodes", "{}"
-        op = self.npm.run_script(cmd=script_name, args=args)
-        if op != 0:
-            raise AggregateNodeStatusCheckFailed
-        else:
-            log.info("Aggregate node status check successfully passed")
+        self.cluster_health = self.health_checker.wait_converged()
+        log.info("Aggregate node status check successfully passed")
+        return self.cluster_health
+
+    def render_env(self):
+        """
+        Renders the .env file content
+
+        Returns:
+            str: .env file content
+
+        """
+        from common_ci_utils.templating import Templating
+
+        templating = Templating(base_path=config.ENV_DATA["template_dir"])
+        env_template = "env.j2"
+        data = {**config.ENV_DATA, "tuning": self.tuning}
+        return templating.render_template(env_template, data)
+
+    def env_hash(self):
+        """
+        Returns:
+            str: sha256 of the rendered .env file
+
+        """
+        return hashlib.sha256(self.render_env().encode()).hexdigest()
 
     def generate_env_file(self):
         """
         Creates .env file
         """
         log.info("creating .env file")
-        templating = Templating(base_path=config.ENV_DATA["template_dir"])
-        env_template = "env.j2"
-        env_str = templating.render_template(env_template, config.ENV_DATA)
+        env_str = self.render_env()
         env_file = config.ENV_DATA["env_file"]
         cmd = f"touch {env_file}"
         exec_cmd(cmd=cmd, use_sudo=True)
@@ -439,18 +1144,112 @@ class DeploymentDB(Deployment):
         Creates config-local
         """
         log.info("creating config-local.js file")
-        config_local = os.path.join(config.ENV_DATA["template_dir"], "config-local.js")
-        cmd = f'cp {config_local} {config.ENV_DATA["config_local"]}'
-        exec_cmd(cmd=cmd, use_sudo=True)
+        from common_ci_utils.templating import Templating
+
+        templating = Templating(base_path=config.ENV_DATA["template_dir"])
+        config_local_template = "config-local.js.j2"
+        config_local_str = templating.render_template(
+            config_local_template, {**config.ENV_DATA, "tuning": self.tuning}
+        )
+        config_local = config.ENV_DATA["config_local"]
+        exec_cmd(cmd=f"touch {config_local}", use_sudo=True)
+        exec_cmd(cmd=f"chmod 666 {config_local}", use_sudo=True)
+        with open(config_local, "w") as f:
+            f.write(config_local_str)
+
+
+def host_tuning():
+    """
+    Computes the tuning values for this host from the configured profile
+
+    Returns:
+        tuple: (HostInfo, profile name, OrderedDict of TuningValue)
+
+    """
+    host = detect_host(drives=config.DEPLOYMENT["backing_stores"])
+    profile = config.DEPLOYMENT["tuning_profile"]
+    tuning = compute_tuning(
+        host, profile, overrides=config.DEPLOYMENT.get("tuning_overrides")
+    )
+    return host, profile, tuning
+
+
+def prepare_host(transport, postgres=True):
+    """
+    Prepares a host for db:init and the services: the noobaa-core and
+    PostgreSQL socket directories are opened up and the storage directory
+    is created
+
+    Args:
+        transport (Transport): transport of the host
+        postgres (bool): If False, the host doesn't run PostgreSQL
+
+    """
+    noobaa_core_dir = config.ENV_DATA["noobaa_core_dir"]
+    # a relative storage_dir is relative to noobaa-core
+    storage_dir = os.path.join(noobaa_core_dir, config.ENV_DATA["storage_dir"])
+    transport.run(f"sudo chmod 777 {noobaa_core_dir}")
+    transport.run(f"mkdir -p -m 777 {storage_dir}")
+    if postgres:
+        transport.run(f"sudo chmod 777 {config.ENV_DATA['postgresql_dir']}")
+
+
+def install_file(content, path, mode="644"):
+    """
+    Writes a file owned by root, a symbolic link at the path is replaced
+
+    Args:
+        content (str): file content
+        path (str): path of the file
+        mode (str): octal permissions
+
+    """
+    with tempfile.NamedTemporaryFile("w", delete=False) as f:
+        f.write(content)
+    try:
+        exec_cmd(cmd=f"rm -f {path}", use_sudo=True)
+        exec_cmd(cmd=f"install -m {mode} {f.name} {path}", use_sudo=True)
+    finally:
+        os.remove(f.name)
+    log.info(f"{path} written")
+
+
+def is_rpm_installed(name):
+    """
+    Checks whether RPMs are installed
+
+    Args:
+        name (str): space separated RPM names or NEVRAs
+
+    Returns:
+        bool: True if all the RPMs are installed
+
+    """
+    return exec_cmd(cmd=f"rpm -q {name}").returncode == 0
 
 
 def deploy():
     """
     Deploys NooBaa as a Standalone
+
+    Returns:
+        Supervisor: supervisor of the started services with DB,
+            None with NSFS (services are run by systemd)
+
     """
+    supervisor = None
     if config.ENV_DATA["db_installation"]:
-        dep = DeploymentDB()
-        dep.install_noobaa_sa_db()
+        with tracer.span("deploy db"):
+            dep = DeploymentDB()
+            try:
+                dep.install_noobaa_sa_db()
+            except Exception:
+                log.error("Deployment failed, stopping the started services")
+                dep.supervisor.stop_all()
+                raise
+            supervisor = dep.supervisor
     if config.ENV_DATA["nsfs_installation"]:
-        dep = DeploymentNSFS()
-        dep.install_noobaa_sa_nsfs()
+        with tracer.span("deploy nsfs"):
+            dep = DeploymentNSFS()
+            dep.install_noobaa_sa_nsfs()
+    return supervisor
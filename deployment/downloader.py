@@ -0,0 +1,237 @@
+"""
+This module downloads large files (RPMs) with parallel HTTP Range requests.
+Ranges are written straight into a preallocated file at their offsets and
+finished ranges are recorded in a sidecar progress file, so an interrupted
+download resumes where it stopped. Servers without range support, or
+which answer range requests with the whole file, are downloaded with a
+single stream.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from framework import exceptions
+
+log = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class RangedDownloader(object):
+    """
+    Parallel, resumable downloader
+    """
+
+    def __init__(
+        self,
+        url,
+        dest,
+        auth=None,
+        workers=4,
+        chunk_size=16 * 1024 * 1024,
+        session=None,
+    ):
+        """
+        Args:
+            url (str): URL to download
+            dest (str): path of the downloaded file
+            auth (tuple): (username, password) when authentication is required
+            workers (int): number of ranges fetched at the same time
+            chunk_size (int): size of a single range in bytes
+            session (requests.Session): session used for the requests
+
+        """
+        self.url = url
+        self.dest = dest
+        self.auth = auth
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.session = session or requests.Session()
+        self.progress_file = f"{dest}.progress"
+        self._lock = threading.Lock()
+
+    def probe(self):
+        """
+        Finds out the size of the file and whether the server supports ranges
+
+        Returns:
+            tuple: (size or None, validator or None, supports ranges)
+
+        """
+        response = self.session.head(self.url, auth=self.auth, allow_redirects=True)
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        validator = response.headers.get("ETag") or response.headers.get(
+            "Last-Modified"
+        )
+        ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return (int(size) if size else None), validator, ranges
+
+    def download(self, checksum=None):
+        """
+        Downloads the file
+
+        Args:
+            checksum (str): expected sha256 of the file (optional)
+
+        Returns:
+            str: sha256 of the downloaded file
+
+        Raises:
+            RPMChecksumMismatch: In case the file doesn't match the checksum
+            requests.RequestException: In case the download failed
+
+        """
+        size, validator, ranges = self.probe()
+        if self.workers > 1 and ranges and size and size > self.chunk_size:
+            try:
+                self._download_ranges(size, validator)
+            except exceptions.RangesNotSupported as e:
+                log.warning(f"{e}, downloading it with a single stream")
+                self._download_stream()
+        else:
+            log.info(f"Downloading {self.url} with a single stream")
+            self._download_stream()
+        return self.verify(size, checksum)
+
+    def _load_progress(self, size, validator):
+        """
+        Loads finished ranges of a previous download of the same file
+
+        Returns:
+            set: indexes of finished ranges
+
+        """
+        if not (os.path.exists(self.progress_file) and os.path.exists(self.dest)):
+            return set()
+        with open(self.progress_file) as f:
+            progress = json.load(f)
+        current = {
+            "url": self.url,
+            "size": size,
+            "validator": validator,
+            "chunk_size": self.chunk_size,
+        }
+        if validator and all(progress.get(k) == v for k, v in current.items()):
+            return set(progress["done"])
+        log.info(f"{self.url} changed since the interrupted download, restarting")
+        return set()
+
+    def _save_progress(self, size, validator, done):
+        progress = {
+            "url": self.url,
+            "size": size,
+            "validator": validator,
+            "chunk_size": self.chunk_size,
+            "done": sorted(done),
+        }
+        tmp_file = f"{self.progress_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(progress, f)
+        os.replace(tmp_file, self.progress_file)
+
+    def _download_ranges(self, size, validator):
+        """
+        Fetches all missing ranges concurrently into the preallocated file
+        """
+        done = self._load_progress(size, validator)
+        chunks = range((size + self.chunk_size - 1) // self.chunk_size)
+        missing = [index for index in chunks if index not in done]
+        log.info(
+            f"Downloading {self.url} ({size} bytes) in {len(missing)} of "
+            f"{len(chunks)} ranges with {self.workers} workers"
+        )
+        fd = os.open(self.dest, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._save_progress(size, validator, done)
+
+            def _fetch(index):
+                start = index * self.chunk_size
+                end = min(start + self.chunk_size, size) - 1
+                headers = {"Range": f"bytes={start}-{end}"}
+                if validator:
+                    headers["If-Range"] = validator
+                with self.session.get(
+                    self.url, auth=self.auth, headers=headers, stream=True
+                ) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise exceptions.RangesNotSupported(
+                            f"{self.url} answered range {start}-{end} with "
+                            f"{response.status_code}"
+                        )
+                    offset = start
+                    for data in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                        os.pwrite(fd, data, offset)
+                        offset += len(data)
+                if offset != end + 1:
+                    raise requests.RequestException(
+                        f"Range {start}-{end} of {self.url} is incomplete"
+                    )
+                with self._lock:
+                    done.add(index)
+                    self._save_progress(size, validator, done)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(_fetch, i) for i in missing]
+                try:
+                    for future in futures:
+                        future.result()
+                except Exception:
+                    # ranges not started yet would fail the same way
+                    for future in futures:
+                        future.cancel()
+                    raise
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _download_stream(self):
+        """
+        Downloads the file with a single stream
+        """
+        with self.session.get(self.url, auth=self.auth, stream=True) as response:
+            response.raise_for_status()
+            with open(self.dest, "wb") as f:
+                for data in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    f.write(data)
+
+    def verify(self, size=None, checksum=None):
+        """
+        Verifies size and checksum of the downloaded file and drops the
+        progress file
+
+        Args:
+            size (int): expected size in bytes (optional)
+            checksum (str): expected sha256 (optional)
+
+        Returns:
+            str: sha256 of the downloaded file
+
+        """
+        actual_size = os.path.getsize(self.dest)
+        if size is not None and actual_size != size:
+            raise requests.RequestException(
+                f"Downloaded {actual_size} bytes of {self.url}, expected {size}"
+            )
+        digest = hashlib.sha256()
+        with open(self.dest, "rb") as f:
+            for data in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                digest.update(data)
+        sha256 = digest.hexdigest()
+        if checksum and checksum.lower() != sha256:
+            os.remove(self.dest)
+            raise exceptions.RPMChecksumMismatch(
+                f"sha256 of {self.url} is {sha256}, expected {checksum}"
+            )
+        if os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
+        log.info(f"Downloaded {self.url} to {self.dest} ({actual_size} bytes)")
+        return sha256
@@ -0,0 +1,471 @@
+"""
+This module checks that the NooBaa cluster converged after deployment.
+The management API is polled till the expected number of storage nodes
+is online with the expected capacity, and the outcome is kept as a
+structured health snapshot.
+
+The calls go through one node process holding an authenticated RPC client,
+so the node start, connection and authentication are paid once for the
+whole wait and not on every poll. When that client can't start, e.g: an
+RPM without the RPC modules, every call falls back to a new `api` package
+script process.
+"""
+
+import collections
+import json
+import logging
+import queue
+import subprocess
+import threading
+import time
+
+from common_ci_utils.exceptions import (
+    AggregateNodeStatusCheckFailed,
+    StorageStatusCheckFailed,
+)
+
+log = logging.getLogger(__name__)
+
+PETABYTE = 2**50
+
+# prefix of the reply lines of the API client, the RPC modules log to stdout
+REPLY_MARKER = "@@noobaa-api-reply "
+
+# reads one {"api", "method", "params"} request per stdin line, answers each
+# with a marker line holding {"reply"} or {"error"}, exits when stdin closes
+API_CLIENT_SCRIPT = """
+require('./src/util/dotenv').load();
+const readline = require('readline');
+const api = require('./src/api');
+const client = api.new_rpc().new_client();
+let auth;
+function authenticate() {
+    auth = auth || client.create_auth_token({
+        email: process.env.CREATE_SYS_EMAIL,
+        password: process.env.CREATE_SYS_PASSWD,
+        system: process.env.CREATE_SYS_NAME,
+    }).catch(err => {
+        auth = undefined;
+        throw err;
+    });
+    return auth;
+}
+function answer(res) {
+    process.stdout.write('\\n%s' + JSON.stringify(res) + '\\n');
+}
+readline.createInterface({ input: process.stdin })
+    .on('line', async line => {
+        try {
+            const req = JSON.parse(line);
+            await authenticate();
+            answer({ reply: await client[req.api][req.method](req.params) });
+        } catch (err) {
+            answer({ error: String((err && err.message) || err) });
+        }
+    })
+    .on('close', () => process.exit(0));
+""" % REPLY_MARKER
+
+
+def parse_rpc_output(output):
+    """
+    Parses the JSON reply of an api call, skipping log lines printed
+    before it
+
+    Args:
+        output (str): output of the api script
+
+    Returns:
+        object: the parsed reply, None if the call has no reply
+
+    Raises:
+        ValueError: In case the output has no parsable JSON reply
+
+    """
+    decoder = json.JSONDecoder()
+    for index, char in enumerate(output):
+        if char in "{[" and (index == 0 or output[index - 1] == "\n"):
+            try:
+                return decoder.raw_decode(output, index)[0]
+            except ValueError:
+                continue
+    if output.strip() in ("", "undefined", "null"):
+        return None
+    raise ValueError(f"No JSON reply in api output: {output[-500:]!r}")
+
+
+def to_bytes(value):
+    """
+    Converts a NooBaa size to bytes
+
+    Args:
+        value (object): number, numeric string or {"peta": p, "n": n}
+
+    Returns:
+        int: size in bytes
+
+    """
+    if isinstance(value, dict):
+        return value.get("peta", 0) * PETABYTE + value.get("n", 0)
+    return int(value or 0)
+
+
+class ClusterHealth(object):
+    """
+    Snapshot of the cluster nodes and storage
+    """
+
+    def __init__(self, total_nodes, online_nodes, storage, raw):
+        """
+        Args:
+            total_nodes (int): number of registered nodes
+            online_nodes (int): number of online nodes
+            storage (dict): total, free and used bytes
+            raw (dict): aggregate_nodes reply
+
+        """
+        self.total_nodes = total_nodes
+        self.online_nodes = online_nodes
+        self.storage = storage
+        self.raw = raw
+        self.converged = False
+        self.elapsed = None
+
+    @classmethod
+    def from_aggregate(cls, reply):
+        """
+        Builds the snapshot from an aggregate_nodes reply, the reply is
+        either a single aggregate or aggregates by group
+
+        Args:
+            reply (dict): aggregate_nodes reply
+
+        Returns:
+            ClusterHealth: the snapshot
+
+        """
+        groups = [reply] if "nodes" in reply else list(reply.values())
+        total_nodes = online_nodes = 0
+        storage = {"total": 0, "free": 0, "used": 0}
+        for group in groups:
+            nodes = group.get("nodes", {})
+            total_nodes += int(nodes.get("count", 0))
+            online_nodes += int(nodes.get("online", 0))
+            for key in storage:
+                storage[key] += to_bytes(group.get("storage", {}).get(key))
+        return cls(total_nodes, online_nodes, storage, reply)
+
+    def to_dict(self):
+        return {
+            "total_nodes": self.total_nodes,
+            "online_nodes": self.online_nodes,
+            "storage": self.storage,
+            "converged": self.converged,
+            "elapsed": self.elapsed,
+        }
+
+    def __str__(self):
+        return (
+            f"{self.online_nodes}/{self.total_nodes} nodes online, "
+            f"{self.storage['total'] / 2**30:.1f}GB total, "
+            f"{self.storage['free'] / 2**30:.1f}GB free"
+        )
+
+
+class ApiClient(object):
+    """
+    Management API client kept in one node process, the RPC connection and
+    the authentication are reused by all the calls
+    """
+
+    def __init__(self, node, cwd, call_timeout=60):
+        """
+        Args:
+            node (str): path to the node binary
+            cwd (str): NooBaa core directory, the RPC modules and the .env
+                are loaded from it
+            call_timeout (float): seconds to wait for a single call
+
+        """
+        self.node = node
+        self.cwd = cwd
+        self.call_timeout = call_timeout
+        self.process = None
+        self.replies = None
+        self.output = collections.deque(maxlen=20)
+        # a reply was received, the client itself works
+        self.answered = False
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.node, "-e", API_CLIENT_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=self.cwd,
+            text=True,
+            errors="replace",
+        )
+        self.replies = queue.Queue()
+        threading.Thread(
+            target=self._read, args=(self.process, self.replies), daemon=True
+        ).start()
+
+    def _read(self, process, replies):
+        """
+        Queues the replies of the process, None once it exited
+        """
+        for line in process.stdout:
+            if line.startswith(REPLY_MARKER):
+                replies.put(line[len(REPLY_MARKER) :])
+            elif line.strip():
+                self.output.append(line.rstrip())
+        replies.put(None)
+
+    def call(self, method, params=None, api="node"):
+        """
+        Calls a management API method, the client is started on the first
+        call and after a failed one
+
+        Args:
+            method (str): method name, e.g: "aggregate_nodes"
+            params (dict): method params
+            api (str): api name
+
+        Returns:
+            object: the reply
+
+        Raises:
+            RuntimeError: In case the call failed
+
+        """
+        if self.process is None:
+            self.start()
+        request = json.dumps({"api": api, "method": method, "params": params})
+        try:
+            self.process.stdin.write(f"{request}\n")
+            self.process.stdin.flush()
+            line = self.replies.get(timeout=self.call_timeout)
+        except (OSError, queue.Empty) as ex:
+            self.close()
+            raise RuntimeError(f"api call {api}.{method} failed: {ex!r}") from ex
+        if line is None:
+            self.close()
+            raise RuntimeError(
+                f"api client exited during {api}.{method}: "
+                f"{chr(10).join(self.output)}"
+            )
+        self.answered = True
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(f"api call {api}.{method} failed: {reply['error']}")
+        return reply.get("reply")
+
+    def close(self):
+        """
+        Stops the client process, it exits once its stdin is closed
+        """
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+            process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+
+
+class HealthChecker(object):
+    """
+    Polls the management API till the cluster converges
+    """
+
+    def __init__(
+        self,
+        npm,
+        expected_nodes,
+        min_capacity=0,
+        timeout=300,
+        interval=1,
+        max_interval=15,
+        backoff_factor=2,
+        call_timeout=60,
+        node="node",
+    ):
+        """
+        Args:
+            npm (NPM): launcher of the package scripts, runs the api script
+                when the API client can't start
+            expected_nodes (int): number of nodes which have to be online
+            min_capacity (int): bytes of total storage which have to be
+                reported
+            timeout (float): seconds to wait for convergence
+            interval (float): seconds to wait after the first poll
+            max_interval (float): upper bound for the wait between polls
+            backoff_factor (float): multiplier applied to the wait after
+                each poll
+            call_timeout (float): seconds to wait for a single api call
+            node (str): path to the node binary running the API client
+
+        """
+        self.npm = npm
+        self.expected_nodes = expected_nodes
+        self.min_capacity = min_capacity
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.call_timeout = call_timeout
+        self.client = ApiClient(node, npm.package_dir, call_timeout=call_timeout)
+
+    def call(self, method, params=None, api="node"):
+        """
+        Calls a management API method through the API client, or through a
+        new `api` script process when the client can't start
+
+        Args:
+            method (str): method name, e.g: "aggregate_nodes"
+            params (dict): method params
+            api (str): api name
+
+        Returns:
+            object: the parsed reply
+
+        Raises:
+            RuntimeError: In case the call failed
+
+        """
+        if self.client is not None:
+            try:
+                return self.client.call(method, params, api)
+            except RuntimeError as ex:
+                if self.client.answered:
+                    raise
+                log.warning(f"api client didn't start, using the api script: {ex}")
+                self.client = None
+        return self.call_script(method, params, api)
+
+    def call_script(self, method, params=None, api="node"):
+        """
+        Calls a management API method in a new `api` script process, the
+        process start and RPC connection are paid on every call
+
+        Args:
+            method (str): method name, e.g: "aggregate_nodes"
+            params (dict): method params
+            api (str): api name
+
+        Returns:
+            object: the parsed reply
+
+        Raises:
+            RuntimeError: In case the call failed
+
+        """
+        args = ["--", api, method]
+        if params is not None:
+            args.append(json.dumps(params))
+        start = time.monotonic()
+        process = self.npm.run_script(cmd="api", args=tuple(args), wait=False)
+        try:
+            output, _ = process.communicate(timeout=self.call_timeout)
+        except Exception:
+            process.kill()
+            process.communicate()
+            raise
+        output = output.decode(errors="replace")
+        log.debug(f"api call {api}.{method} took {time.monotonic() - start:.2f}s")
+        if process.returncode != 0:
+            raise RuntimeError(
+                f"api call {api}.{method} exited with {process.returncode}: "
+                f"{output[-500:]}"
+            )
+        return parse_rpc_output(output)
+
+    def sync_monitor(self):
+        """
+        Makes the nodes monitor persist the current node states
+
+        Raises:
+            StorageStatusCheckFailed: In case the sync failed
+
+        """
+        try:
+            self.call("sync_monitor_to_store")
+        except RuntimeError as ex:
+            raise StorageStatusCheckFailed(str(ex)) from ex
+
+    def snapshot(self):
+        """
+        Returns:
+            ClusterHealth: current state of the nodes and storage
+
+        """
+        return ClusterHealth.from_aggregate(self.call("aggregate_nodes", {}))
+
+    def is_converged(self, health):
+        return (
+            health.online_nodes >= self.expected_nodes
+            and health.storage["total"] >= self.min_capacity
+        )
+
+    def close(self):
+        """
+        Stops the API client
+        """
+        if self.client is not None:
+            self.client.close()
+
+    def wait_converged(self):
+        """
+        Polls with exponential backoff till the expected nodes are online
+        with the expected capacity, every poll syncs the nodes monitor once
+        and reads the aggregate over the same API client
+
+        Returns:
+            ClusterHealth: the converged snapshot
+
+        Raises:
+            AggregateNodeStatusCheckFailed: In case the cluster didn't
+                converge within timeout
+
+        """
+        try:
+            return self._wait_converged()
+        finally:
+            self.close()
+
+    def _wait_converged(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        interval = self.interval
+        health = None
+        error = None
+        while True:
+            try:
+                self.sync_monitor()
+                health = self.snapshot()
+                error = None
+            except (StorageStatusCheckFailed, RuntimeError, ValueError) as ex:
+                # the api may not be serving yet while agents register
+                error = ex
+            if health is not None and error is None:
+                log.info(f"cluster health: {health}")
+                if self.is_converged(health):
+                    health.converged = True
+                    health.elapsed = time.monotonic() - start
+                    log.info(f"cluster converged after {health.elapsed:.2f}s")
+                    return health
+            else:
+                log.warning(f"cluster health check failed: {error}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AggregateNodeStatusCheckFailed(
+                    f"cluster didn't converge after {self.timeout}s, expected "
+                    f"{self.expected_nodes} nodes online and "
+                    f"{self.min_capacity} bytes, last state: "
+                    f"{health if error is None else error}"
+                )
+            time.sleep(min(interval, remaining))
+            interval = min(interval * self.backoff_factor, self.max_interval)
@@ -0,0 +1,88 @@
+"""
+This module holds the HTTP client shared by all remote fetches of a
+deployment (RPM resolution and download). It keeps connections alive in a
+pool, retries transient failures with jittered exponential backoff and
+applies default timeouts and authentication to every request.
+"""
+
+import logging
+import random
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """
+    Retry which adds a random jitter to the exponential backoff, so parallel
+    requests failing together don't retry in lockstep
+    """
+
+    def __init__(self, *args, jitter=0.0, **kwargs):
+        self.jitter = jitter
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.jitter = self.jitter
+        return retry
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, self.jitter)
+
+
+class HTTPClient(requests.Session):
+    """
+    Pooled requests session with retries, timeouts and authentication
+    """
+
+    def __init__(
+        self,
+        auth=None,
+        pool_size=16,
+        retries=3,
+        backoff_factor=0.5,
+        backoff_jitter=0.5,
+        timeout=(10, 120),
+    ):
+        """
+        Args:
+            auth (tuple): (username, password) when authentication is required
+            pool_size (int): max number of kept alive connections per host
+            retries (int): max number of retries of a failed request
+            backoff_factor (float): base of the exponential backoff in seconds
+            backoff_jitter (float): max random seconds added to every backoff
+            timeout (tuple): default (connect, read) timeouts in seconds
+
+        """
+        super().__init__()
+        self.auth = auth
+        self.timeout = timeout
+        retry = JitteredRetry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["HEAD", "GET", "OPTIONS"]),
+            raise_on_status=False,
+            jitter=backoff_jitter,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends the request with the default timeout unless one is given
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
@@ -0,0 +1,161 @@
+"""
+This module keeps a ledger of completed deployment steps on the host.
+Every step is recorded with a fingerprint of its inputs (RPM NEVRA,
+rendered env, config, ...), so re-running a deployment skips the steps
+which are up to date and redoes only what changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def fingerprint(inputs):
+    """
+    Calculates a stable fingerprint of step inputs
+
+    Args:
+        inputs (dict): JSON serializable inputs of a step
+
+    Returns:
+        str: sha256 of the inputs
+
+    """
+    data = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class StepLedger(object):
+    """
+    Persisted record of completed steps and their input fingerprints
+    """
+
+    def __init__(self, path, force=False):
+        """
+        Args:
+            path (str): path of the ledger file
+            force (bool): If True, all steps are redone, the ledger is
+                still updated
+
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.force = force
+        self._lock = threading.Lock()
+        self.steps = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.steps = json.load(f)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w") as f:
+            json.dump(self.steps, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def is_done(self, name, inputs):
+        """
+        Checks whether the step completed with the same inputs
+
+        Args:
+            name (str): step name
+            inputs (dict): inputs of the step
+
+        Returns:
+            bool: True if the step is up to date
+
+        """
+        with self._lock:
+            record = self.steps.get(name)
+        return (
+            not self.force
+            and record is not None
+            and record["fingerprint"] == fingerprint(inputs)
+        )
+
+    def mark_done(self, name, inputs, outputs=None):
+        """
+        Records the step as completed with the inputs, only their
+        fingerprint is stored as the inputs may hold secrets
+
+        Args:
+            name (str): step name
+            inputs (dict): inputs of the step
+            outputs (object): JSON serializable outcome of the step, e.g:
+                allocated ports, handed back when the step is skipped
+
+        """
+        with self._lock:
+            self.steps[name] = {
+                "fingerprint": fingerprint(inputs),
+                "outputs": outputs,
+                "completed_at": time.time(),
+            }
+            self._save()
+
+    def outputs(self, name):
+        """
+        Returns the recorded outputs of a step
+
+        Args:
+            name (str): step name
+
+        Returns:
+            object: outputs of the step, None if it has no record
+
+        """
+        with self._lock:
+            return self.steps.get(name, {}).get("outputs")
+
+    def invalidate(self, name):
+        """
+        Drops the record of a step, so it is redone by the next run
+
+        Args:
+            name (str): step name
+
+        """
+        with self._lock:
+            if self.steps.pop(name, None) is not None:
+                self._save()
+
+    def run(self, name, inputs, func, check=None):
+        """
+        Runs the step unless it is up to date
+
+        Args:
+            name (str): step name
+            inputs (dict): inputs of the step
+            func (callable): callable without arguments which runs the step
+            check (callable): optional callable returning False when the
+                outcome of a recorded step is gone from the host, e.g: the
+                RPM was removed
+
+        Returns:
+            object: what func returned, or the recorded outputs when the
+                step was skipped
+
+        """
+        if self.is_done(name, inputs) and (check is None or check()):
+            log.info(f"Step '{name}' is up to date, skipping it")
+            return self.outputs(name)
+        self.invalidate(name)
+        outputs = func()
+        self.mark_done(name, inputs, outputs)
+        return outputs
+
+    def step(self, name, inputs, func, check=None):
+        """
+        Wraps the step for a scheduler, see run
+
+        Returns:
+            callable: callable without arguments running the step via ledger
+
+        """
+        return lambda: self.run(name, inputs, func, check)
@@ -1,18 +1,205 @@
 """
 Main module
+
+The entry points import the deployment modules they use after parsing the
+arguments, so --help and argument errors don't load requests, jinja2,
+paramiko or the config.
 """
 
-from deployment.deployment import deploy
-from framework.customizations.arg_parser import load_args
-from framework.customizations.logging import logging
+import json
+import logging
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+import framework
+from framework.customizations.arg_parser import (
+    load_args,
+    load_bench_args,
+    load_metrics_args,
+    load_teardown_args,
+)
+from framework.customizations.logging import configure_logging
+from framework.tracing import tracer
 
 log = logging.getLogger(__name__)
 
 
+@contextmanager
+def resource_sampling(enabled=True):
+    """
+    Samples the resource usage of the DB mode services while the context is
+    active, optionally served on the local metrics port, and dumps the
+    samples as JSON at exit
+
+    Args:
+        enabled (bool): If False, nothing is sampled
+
+    Yields:
+        ResourceSampler: the running sampler, None when disabled
+
+    """
+    reporting = framework.config.REPORTING
+    if not (enabled and reporting["metrics_enabled"]):
+        yield None
+        return
+    from deployment.metrics import ResourceSampler
+
+    sampler = ResourceSampler(
+        framework.config.DEPLOYMENT["service_log_dir"],
+        interval=reporting["metrics_interval"],
+        ring_size=reporting["metrics_ring_size"],
+    )
+    sampler.start()
+    server = None
+    if reporting.get("metrics_port"):
+        server = sampler.serve(reporting["metrics_port"])
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        if server:
+            server.shutdown()
+        sampler.write_json(
+            reporting["metrics_file"].format(timestamp=time.strftime("%Y%m%d%H%M%S"))
+        )
+
+
 def noobaa_sa_install():
     """
     Installs NooBaa Standalone
     """
-    log.info("Installing Noobaa Standalone")
     load_args()
-    deploy()
+    configure_logging()
+    log.info("Installing Noobaa Standalone")
+    config = framework.config
+    if config.DEPLOYMENT["explain_tuning"]:
+        from deployment.deployment import host_tuning
+        from deployment.tuning import explain
+
+        print(explain(*host_tuning()))
+        return
+    if config.DEPLOYMENT.get("inventory"):
+        from deployment.multihost import MultiHostDeployment, load_inventory
+
+        try:
+            with tracer.span("noobaa_sa_install", multihost=True):
+                hosts = load_inventory(config.DEPLOYMENT["inventory"])
+                MultiHostDeployment(hosts).deploy()
+        finally:
+            trace_file = config.REPORTING["trace_file"].format(
+                timestamp=time.strftime("%Y%m%d%H%M%S")
+            )
+            tracer.write_report(trace_file)
+        return
+    from deployment.deployment import deploy
+
+    with resource_sampling(enabled=config.ENV_DATA["db_installation"]):
+        try:
+            with tracer.span("noobaa_sa_install"):
+                supervisor = deploy()
+        finally:
+            trace_file = config.REPORTING["trace_file"].format(
+                timestamp=time.strftime("%Y%m%d%H%M%S")
+            )
+            tracer.write_report(trace_file)
+        if supervisor and config.DEPLOYMENT["supervise_services"]:
+            supervisor.wait()
+
+
+def noobaa_sa_bench():
+    """
+    Benchmarks the S3 endpoint of NooBaa Standalone
+
+    Returns:
+        int: exit code, 1 in case of regressions against the baseline
+
+    """
+    load_bench_args()
+    configure_logging()
+    from deployment.bench import (
+        HOUSEKEEPING_WORKERS,
+        S3Bench,
+        compare,
+        parse_mix,
+        parse_size,
+        write_report,
+    )
+    from deployment.s3_client import S3Client
+
+    run = framework.config.RUN
+    concurrencies = run["bench_concurrency"]
+    client = S3Client(
+        run["bench_endpoint"],
+        run["bench_access_key"],
+        run["bench_secret_key"],
+        region=run["bench_region"],
+        pool_size=max([*concurrencies, HOUSEKEEPING_WORKERS]),
+    )
+    bench = S3Bench(
+        client,
+        run["bench_bucket"],
+        sizes=[parse_size(size) for size in run["bench_sizes"]],
+        concurrencies=concurrencies,
+        mix=parse_mix(run["bench_mix"]),
+        duration=run["bench_duration"],
+        prefill=run["bench_prefill"],
+    )
+    log.info(f"Benchmarking S3 endpoint {run['bench_endpoint']}")
+    report = bench.run()
+    report_file = run["bench_report_file"].format(
+        timestamp=time.strftime("%Y%m%d%H%M%S")
+    )
+    write_report(report, report_file)
+    if not run.get("bench_baseline"):
+        return 0
+    with open(run["bench_baseline"]) as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, run["bench_tolerance"])
+    for regression in regressions:
+        log.error(f"Regression: {regression}")
+    if regressions:
+        return 1
+    log.info(f"No regressions against baseline {run['bench_baseline']}")
+    return 0
+
+
+def noobaa_sa_teardown():
+    """
+    Tears down NooBaa Standalone
+    """
+    load_teardown_args()
+    configure_logging()
+    log.info("Tearing down Noobaa Standalone")
+    from deployment.teardown import Teardown
+
+    config = framework.config
+    teardown = Teardown(
+        keep_packages=config.DEPLOYMENT["teardown_keep_packages"],
+        timeout=config.DEPLOYMENT["teardown_timeout"],
+    )
+    teardown.run(
+        db=config.ENV_DATA["db_installation"],
+        nsfs=config.ENV_DATA["nsfs_installation"],
+    )
+
+
+def noobaa_sa_metrics():
+    """
+    Samples the resource usage of running DB mode services till
+    SIGINT/SIGTERM
+    """
+    load_metrics_args()
+    configure_logging()
+    config = framework.config
+    config.REPORTING["metrics_enabled"] = True
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    log.info(
+        f"Sampling the services of {config.DEPLOYMENT['service_log_dir']} every "
+        f"{config.REPORTING['metrics_interval']}s"
+    )
+    with resource_sampling():
+        stop.wait()
@@ -0,0 +1,316 @@
+"""
+This module samples the resource usage of the DB mode services. The
+service process trees are found through the supervisor pid files and read
+from /proc on an interval into a per-service ring buffer, which is served
+in the Prometheus text format on a local port or dumped as JSON.
+"""
+
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+from deployment.supervisor import SUPERVISOR_PID_FILE, read_pid_file
+
+log = logging.getLogger(__name__)
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# totals of a service process tree at a point of time
+Sample = namedtuple(
+    "Sample",
+    "time cpu_percent cpu_seconds rss fds read_bytes write_bytes processes",
+)
+# Prometheus metric, its type, help and the Sample field it is taken from
+METRICS = (
+    ("cpu_seconds_total", "counter", "CPU time of the service", "cpu_seconds"),
+    (
+        "cpu_percent",
+        "gauge",
+        "CPU usage since the previous sample, 100 is one core",
+        "cpu_percent",
+    ),
+    ("resident_memory_bytes", "gauge", "Resident memory", "rss"),
+    ("open_fds", "gauge", "Open file descriptors", "fds"),
+    ("read_bytes_total", "counter", "Bytes read from storage", "read_bytes"),
+    ("write_bytes_total", "counter", "Bytes written to storage", "write_bytes"),
+    ("processes", "gauge", "Processes of the service tree", "processes"),
+)
+METRIC_PREFIX = "noobaa_sa_service_"
+
+
+def scan_processes():
+    """
+    Reads the stat of all processes in one pass over /proc
+
+    Returns:
+        dict: pid to its stat fields following the command
+
+    """
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stats[int(entry)] = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+    return stats
+
+
+def process_tree(pid, children):
+    """
+    Args:
+        pid (int): root of the tree
+        children (dict): pid to the pids of its children
+
+    Returns:
+        list: pid and all its descendants
+
+    """
+    tree = [pid]
+    for p in tree:
+        tree.extend(children.get(p, ()))
+    return tree
+
+
+def read_io(pid):
+    """
+    Returns:
+        tuple: (read_bytes, write_bytes) of the process, zeros if /proc/<pid>/io
+            is not readable
+
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                values[name] = int(value)
+    except OSError:
+        pass
+    return values.get("read_bytes", 0), values.get("write_bytes", 0)
+
+
+def count_fds(pid):
+    """
+    Returns:
+        int: open file descriptors of the process, 0 if not readable
+
+    """
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return 0
+
+
+class ResourceSampler(object):
+    """
+    Samples the service process trees into per-service ring buffers
+    """
+
+    def __init__(self, pid_dir, interval=5, ring_size=720):
+        """
+        Args:
+            pid_dir (str): directory of the supervisor pid files
+            interval (float): seconds between samples
+            ring_size (int): number of samples kept per service
+
+        """
+        self.pid_dir = os.path.abspath(os.path.expanduser(pid_dir))
+        self.interval = interval
+        self.ring_size = ring_size
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def services(self):
+        """
+        Returns:
+            dict: name to pid of the running services
+
+        """
+        services = {}
+        if not os.path.isdir(self.pid_dir):
+            return services
+        for name in os.listdir(self.pid_dir):
+            if not name.endswith(".pid") or name == SUPERVISOR_PID_FILE:
+                continue
+            pid = read_pid_file(os.path.join(self.pid_dir, name))
+            if pid is not None:
+                services[name[: -len(".pid")]] = pid
+        return services
+
+    def sample(self):
+        """
+        Takes one sample of every running service
+
+        Returns:
+            dict: service name to its Sample
+
+        """
+        now = time.time()
+        stats = scan_processes()
+        children = {}
+        for pid, fields in stats.items():
+            children.setdefault(int(fields[1]), []).append(pid)
+        samples = {}
+        for name, root in self.services().items():
+            pids = [pid for pid in process_tree(root, children) if pid in stats]
+            # utime, stime and the times of reaped children
+            ticks = sum(int(x) for pid in pids for x in stats[pid][11:15])
+            io = [read_io(pid) for pid in pids]
+            cpu_seconds = ticks / CLK_TCK
+            cpu_percent = 0.0
+            with self._lock:
+                previous = self.samples.get(name)
+            if previous:
+                elapsed = now - previous[-1].time
+                used = max(cpu_seconds - previous[-1].cpu_seconds, 0)
+                cpu_percent = round(used / elapsed * 100, 1) if elapsed > 0 else 0.0
+            samples[name] = Sample(
+                time=now,
+                cpu_percent=cpu_percent,
+                cpu_seconds=round(cpu_seconds, 2),
+                rss=sum(int(stats[pid][21]) for pid in pids) * PAGE_SIZE,
+                fds=sum(count_fds(pid) for pid in pids),
+                read_bytes=sum(r for r, _ in io),
+                write_bytes=sum(w for _, w in io),
+                processes=len(pids),
+            )
+        with self._lock:
+            for name, sample in samples.items():
+                ring = self.samples.setdefault(name, deque(maxlen=self.ring_size))
+                ring.append(sample)
+        return samples
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.sample()
+            except Exception as ex:
+                log.warning(f"resource sampling failed: {ex}")
+            self._stopping.wait(self.interval)
+
+    def start(self):
+        """
+        Starts sampling in a background thread
+        """
+        self._thread = threading.Thread(
+            target=self._run, name="resource-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def latest(self):
+        """
+        Returns:
+            dict: service name to its most recent Sample
+
+        """
+        with self._lock:
+            return {name: ring[-1] for name, ring in self.samples.items() if ring}
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: all kept samples, JSON serializable
+
+        """
+        with self._lock:
+            services = {
+                name: [sample._asdict() for sample in ring]
+                for name, ring in sorted(self.samples.items())
+            }
+        return {"interval": self.interval, "services": services}
+
+    def write_json(self, path):
+        """
+        Writes all kept samples as JSON
+
+        Args:
+            path (str): path of the JSON file
+
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+        log.info(f"Resource samples written to {path}")
+
+    def prometheus_text(self):
+        """
+        Renders the most recent samples in the Prometheus text format
+
+        Returns:
+            str: exposition of all METRICS by service
+
+        """
+        latest = sorted(self.latest().items())
+        lines = []
+        for metric, metric_type, description, field in METRICS:
+            name = f"{METRIC_PREFIX}{metric}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for service, sample in latest:
+                value = getattr(sample, field)
+                lines.append(f'{name}{{service="{service}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves /metrics in the Prometheus text format and /json with all
+        kept samples in a background thread
+
+        Args:
+            port (int): local port
+            host (str): address to bind
+
+        Returns:
+            ThreadingHTTPServer: the server, shutdown() stops it
+
+        """
+        server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        server.sampler = self
+        threading.Thread(
+            target=server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+        log.info(f"Serving resource metrics on http://{host}:{port}/metrics")
+        return server
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the samples of the server's ResourceSampler
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        sampler = self.server.sampler
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = sampler.prometheus_text().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif path == "/json":
+            body = json.dumps(sampler.to_dict()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,543 @@
+"""
+This module deploys NooBaa Standalone with DB across several hosts.
+An inventory assigns the service roles to hosts: the core host runs
+postgres, web, bg and hosted agents, any number of hosts run s3 endpoints
+and backingstores pointed at the core host. The RPM is downloaded once
+and pushed to every host, the per-host steps run through a transport on a
+bounded worker pool.
+
+Inventory example:
+
+    defaults:
+      user: root
+      private_key: ~/.ssh/id_rsa
+      transport: ssh          # or local, to try an inventory on this host
+    hosts:
+      - address: 10.0.0.1
+        roles: [db, web, bg, hosted_agents]
+      - address: 10.0.0.2
+        roles: [s3, backingstore]
+        backing_stores: 8
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import shlex
+import tempfile
+
+import yaml
+
+from common_ci_utils.templating import Templating
+from deployment.backingstore import allocate_ports
+from deployment.deployment import Deployment, prepare_host
+from deployment.pg_tuning import INCLUDE_DIR, data_dir_of
+from deployment.readiness import build_probe, wait_for_all_ready, wait_for_ready
+from deployment.scheduler import DependencyScheduler
+from deployment.transport import LocalTransport, SSHTransport
+from deployment.tuning import HostInfo, compute_tuning, tuning_values
+from framework import config, exceptions
+from framework.tracing import tracer
+
+log = logging.getLogger(__name__)
+
+NETWORK_FILE = "noobaa_network.conf"
+CORE_ROLES = ("db", "web", "bg", "hosted_agents")
+ROLES = CORE_ROLES + ("s3", "backingstore")
+TRANSPORTS = ("ssh", "local")
+
+
+class InventoryHost(object):
+    """
+    A host of the inventory and the roles it runs
+    """
+
+    def __init__(
+        self,
+        address,
+        roles,
+        transport="ssh",
+        user=None,
+        private_key=None,
+        password=None,
+        backing_stores=None,
+    ):
+        """
+        Args:
+            address (str): hostname or IP the other hosts reach the host at
+            roles (list): roles of the host, see ROLES
+            transport (str): ssh or local
+            user (str): SSH username
+            private_key (str): SSH private key
+            password (str): SSH password
+            backing_stores (int): number of backingstores, defaults to
+                DEPLOYMENT backing_stores
+
+        """
+        self.address = address
+        self.roles = list(roles)
+        self.transport_type = transport
+        self.user = user
+        self.private_key = private_key and os.path.expanduser(private_key)
+        self.password = password
+        self.backing_stores = backing_stores
+        self._transport = None
+
+    @property
+    def transport(self):
+        """
+        Returns:
+            Transport: transport of the host, created on first use
+
+        """
+        if self._transport is None:
+            if self.transport_type == "local":
+                self._transport = LocalTransport(self.address)
+            else:
+                self._transport = SSHTransport(
+                    self.address, self.user, self.private_key, self.password
+                )
+        return self._transport
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    def __str__(self):
+        return self.address
+
+
+def load_inventory(path):
+    """
+    Loads and validates an inventory file
+
+    Args:
+        path (str): path of the inventory YAML
+
+    Returns:
+        list: InventoryHost of every host, the core host first
+
+    Raises:
+        InventoryError: In case the inventory is invalid
+
+    """
+    with open(os.path.expanduser(path)) as f:
+        inventory = yaml.safe_load(f) or {}
+    defaults = inventory.get("defaults", {})
+    hosts = []
+    for entry in inventory.get("hosts", []):
+        try:
+            host = InventoryHost(**{**defaults, **entry})
+        except TypeError as ex:
+            raise exceptions.InventoryError(f"Invalid host {entry}: {ex}")
+        unknown = set(host.roles) - set(ROLES)
+        if unknown:
+            raise exceptions.InventoryError(
+                f"Host {host} has unknown roles {sorted(unknown)}, expected {ROLES}"
+            )
+        if host.transport_type not in TRANSPORTS:
+            raise exceptions.InventoryError(
+                f"Host {host} has unknown transport {host.transport_type}"
+            )
+        hosts.append(host)
+    addresses = [host.address for host in hosts]
+    if len(set(addresses)) != len(addresses):
+        raise exceptions.InventoryError(f"Duplicate hosts in inventory {path}")
+    # the addresses of the core services are rendered from a single host
+    core = [host for host in hosts if set(CORE_ROLES) & set(host.roles)]
+    if len(core) != 1 or not set(CORE_ROLES) <= set(core[0].roles):
+        raise exceptions.InventoryError(
+            f"Roles {CORE_ROLES} have to be assigned to one host together, "
+            f"got {[f'{host}: {host.roles}' for host in core]}"
+        )
+    return core + [host for host in hosts if host is not core[0]]
+
+
+def host_cidr(address):
+    """
+    Args:
+        address (str): IP or hostname of a host
+
+    Returns:
+        str: pg_hba.conf address matching only the host
+
+    """
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    return f"{ip}/{ip.max_prefixlen}"
+
+
+def listening_ports(transport):
+    """
+    Lists the TCP ports bound on a host through its transport
+
+    Args:
+        transport (Transport): transport of the host
+
+    Returns:
+        set: listening TCP ports
+
+    """
+    output = transport.run("ss -Htln | awk '{print $4}'")
+    # local addresses look like 0.0.0.0:5432, [::]:5432 or *:5432
+    return {int(address.rsplit(":", 1)[1]) for address in output.split()}
+
+
+def remote_host_info(transport, drives):
+    """
+    Inspects the resources of a host through its transport
+
+    Args:
+        transport (Transport): transport of the host
+        drives (int): number of backingstore drives of the host
+
+    Returns:
+        HostInfo: CPUs, memory in bytes, NUMA nodes and drives of the host
+
+    """
+    cpus, memory_kb, numa_nodes = transport.run(
+        "nproc; awk '/^MemTotal:/ {print $2}' /proc/meminfo; "
+        "ls -d /sys/devices/system/node/node[0-9]* 2>/dev/null | wc -l"
+    ).split()
+    return HostInfo(int(cpus), int(memory_kb) * 1024, int(numa_nodes) or 1, drives)
+
+
+class MultiHostDeployment(Deployment):
+    """
+    NooBaa Standalone deployment with DB spread over the inventory hosts
+    """
+
+    def __init__(self, hosts):
+        """
+        Args:
+            hosts (list): InventoryHost of every host, the core host first
+
+        """
+        super().__init__()
+        self.hosts = hosts
+        self.core = hosts[0]
+        self.noobaa_core_dir = config.ENV_DATA["noobaa_core_dir"]
+        self.log_dir = config.DEPLOYMENT["service_log_dir"]
+        self.probes = config.DEPLOYMENT["readiness_probes"]
+
+    def backing_stores(self, host):
+        """
+        Returns:
+            int: number of backingstores of the host
+
+        """
+        if "backingstore" not in host.roles:
+            return 0
+        if host.backing_stores is not None:
+            return host.backing_stores
+        return config.DEPLOYMENT["backing_stores"]
+
+    def _wait(self, probe, spec):
+        wait_for_ready(
+            probe,
+            timeout=spec.get("timeout", config.DEPLOYMENT["readiness_timeout"]),
+            interval=config.DEPLOYMENT["readiness_interval"],
+            max_interval=config.DEPLOYMENT["readiness_max_interval"],
+        )
+
+    def run_script(self, host, script, args=""):
+        """
+        Runs a package script on the host till it exits
+
+        Args:
+            host (InventoryHost): host to run on
+            script (str): package.json script name
+            args (str): arguments of the script
+
+        """
+        node_bin = os.path.dirname(self.node_path)
+        host.transport.run(
+            f"cd {self.noobaa_core_dir} && PATH={node_bin}:$PATH npm run {script} "
+            f"{args}"
+        )
+
+    def start_service(self, host, name, script, args=""):
+        """
+        Starts a package script on the host in the background, its output
+        and a pid file for the teardown are written to the service log
+        directory of the host
+
+        Args:
+            host (InventoryHost): host to run on
+            name (str): service name, e.g: "s3", "backingstore-9991"
+            script (str): package.json script name
+            args (str): arguments of the script
+
+        """
+        node_bin = os.path.dirname(self.node_path)
+        log_file = os.path.join(self.log_dir, f"{name}.log")
+        pid_file = os.path.join(self.log_dir, f"{name}.pid")
+        # the start time in the pid file guards the teardown against reused pids
+        start_time = "$(sed 's/.*) //' /proc/$pid/stat | cut -d' ' -f20)"
+        log.info(f"starting service '{name}' on {host}")
+        host.transport.run(
+            f"mkdir -p {self.log_dir} && cd {self.noobaa_core_dir} && "
+            f"{{ PATH={node_bin}:$PATH nohup npm run {script} {args} "
+            f"> {log_file} 2>&1 < /dev/null & pid=$!; "
+            f'echo "$pid {start_time}" > {pid_file}; }}'
+        )
+
+    def push_rpm(self, host):
+        """
+        Uploads the downloaded RPM to the host and installs it, skipped
+        when the host has the same RPM installed
+        """
+        transport = host.transport
+        if transport.exec_cmd(f"rpm -q {self.rpm_nevra}")[0] == 0:
+            log.info(f"{self.rpm_nevra} is already installed on {host}")
+            return
+        remote_path = os.path.join(
+            config.DEPLOYMENT["remote_rpm_dir"], os.path.basename(self.rpm_path)
+        )
+        with tracer.span("rpm push", host=host.address):
+            transport.upload_file(self.rpm_path, remote_path)
+            transport.run(f"sudo yum install -y {remote_path}")
+
+    def configure(self, host):
+        """
+        Renders the .env and config-local.js of the host, tuned for its
+        resources and pointing at the core host, and uploads them
+        """
+        resources = remote_host_info(host.transport, self.backing_stores(host))
+        tuning = tuning_values(
+            compute_tuning(
+                resources,
+                config.DEPLOYMENT["tuning_profile"],
+                overrides=config.DEPLOYMENT.get("tuning_overrides"),
+            )
+        )
+        data = {
+            **config.ENV_DATA,
+            "ip_address": self.core.address,
+            # services on the core host reach postgres over localhost
+            "host_name": "localhost" if host is self.core else self.core.address,
+            "tuning": tuning,
+        }
+        templating = Templating(base_path=config.ENV_DATA["template_dir"])
+        files = {
+            "env.j2": config.ENV_DATA["env_file"],
+            "config-local.js.j2": config.ENV_DATA["config_local"],
+        }
+        for template, target in files.items():
+            content = templating.render_template(template, data)
+            with tempfile.NamedTemporaryFile("w", delete=False) as f:
+                f.write(content)
+            # hosts are configured in parallel, possibly on the same machine
+            staged = host.transport.run(
+                f"mktemp /tmp/noobaa-sa-{os.path.basename(target)}.XXXXXX"
+            ).strip()
+            try:
+                host.transport.upload_file(f.name, staged)
+                host.transport.run(f"sudo install -m 666 {staged} {target}")
+            finally:
+                os.remove(f.name)
+                host.transport.exec_cmd(f"rm -f {staged}")
+
+    def open_postgres(self):
+        """
+        Makes the postgres initialized by db:init on the core host listen on
+        the core address and accept the inventory hosts, with the auth
+        method db:init set for local TCP connections
+        """
+        package_json = config.ENV_DATA["package_json"]
+        package = json.loads(self.core.transport.run(f"cat {package_json}"))
+        data_dir = data_dir_of(package, os.path.dirname(package_json))
+        if data_dir is None:
+            raise exceptions.InventoryError(
+                f"PostgreSQL data directory not found in {package_json} on "
+                f"{self.core}"
+            )
+        conf = os.path.join(data_dir, "postgresql.conf")
+        hba = os.path.join(data_dir, "pg_hba.conf")
+        include_dir = os.path.join(data_dir, INCLUDE_DIR)
+        include = f"include_dir = '{INCLUDE_DIR}'"
+        listen = f"listen_addresses = 'localhost,{self.core.address}'"
+        lines = [
+            "set -e",
+            f"mkdir -p {include_dir}",
+            f'echo "{listen}" > {os.path.join(include_dir, NETWORK_FILE)}',
+            f'grep -q "^{include}" {conf} || '
+            f'printf "\n# NooBaa tuning\n{include}\n" >> {conf}',
+            "method=$(awk '$1 == \"host\" && $4 == \"127.0.0.1/32\" "
+            f"{{print $5; exit}}' {hba})",
+        ]
+        for host in self.hosts:
+            rule = f"host all all {host_cidr(host.address)}"
+            lines.append(
+                f'grep -q "^{rule} " {hba} || '
+                f'echo "{rule} ${{method:-trust}}" >> {hba}'
+            )
+        with tracer.span("postgres network", host=self.core.address):
+            self.core.transport.run(f"sudo bash -c {shlex.quote('; '.join(lines))}")
+
+    def install_postgres(self, host):
+        """
+        Installs the postgres packages on the host
+        """
+        repo = config.ENV_DATA["postgres_repo"]
+        packages = " ".join(map(str, config.ENV_DATA["db_packages"]))
+        version = config.ENV_DATA["postgresql_version"]
+        with tracer.span("postgres install", host=host.address):
+            host.transport.run(f"sudo yum install -y {repo}")
+            host.transport.run(f"sudo dnf module enable -y postgresql:{version}")
+            host.transport.run(f"sudo yum install -y {packages}")
+
+    def run_core_service(self, service):
+        """
+        Starts a core service on the core host and waits till it is ready
+
+        Args:
+            service (str): service name as in DEPLOYMENT["readiness_probes"]
+
+        """
+        spec = self.probes[service]
+        self.start_service(self.core, service, service)
+        self._wait(build_probe(spec, host=self.core.address), spec)
+
+    def run_s3(self, host):
+        """
+        Starts the s3 endpoint on the host and waits till it is ready
+        """
+        spec = self.probes["s3"]
+        self.start_service(host, "s3", "s3")
+        self._wait(build_probe(spec, host=host.address), spec)
+
+    def run_backingstores(self, host):
+        """
+        Creates the backingstore drives of the host, starts their agents and
+        waits till all of them are ready
+        """
+        spec = self.probes["backingstore"]
+        drive_path = config.DEPLOYMENT["backing_store_drive_path"]
+        prefix = config.DEPLOYMENT["backing_store_drive_prefix"]
+        count = self.backing_stores(host)
+        used = listening_ports(host.transport)
+        ports = allocate_ports(
+            count,
+            config.DEPLOYMENT["backing_store_drive_port"],
+            reserved_ports=[s["port"] for s in self.probes.values() if "port" in s],
+            is_free=lambda port: port not in used,
+        )
+        drives = [
+            (os.path.join(drive_path, f"{prefix}{num}"), port)
+            for num, port in enumerate(ports)
+        ]
+        host.transport.run(
+            "mkdir -p " + " ".join(shlex.quote(path) for path, _ in drives)
+        )
+        for path, port in drives:
+            self.start_service(
+                host, f"backingstore-{port}", "backingstore", f"-- {path} --port {port}"
+            )
+        wait_for_all_ready(
+            [build_probe(spec, host=host.address, port=port) for _, port in drives],
+            timeout=spec.get("timeout", config.DEPLOYMENT["readiness_timeout"]),
+            interval=config.DEPLOYMENT["readiness_interval"],
+            max_interval=config.DEPLOYMENT["readiness_max_interval"],
+        )
+
+    def build_graph(self):
+        """
+        Declares the per-host steps. Every host gets the RPM and its config,
+        the core host bootstraps postgres and the core services, the s3
+        endpoints and backingstores of all hosts start once web is ready.
+
+        Returns:
+            DependencyScheduler: scheduler holding the steps of all hosts
+
+        """
+        scheduler = DependencyScheduler(
+            max_workers=config.DEPLOYMENT["fanout_max_workers"]
+        )
+        core = self.core
+        for host in self.hosts:
+            scheduler.add_step(f"{host} rpm installed", lambda h=host: self.push_rpm(h))
+            scheduler.add_step(
+                f"{host} configured",
+                lambda h=host: self.configure(h),
+                [f"{host} rpm installed"],
+            )
+            if host is not core:
+                scheduler.add_step(
+                    f"{host} prepared",
+                    lambda h=host: prepare_host(h.transport, postgres=False),
+                    [f"{host} rpm installed"],
+                )
+
+        scheduler.add_step(
+            f"{core} postgres installed", lambda: self.install_postgres(core)
+        )
+        scheduler.add_step(
+            f"{core} prepared",
+            lambda: prepare_host(core.transport),
+            [f"{core} rpm installed", f"{core} postgres installed"],
+        )
+        scheduler.add_step(
+            f"{core} db initialized",
+            lambda: self.run_script(core, "db:init"),
+            [f"{core} prepared"],
+        )
+        scheduler.add_step(
+            f"{core} db opened",
+            self.open_postgres,
+            [f"{core} db initialized"],
+        )
+        scheduler.add_step(
+            f"{core} db ready",
+            lambda: self.run_core_service("db"),
+            [f"{core} db opened", f"{core} configured"],
+        )
+        scheduler.add_step(
+            f"{core} db created",
+            lambda: self.run_script(core, "db:create"),
+            [f"{core} db ready"],
+        )
+        web_ready = f"{core} web ready"
+        scheduler.add_step(
+            web_ready, lambda: self.run_core_service("web"), [f"{core} db created"]
+        )
+        for service in ("bg", "hosted_agents"):
+            scheduler.add_step(
+                f"{core} {service} ready",
+                lambda s=service: self.run_core_service(s),
+                [web_ready],
+            )
+
+        for host in self.hosts:
+            ready = [web_ready, f"{host} configured", f"{host} prepared"]
+            if "s3" in host.roles:
+                scheduler.add_step(
+                    f"{host} s3 ready", lambda h=host: self.run_s3(h), ready
+                )
+            if self.backing_stores(host):
+                scheduler.add_step(
+                    f"{host} backingstores ready",
+                    lambda h=host: self.run_backingstores(h),
+                    ready,
+                )
+        return scheduler
+
+    def deploy(self):
+        """
+        Downloads the RPM once and deploys all the hosts
+        """
+        self.resolve_rpm()
+        with tracer.span("rpm download", url=self.rpm_url):
+            self.rpm_path = self.download_rpm()
+        try:
+            self.build_graph().run()
+        finally:
+            for host in self.hosts:
+                host.close()
+        log.info(
+            f"NooBaa deployed on {len(self.hosts)} hosts, core services on "
+            f"{self.core}"
+        )
@@ -1,9 +1,39 @@
+import json
 import logging
-
-from pynpm import NPMPackage
+import os
+import re
+import shlex
+import subprocess
 
 log = logging.getLogger(__name__)
 
+# scripts using shell features are left to npm
+SHELL_SYNTAX = re.compile(r"&&|\|\||[|;<>`$()*?]")
+ENV_ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+
+
+def run_argv(argv, cwd, wait, env=None, stdout=subprocess.PIPE):
+    """
+    Runs a command the way pynpm runs npm
+
+    Args:
+        stdout (int|file): where the output of a process which is not
+            waited for goes, stderr is merged into it
+
+    Returns:
+        int: exit code if wait, otherwise subprocess.Popen object
+
+    """
+    if wait:
+        return subprocess.call(argv, cwd=cwd, env=env)
+    return subprocess.Popen(
+        argv,
+        stdout=stdout,
+        stderr=subprocess.STDOUT,
+        cwd=cwd,
+        env=env,
+    )
+
 
 class NPM(object):
     """
@@ -18,9 +48,26 @@ class NPM(object):
             package (str): Path to package.json
 
         """
-        self.pkg = NPMPackage(package)
+        self.package = package
+        self.package_dir = os.path.dirname(os.path.abspath(package))
+        self._pkg = None
+
+    @property
+    def pkg(self):
+        """
+        Returns:
+            NPMPackage: pynpm package, pynpm is imported on first use
+
+        """
+        if self._pkg is None:
+            from pynpm import NPMPackage
 
-    def run_script(self, cmd, args=None, wait=True):
+            self._pkg = NPMPackage(self.package)
+        return self._pkg
+
+    def run_script(
+        self, cmd, args=None, wait=True, prefix=None, stdout=subprocess.PIPE
+    ):
         """
         Runs the command with npm
 
@@ -29,12 +76,109 @@ class NPM(object):
             args (tuple): arguments to pass to run_scrit
                e.g: ('--', 'drive1', '--port', '9991')
             wait (bool): If True, npm will wait till command is completed
+            prefix (list): argv npm is run under, e.g: ['taskset', '-c', '0-7']
+            stdout (int|file): output of npm if not waited for, a pipe by
+                default
 
         Returns:
             object: subprocess.Popen object
 
         """
         log.info(f"executing 'npm run {cmd}'")
+        if prefix or not wait:
+            argv = list(prefix or []) + ["npm", "run", cmd] + list(args or [])
+            return run_argv(argv, self.package_dir, wait, stdout=stdout)
         if args:
             return self.pkg.run_script(cmd, *args, wait=wait)
         return self.pkg.run_script(cmd, wait=wait)
+
+
+class DirectLauncher(NPM):
+    """
+    Runs package.json scripts directly, without spawning npm and a shell.
+    The scripts section is read once and every script is resolved into an
+    argv with node replaced by node_path. Scripts which need a shell or
+    have pre/post hooks are run with npm.
+    """
+
+    def __init__(self, package, node_path):
+        """
+        Initializes the necessary variables needed for DirectLauncher
+
+        Args:
+            package (str): Path to package.json
+            node_path (str): Path to the node binary
+
+        """
+        super().__init__(package)
+        self.node_path = node_path
+        with open(package) as f:
+            self.scripts = json.load(f).get("scripts", {})
+        self.env = dict(os.environ)
+        bin_dir = os.path.join(self.package_dir, "node_modules", ".bin")
+        self.env["PATH"] = os.pathsep.join([bin_dir, self.env.get("PATH", "")])
+        self._resolved = {}
+
+    def resolve(self, cmd):
+        """
+        Resolves a script into an argv and environment
+
+        Args:
+            cmd (str): script name
+
+        Returns:
+            tuple: (argv, env overrides), None if the script needs npm
+
+        """
+        if cmd in self._resolved:
+            return self._resolved[cmd]
+        resolved = None
+        command = self.scripts.get(cmd)
+        hooks = f"pre{cmd}" in self.scripts or f"post{cmd}" in self.scripts
+        if command and not hooks and not SHELL_SYNTAX.search(command):
+            argv = shlex.split(command)
+            env = {}
+            while argv and ENV_ASSIGNMENT.match(argv[0]):
+                name, value = argv.pop(0).split("=", 1)
+                env[name] = value
+            if argv:
+                if argv[0] == "node":
+                    argv[0] = self.node_path
+                resolved = (argv, env)
+        self._resolved[cmd] = resolved
+        return resolved
+
+    def run_script(
+        self, cmd, args=None, wait=True, prefix=None, stdout=subprocess.PIPE
+    ):
+        """
+        Runs the script directly, or with npm when it can't be resolved
+
+        Args:
+            cmd (str): script name
+            args (tuple): arguments to pass to the script
+               e.g: ('--', 'drive1', '--port', '9991')
+            wait (bool): If True, waits till the script is completed
+            prefix (list): argv the script is run under,
+               e.g: ['numactl', '--cpunodebind=1', '--preferred=1']
+            stdout (int|file): output of the script if not waited for,
+                a pipe by default
+
+        Returns:
+            int: exit code if wait, otherwise subprocess.Popen object
+
+        """
+        resolved = self.resolve(cmd)
+        if resolved is None:
+            return super().run_script(
+                cmd, args=args, wait=wait, prefix=prefix, stdout=stdout
+            )
+        argv, env = resolved
+        args = list(args or [])
+        if args[:1] == ["--"]:
+            args = args[1:]
+        argv = list(prefix or []) + argv + [str(arg) for arg in args]
+        log.info(f"executing script '{cmd}': {' '.join(argv)}")
+        return run_argv(
+            argv, self.package_dir, wait, env={**self.env, **env}, stdout=stdout
+        )
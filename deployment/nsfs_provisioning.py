@@ -0,0 +1,276 @@
+"""
+This module provisions NSFS accounts and exported buckets in bulk from a
+declarative spec. The backing directories are created in a few batched
+commands, the NooBaa CLI account and bucket operations run concurrently
+on a bounded pool, every account's buckets start as soon as the account
+exists and whatever already exists is skipped.
+"""
+
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from common_ci_utils.command_runner import exec_cmd
+from framework import exceptions
+from framework.tracing import bind_context, tracer
+
+log = logging.getLogger(__name__)
+
+Account = namedtuple("Account", ["name", "uid", "gid", "path"])
+Bucket = namedtuple("Bucket", ["name", "owner", "path"])
+# paths per mkdir/chown command, far below the argument size limit
+PATHS_PER_COMMAND = 500
+# config directory entries of the accounts and buckets, in any layout
+ACCOUNT_DIRS = ("accounts", "accounts_by_name")
+BUCKET_DIRS = ("buckets",)
+ALREADY_EXISTS = re.compile(r"AlreadyExists")
+
+
+def id_in_range(id_range, index):
+    """
+    Picks an id of a range round-robin
+
+    Args:
+        id_range (list): [first, last] ids, inclusive
+        index (int): index of the account
+
+    Returns:
+        int: the id
+
+    """
+    first, last = id_range
+    return first + index % (last - first + 1)
+
+
+def expand_spec(spec):
+    """
+    Expands the spec into the accounts and buckets it declares
+
+    Args:
+        spec (dict): provisioning spec, e.g:
+            {
+                "accounts": 100,
+                "buckets_per_account": 5,
+                "account_name": "account{n}",
+                "bucket_name": "{account}-bucket{n}",
+                "uid_range": [2000, 2999],
+                "gid_range": [2000, 2000],
+                "base_path": "/mnt/nsfs",
+                "account_path": "{base_path}/{account}",
+                "bucket_path": "{base_path}/{account}/{bucket}",
+            }
+
+    Returns:
+        tuple: (list of Account, dict of account name to its list of Bucket)
+
+    """
+    accounts = []
+    buckets = {}
+    for index in range(spec["accounts"]):
+        name = spec["account_name"].format(n=index)
+        account = Account(
+            name,
+            id_in_range(spec["uid_range"], index),
+            id_in_range(spec["gid_range"], index),
+            spec["account_path"].format(base_path=spec["base_path"], account=name),
+        )
+        accounts.append(account)
+        buckets[name] = []
+        for number in range(spec["buckets_per_account"]):
+            bucket = spec["bucket_name"].format(account=name, n=number)
+            buckets[name].append(
+                Bucket(
+                    bucket,
+                    name,
+                    spec["bucket_path"].format(
+                        base_path=spec["base_path"], account=name, bucket=bucket
+                    ),
+                )
+            )
+    return accounts, buckets
+
+
+def existing_names(conf_dir, subdirs):
+    """
+    Lists the names of the entries in the NSFS config directory
+
+    Args:
+        conf_dir (str): NSFS config directory
+        subdirs (tuple): subdirectories holding the entries
+
+    Returns:
+        set: entry names without their extension
+
+    """
+    names = set()
+    for subdir in subdirs:
+        path = os.path.join(conf_dir, subdir)
+        if os.path.isdir(path):
+            names.update(os.path.splitext(name)[0] for name in os.listdir(path))
+    return names
+
+
+class NSFSProvisioner(object):
+    """
+    Creates the accounts, buckets and directories of a provisioning spec
+    """
+
+    def __init__(self, spec, cli, conf_dir, workers=16):
+        """
+        Args:
+            spec (dict): provisioning spec, see expand_spec
+            cli (str): command of the NooBaa NSFS CLI, e.g:
+                "/usr/local/noobaa-core/node/bin/node
+                /usr/local/noobaa-core/src/cmd/manage_nsfs"
+            conf_dir (str): NSFS config directory, for skipping what exists
+            workers (int): max number of CLI operations running at once
+
+        """
+        self.accounts, self.buckets = expand_spec(spec)
+        self.cli = cli
+        self.conf_dir = conf_dir
+        self.workers = workers
+
+    def create_directories(self, accounts, buckets):
+        """
+        Creates the account and bucket directories owned by their accounts,
+        in batches of PATHS_PER_COMMAND paths
+
+        Raises:
+            NSFSProvisioningFailed: In case a batch failed
+
+        """
+        by_owner = {}
+        for account in accounts:
+            paths = [account.path] + [b.path for b in buckets[account.name]]
+            by_owner.setdefault((account.uid, account.gid), []).extend(paths)
+        for (uid, gid), paths in by_owner.items():
+            for i in range(0, len(paths), PATHS_PER_COMMAND):
+                batch = paths[i : i + PATHS_PER_COMMAND]
+                for cmd in ("mkdir -p", f"chown {uid}:{gid}"):
+                    result = exec_cmd(f"{cmd} {' '.join(batch)}", use_sudo=True)
+                    if result.returncode != 0:
+                        raise exceptions.NSFSProvisioningFailed(
+                            f"'{cmd}' of {len(batch)} paths from {batch[0]} to "
+                            f"{batch[-1]} failed: {result.stderr.decode()}"
+                        )
+
+    def _cli(self, args):
+        """
+        Runs a CLI operation
+
+        Returns:
+            bool: True if created, False if it already existed
+
+        Raises:
+            NSFSProvisioningFailed: In case the operation failed
+
+        """
+        result = exec_cmd(f"{self.cli} {args}", use_sudo=True)
+        if result.returncode == 0:
+            return True
+        output = result.stdout.decode() + result.stderr.decode()
+        if ALREADY_EXISTS.search(output):
+            return False
+        raise exceptions.NSFSProvisioningFailed(f"'{args}' failed: {output}")
+
+    def add_account(self, account):
+        return self._cli(
+            f"account add --name {account.name} --new_buckets_path {account.path} "
+            f"--uid {account.uid} --gid {account.gid}"
+        )
+
+    def add_bucket(self, bucket):
+        return self._cli(
+            f"bucket add --name {bucket.name} --owner {bucket.owner} "
+            f"--path {bucket.path}"
+        )
+
+    def run(self):
+        """
+        Provisions everything the spec declares
+
+        Returns:
+            dict: created, skipped and failed counts of accounts and buckets,
+                elapsed seconds and achieved operations per second
+
+        Raises:
+            NSFSProvisioningFailed: In case any operation failed, after all
+                the others completed
+
+        """
+        start = time.monotonic()
+        stats = {
+            kind: {"created": 0, "skipped": 0, "failed": 0}
+            for kind in ("accounts", "buckets")
+        }
+        existing_accounts = existing_names(self.conf_dir, ACCOUNT_DIRS)
+        existing_buckets = existing_names(self.conf_dir, BUCKET_DIRS)
+        stats["accounts"]["skipped"] = sum(
+            a.name in existing_accounts for a in self.accounts
+        )
+        with tracer.span("nsfs directories", accounts=len(self.accounts)):
+            self.create_directories(self.accounts, self.buckets)
+
+        errors = []
+
+        def count(kind, future):
+            try:
+                created = future.result()
+            except Exception as ex:
+                stats[kind]["failed"] += 1
+                errors.append(ex)
+                return False
+            stats[kind]["created" if created else "skipped"] += 1
+            return True
+
+        def submit_buckets(executor, owner):
+            futures = []
+            for bucket in self.buckets[owner]:
+                if bucket.name in existing_buckets:
+                    stats["buckets"]["skipped"] += 1
+                    continue
+                futures.append(
+                    executor.submit(bind_context(self.add_bucket, bucket))
+                )
+            return futures
+
+        with tracer.span("nsfs accounts and buckets"), ThreadPoolExecutor(
+            max_workers=self.workers
+        ) as executor:
+            account_futures = {}
+            bucket_futures = []
+            for account in self.accounts:
+                if account.name in existing_accounts:
+                    bucket_futures += submit_buckets(executor, account.name)
+                    continue
+                future = executor.submit(bind_context(self.add_account, account))
+                account_futures[future] = account.name
+            # buckets of an account are created as soon as the account exists
+            for future in as_completed(account_futures):
+                if count("accounts", future):
+                    bucket_futures += submit_buckets(
+                        executor, account_futures[future]
+                    )
+            for future in bucket_futures:
+                count("buckets", future)
+
+        elapsed = time.monotonic() - start
+        operations = sum(
+            stats[kind]["created"] + stats[kind]["failed"] for kind in stats
+        )
+        stats["elapsed"] = round(elapsed, 2)
+        stats["ops_per_s"] = round(operations / elapsed, 2) if elapsed else 0
+        log.info(
+            f"NSFS provisioning: accounts {stats['accounts']}, buckets "
+            f"{stats['buckets']} in {stats['elapsed']}s, "
+            f"{stats['ops_per_s']} CLI operations/s with {self.workers} workers"
+        )
+        if errors:
+            raise exceptions.NSFSProvisioningFailed(
+                f"{len(errors)} NSFS operations failed, first: {errors[0]}"
+            )
+        return stats
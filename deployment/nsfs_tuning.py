@@ -0,0 +1,210 @@
+"""
+This module computes the NSFS endpoint settings from the host resources
+and the filesystem of the exported paths. Forks follow the CPU count, the
+libuv thread pool and buffer pool follow the filesystem latency and the
+memory, GPFS gets direct I/O reads and its native library.
+"""
+
+import logging
+import os
+from collections import OrderedDict
+
+from deployment.placement import find_mount, read_mounts
+from deployment.tuning import GB, MB, UV_THREADPOOL_MAX, TuningValue
+
+log = logging.getLogger(__name__)
+
+GPFS_LIBRARY = "/usr/lpp/mmfs/lib/libgpfs.so"
+# comment of the generated .env, marks it for the teardown
+ENV_MARKER = "# tuned by noobaa-sa-infra for the host and the exported filesystems"
+# settings of config.json before the tuning, kept next to it for the teardown
+TUNED_RECORD = ".config.json.tuned"
+# filesystem type reported by /proc/mounts to its tuning class
+FS_CLASSES = {
+    "gpfs": "gpfs",
+    "nfs": "nfs",
+    "nfs4": "nfs",
+    "ceph": "nfs",
+    "fuse.ceph-fuse": "nfs",
+    "cifs": "nfs",
+}
+# blocking fs calls in flight per fork, remote filesystems wait longer per call
+THREADS_PER_FORK = {"gpfs": 64, "nfs": 32, "local": 16}
+# size of the large NSFS buffers, GPFS blocks are 4MB to 16MB
+LARGE_BUFFER = {"gpfs": 16 * MB, "nfs": 8 * MB, "local": 8 * MB}
+# share of the memory for the buffer pools of all forks
+BUFFER_POOL_FRACTION = 1 / 4
+FORK_MEMORY = 256 * MB
+
+
+def mount_of(path, mounts_file="/proc/mounts"):
+    """
+    Finds the mount a path is on, the path doesn't have to exist yet
+
+    Args:
+        path (str): absolute path
+        mounts_file (str): mount table
+
+    Returns:
+        tuple: (mount point, filesystem type)
+
+    """
+    entry = find_mount(path, read_mounts(mounts_file))
+    return entry.mount_point, entry.fs_type
+
+
+def fs_class(fs_types):
+    """
+    Picks the tuning class of the exported filesystems, the slowest wins
+
+    Args:
+        fs_types (list): filesystem types of the exported paths
+
+    Returns:
+        str: gpfs, nfs or local
+
+    """
+    classes = {FS_CLASSES.get(fs_type, "local") for fs_type in fs_types}
+    for fs in ("gpfs", "nfs"):
+        if fs in classes:
+            return fs
+    return "local"
+
+
+def compute_nsfs_tuning(host, fs, overrides=None):
+    """
+    Computes the NSFS settings for the host
+
+    Args:
+        host (HostInfo): host resources
+        fs (str): tuning class of the exported filesystems, see fs_class
+        overrides (dict): values set explicitly, they win over the computed
+
+    Returns:
+        OrderedDict: setting name to TuningValue
+
+    """
+    tuning = OrderedDict()
+    forks = max(1, min(host.cpus // 2, 32))
+    reason = f"{host.cpus} CPUs / 2 per fork (max 32)"
+    pool_memory = int(host.memory * BUFFER_POOL_FRACTION)
+    if forks * FORK_MEMORY > host.memory - pool_memory:
+        forks = max(1, (host.memory - pool_memory) // FORK_MEMORY)
+        reason += f", limited by {host.memory // MB}MB memory"
+    tuning["ENDPOINT_FORKS"] = TuningValue(forks, reason)
+
+    threads = min(THREADS_PER_FORK[fs], UV_THREADPOOL_MAX)
+    tuning["UV_THREADPOOL_SIZE"] = TuningValue(
+        threads, f"blocking {fs} calls in flight per fork (libuv max 1024)"
+    )
+
+    buffer_size = LARGE_BUFFER[fs]
+    tuning["NSFS_BUF_SIZE_L"] = TuningValue(
+        buffer_size, f"{buffer_size // MB}MB I/O size for {fs}"
+    )
+    pool_limit = max(64 * MB, min(pool_memory // forks // MB * MB, 4 * GB))
+    tuning["NSFS_BUF_POOL_MEM_LIMIT"] = TuningValue(
+        pool_limit,
+        f"{BUFFER_POOL_FRACTION:.3g} of {host.memory // MB}MB memory shared by "
+        f"{forks} forks, 64MB to 4GB per fork",
+    )
+
+    if fs == "gpfs":
+        tuning["NSFS_OPEN_READ_MODE"] = TuningValue(
+            "rd", "direct I/O reads, GPFS caches in its own pagepool"
+        )
+        tuning["NSFS_NC_STORAGE_BACKEND"] = TuningValue(
+            "GPFS", "exported paths are on GPFS"
+        )
+        if os.path.exists(GPFS_LIBRARY):
+            tuning["GPFS_DL_PATH"] = TuningValue(
+                GPFS_LIBRARY, "native GPFS calls for atomic uploads"
+            )
+    else:
+        tuning["NSFS_OPEN_READ_MODE"] = TuningValue(
+            "r", f"buffered reads through the page cache for {fs}"
+        )
+
+    for name, value in (overrides or {}).items():
+        tuning[name] = TuningValue(value, "overridden in config")
+    return tuning
+
+
+def merge_env(base_env, values):
+    """
+    Merges settings into the content of an env file, the base lines
+    setting the same keys are dropped
+
+    Args:
+        base_env (str): content of the env file shipped with the RPM
+        values (dict): settings written after the base lines
+
+    Returns:
+        str: base lines without the overridden keys
+
+    """
+    lines = []
+    for line in base_env.splitlines():
+        key = line.split("=", 1)[0].strip()
+        if key.startswith("export "):
+            key = key[len("export ") :].strip()
+        if key not in values:
+            lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def record_tuned_settings(settings, values, record=None):
+    """
+    Records the config.json settings the tuning adds or replaces, a setting
+    recorded by an earlier tuning keeps its value from before that tuning
+
+    Args:
+        settings (dict): config.json settings before the tuning, None if
+            there is no config.json
+        values (dict): tuned settings
+        record (dict): record of an earlier tuning
+
+    Returns:
+        dict: generated (True if the tuning created config.json), previous
+            values of the replaced settings and names of the added settings
+
+    """
+    record = record or {"generated": settings is None, "previous": {}, "added": []}
+    for name in values:
+        if name in record["previous"] or name in record["added"]:
+            continue
+        if name in (settings or {}):
+            record["previous"][name] = settings[name]
+        else:
+            record["added"].append(name)
+    return record
+
+
+def untuned_settings(settings, record):
+    """
+    Reverts the tuning of the config.json settings
+
+    Args:
+        settings (dict): tuned config.json settings
+        record (dict): record of the tuning, see record_tuned_settings
+
+    Returns:
+        dict: settings without the tuning, None if the tuning created
+            config.json
+
+    Examples:
+        Settings added by the tuning are dropped, overridden ones restored:
+
+        >>> record = record_tuned_settings({"A": 1, "B": 2}, {"B": 3, "C": 4})
+        >>> untuned_settings({"A": 1, "B": 3, "C": 4, "D": 5}, record)
+        {'A': 1, 'B': 2, 'D': 5}
+        >>> untuned_settings({"C": 4}, record_tuned_settings(None, {"C": 4}))
+
+    """
+    if record["generated"]:
+        return None
+    untuned = {
+        name: value for name, value in settings.items() if name not in record["added"]
+    }
+    untuned.update(record["previous"])
+    return untuned
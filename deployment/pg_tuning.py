@@ -0,0 +1,298 @@
+"""
+This module tunes the PostgreSQL metadata DB of DB mode deployments.
+Memory, connection, WAL and checkpoint settings are derived from the host
+resources and the number of endpoint forks, written as a config include
+of the data directory and verified on the running server.
+"""
+
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+
+from deployment.tuning import GB, MB, TuningValue
+
+log = logging.getLogger(__name__)
+
+INCLUDE_DIR = "conf.d"
+TUNING_FILE = "noobaa_tuning.conf"
+DATA_DIR_REGEX = re.compile(r"(?:-D|--pgdata)[ =]?['\"]?([^\s'\"]+)")
+SIZE_REGEX = re.compile(r"^(\d+)\s*(B|kB|MB|GB|TB)$")
+SIZE_UNITS = {"B": 1, "kB": 1024, "MB": MB, "GB": GB, "TB": 1024 * GB}
+TIME_REGEX = re.compile(r"^(\d+)\s*(ms|s|min|h|d)$")
+TIME_UNITS = {"ms": 0.001, "s": 1, "min": 60, "h": 3600, "d": 86400}
+# core services with their own DB pool besides the endpoint forks:
+# web, bg, hosted agents
+CORE_SERVICES = 3
+# values the server reports for a setting set to a synonym, e.g: since
+# PostgreSQL 15 wal_compression is an enum and "on" is reported as "pglz"
+SETTING_SYNONYMS = {
+    "wal_compression": {"on": ("on", "pglz"), "off": ("off",)},
+}
+
+
+def find_data_dir(package_json):
+    """
+    Finds the data directory initialized by the db:init package script
+
+    Args:
+        package_json (str): path to package.json
+
+    Returns:
+        str: absolute path of the data directory, None if not found
+
+    """
+    with open(package_json) as f:
+        package = json.load(f)
+    return data_dir_of(package, os.path.dirname(os.path.abspath(package_json)))
+
+
+def data_dir_of(package, package_dir):
+    """
+    Args:
+        package (dict): parsed package.json
+        package_dir (str): directory of package.json
+
+    Returns:
+        str: absolute path of the data directory initialized by db:init,
+            None if not found
+
+    """
+    script = package.get("scripts", {}).get("db:init", "")
+    match = DATA_DIR_REGEX.search(script)
+    if not match:
+        return None
+    return os.path.normpath(os.path.join(package_dir, match[1]))
+
+
+def is_rotational(path):
+    """
+    Checks whether the path is stored on a rotational disk
+
+    Args:
+        path (str): path on the disk
+
+    Returns:
+        bool: True for rotational disks, False for SSDs or when unknown
+
+    """
+    dev = os.stat(path).st_dev
+    sys_dev = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    # partitions have the queue attributes on their parent device
+    for queue in (f"{sys_dev}/queue", f"{sys_dev}/../queue"):
+        try:
+            with open(f"{queue}/rotational") as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+
+def pg_size(size):
+    """
+    Formats bytes as a PostgreSQL size, in the largest exact unit
+
+    Args:
+        size (int): bytes
+
+    Returns:
+        str: e.g: "512MB"
+
+    """
+    for unit in ("TB", "GB", "MB", "kB"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return f"{max(size // 1024, 1)}kB"
+
+
+def normalize(value):
+    """
+    Normalizes a setting value, so equal sizes and durations compare equal
+
+    Args:
+        value (object): configured or reported setting value
+
+    Returns:
+        object: bytes for sizes, seconds for durations, string otherwise
+
+    """
+    value = str(value).strip()
+    match = SIZE_REGEX.match(value)
+    if match:
+        return int(match[1]) * SIZE_UNITS[match[2]]
+    match = TIME_REGEX.match(value)
+    if match:
+        return int(match[1]) * TIME_UNITS[match[2]]
+    return value
+
+
+def compute_pg_tuning(
+    host, endpoint_forks, memory_fraction=0.25, clients_per_process=10, ssd=True
+):
+    """
+    Computes the PostgreSQL settings for the host
+
+    Args:
+        host (HostInfo): host resources
+        endpoint_forks (int): ENDPOINT_FORKS of the deployment
+        memory_fraction (float): share of the host memory for PostgreSQL,
+            the rest is left for the NooBaa services on the same host
+        clients_per_process (int): DB pool size of every NooBaa process
+        ssd (bool): whether the data directory is on an SSD
+
+    Returns:
+        OrderedDict: setting name to TuningValue
+
+    """
+    tuning = OrderedDict()
+    pg_memory = int(host.memory * memory_fraction)
+    memory_reason = f"{memory_fraction:.3g} of {pg_size(host.memory)} memory"
+
+    processes = endpoint_forks + CORE_SERVICES
+    max_connections = processes * clients_per_process + 20
+    tuning["max_connections"] = TuningValue(
+        max_connections,
+        f"({endpoint_forks} endpoint forks + {CORE_SERVICES} core services) x "
+        f"{clients_per_process} pooled clients + 20 spare",
+    )
+
+    shared_buffers = max(128 * MB, min(pg_memory // 2 // MB * MB, 8 * GB))
+    tuning["shared_buffers"] = TuningValue(
+        pg_size(shared_buffers), f"half of {memory_reason}, 128MB to 8GB"
+    )
+    effective_cache = max(host.memory // 2 // MB * MB, shared_buffers * 2)
+    tuning["effective_cache_size"] = TuningValue(
+        pg_size(effective_cache), "half of the host memory is page cache"
+    )
+    work_mem = (pg_memory - shared_buffers) // (max_connections * 2) // MB * MB
+    work_mem = max(4 * MB, min(work_mem, 64 * MB))
+    tuning["work_mem"] = TuningValue(
+        pg_size(work_mem),
+        f"rest of {memory_reason} over 2 sorts per connection, 4MB to 64MB",
+    )
+    maintenance_work_mem = max(64 * MB, min(pg_memory // 16 // MB * MB, 2 * GB))
+    tuning["maintenance_work_mem"] = TuningValue(
+        pg_size(maintenance_work_mem), f"1/16 of {memory_reason}, 64MB to 2GB"
+    )
+
+    tuning["wal_buffers"] = TuningValue("16MB", "one WAL segment")
+    large = host.memory >= 16 * GB
+    tuning["min_wal_size"] = TuningValue(
+        "1GB" if large else "512MB", "WAL kept for metadata write bursts"
+    )
+    tuning["max_wal_size"] = TuningValue(
+        "8GB" if large else "2GB",
+        "fewer forced checkpoints under metadata heavy load",
+    )
+    tuning["checkpoint_timeout"] = TuningValue("15min", "spreads checkpoint I/O")
+    tuning["checkpoint_completion_target"] = TuningValue(
+        0.9, "spreads checkpoint writes over the interval"
+    )
+    tuning["wal_compression"] = TuningValue("on", "less WAL I/O for full pages")
+
+    tuning["random_page_cost"] = TuningValue(
+        1.1 if ssd else 4, "SSD data directory" if ssd else "rotational disk"
+    )
+    tuning["effective_io_concurrency"] = TuningValue(
+        200 if ssd else 2, "SSD data directory" if ssd else "rotational disk"
+    )
+    tuning["max_worker_processes"] = TuningValue(
+        max(8, host.cpus), f"{host.cpus} CPUs, at least the default 8"
+    )
+    tuning["max_parallel_workers"] = TuningValue(
+        max(8, host.cpus), "same as max_worker_processes"
+    )
+    tuning["max_parallel_workers_per_gather"] = TuningValue(
+        max(1, min(4, host.cpus // 2)), f"half of {host.cpus} CPUs, max 4"
+    )
+    return tuning
+
+
+def render_conf(tuning):
+    """
+    Renders the settings as a PostgreSQL config file
+
+    Args:
+        tuning (OrderedDict): setting name to TuningValue
+
+    Returns:
+        str: config file content
+
+    """
+    lines = ["# Generated by noobaa-sa-infra, changes are overwritten"]
+    for name, item in tuning.items():
+        value = item.value
+        if isinstance(value, str) and not re.match(r"^[\w.]+$", value):
+            value = f"'{value}'"
+        lines.append(f"{name} = {value}  # {item.reason}")
+    return "\n".join(lines) + "\n"
+
+
+def write_conf(data_dir, tuning):
+    """
+    Writes the settings as an include of the data directory config
+
+    Args:
+        data_dir (str): PostgreSQL data directory
+        tuning (OrderedDict): setting name to TuningValue
+
+    Returns:
+        str: path of the written include
+
+    """
+    include_dir = os.path.join(data_dir, INCLUDE_DIR)
+    os.makedirs(include_dir, exist_ok=True)
+    path = os.path.join(include_dir, TUNING_FILE)
+    with open(path, "w") as f:
+        f.write(render_conf(tuning))
+
+    postgresql_conf = os.path.join(data_dir, "postgresql.conf")
+    with open(postgresql_conf) as f:
+        content = f.read()
+    include = f"include_dir = '{INCLUDE_DIR}'"
+    if not re.search(rf"^\s*{re.escape(include)}", content, re.MULTILINE):
+        with open(postgresql_conf, "a") as f:
+            f.write(f"\n# NooBaa tuning\n{include}\n")
+    log.info(f"PostgreSQL tuning written to {path}")
+    return path
+
+
+def mismatches(tuning, current):
+    """
+    Compares the settings with the values reported by the server
+
+    Args:
+        tuning (OrderedDict): setting name to TuningValue
+        current (dict): setting name to the value reported by the server
+
+    Returns:
+        list: settings which didn't take effect, human readable
+
+    Examples:
+        PostgreSQL 15 reports wal_compression set to "on" as "pglz":
+
+        >>> from deployment.tuning import TuningValue
+        >>> tuning = {"wal_compression": TuningValue("on", "")}
+        >>> mismatches(tuning, {"wal_compression": "pglz"})
+        []
+        >>> mismatches(tuning, {"wal_compression": "off"})
+        ['wal_compression: expected on, got off']
+
+    """
+    wrong = []
+    for name, item in tuning.items():
+        expected = normalize(item.value)
+        actual = normalize(current.get(name))
+        if isinstance(expected, str):
+            synonyms = SETTING_SYNONYMS.get(name, {}).get(expected.lower(), ())
+            equal = str(actual).lower() in (expected.lower(), *synonyms)
+            try:
+                equal = equal or float(expected) == float(actual)
+            except ValueError:
+                pass
+        else:
+            equal = expected == actual
+        if not equal:
+            wrong.append(f"{name}: expected {item.value}, got {current.get(name)}")
+    return wrong
@@ -0,0 +1,300 @@
+"""
+This module plans where the backingstore drives go. Drives are spread
+round-robin over mount points or block devices, local filesystems can be
+discovered with their free space, and every drive carries the NUMA node of
+its device so its agent can be pinned to the CPUs of that node.
+"""
+
+import logging
+import os
+import shutil
+from collections import namedtuple
+
+from framework import exceptions
+
+log = logging.getLogger(__name__)
+
+# line of the mount table
+MountEntry = namedtuple(
+    "MountEntry", ["device", "mount_point", "fs_type", "options"]
+)
+# directory drives are created in, its device, free bytes and NUMA node
+Target = namedtuple("Target", ["directory", "device", "free", "numa_node"])
+# filesystems discovered as backingstore targets
+LOCAL_FILESYSTEMS = ("xfs", "ext4", "ext3", "btrfs")
+SYSTEM_MOUNTS = ("/", "/boot", "/boot/efi")
+PINNING_TOOLS = ("taskset", "numactl")
+SYS_BLOCK = "/sys/class/block"
+SYS_NODES = "/sys/devices/system/node"
+
+
+def read_mounts(mounts_file="/proc/mounts"):
+    """
+    Args:
+        mounts_file (str): mount table
+
+    Returns:
+        list: MountEntry for every mount
+
+    """
+    entries = []
+    with open(mounts_file) as f:
+        for line in f:
+            fields = line.split()
+            # spaces in mount points are escaped as \040
+            entries.append(
+                MountEntry(
+                    fields[0],
+                    fields[1].replace("\\040", " "),
+                    fields[2],
+                    fields[3].split(","),
+                )
+            )
+    return entries
+
+
+def find_mount(path, mounts):
+    """
+    Finds the mount a path is on, the path doesn't have to exist yet
+
+    Args:
+        path (str): absolute path
+        mounts (list): MountEntry of every mount, see read_mounts
+
+    Returns:
+        MountEntry: the mount with the longest mount point holding the path
+
+    """
+    path = os.path.realpath(path)
+    # the nearest existing ancestor is on the same mount as the path will be
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    best = MountEntry("none", "/", "unknown", [])
+    for entry in mounts:
+        mount_point = entry.mount_point
+        within = path == mount_point or path.startswith(
+            mount_point.rstrip("/") + "/"
+        )
+        if within and len(mount_point) >= len(best.mount_point):
+            best = entry
+    return best
+
+
+def block_names(device):
+    """
+    Args:
+        device (str): block device, e.g: /dev/nvme0n1p1 or /dev/mapper/vg-lv
+
+    Returns:
+        set: kernel name of the device and of the disk holding the partition
+
+    """
+    name = os.path.basename(os.path.realpath(device))
+    names = {name}
+    sys_path = os.path.join(SYS_BLOCK, name)
+    if os.path.exists(os.path.join(sys_path, "partition")):
+        names.add(os.path.basename(os.path.dirname(os.path.realpath(sys_path))))
+    return names
+
+
+def device_numa_node(device):
+    """
+    Finds the NUMA node of the controller a block device is attached to,
+    device mapper devices take the node of their first underlying device
+
+    Args:
+        device (str): block device
+
+    Returns:
+        int: NUMA node, None if unknown
+
+    """
+    name = os.path.basename(os.path.realpath(device))
+    path = os.path.realpath(os.path.join(SYS_BLOCK, name))
+    if not os.path.exists(path):
+        return None
+    slaves = os.path.join(path, "slaves")
+    if os.path.isdir(slaves) and os.listdir(slaves):
+        return device_numa_node(sorted(os.listdir(slaves))[0])
+    # the node is on the PCI device somewhere above the block device
+    while path.startswith("/sys/devices/"):
+        numa_file = os.path.join(path, "numa_node")
+        if os.path.isfile(numa_file):
+            with open(numa_file) as f:
+                node = int(f.read())
+            return node if node >= 0 else None
+        path = os.path.dirname(path)
+    return None
+
+
+def node_cpus(node):
+    """
+    Args:
+        node (int): NUMA node
+
+    Returns:
+        str: CPU list of the node, e.g: 0-15,32-47
+
+    """
+    with open(os.path.join(SYS_NODES, f"node{node}", "cpulist")) as f:
+        return f.read().strip()
+
+
+def free_bytes(path):
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def discover_mounts(mounts, min_free=0):
+    """
+    Discovers the writable local filesystems drives can be placed on
+
+    Args:
+        mounts (list): MountEntry of every mount, see read_mounts
+        min_free (int): bytes a filesystem needs free to be a candidate
+
+    Returns:
+        list: MountEntry of the candidates, the most free space first
+
+    """
+    candidates = {}
+    for entry in mounts:
+        if (
+            not entry.device.startswith("/dev/")
+            or entry.fs_type not in LOCAL_FILESYSTEMS
+            or "ro" in entry.options
+            or entry.mount_point in SYSTEM_MOUNTS
+            or entry.mount_point.startswith("/boot/")
+        ):
+            continue
+        free = free_bytes(entry.mount_point)
+        device = os.path.realpath(entry.device)
+        # bind mounts of a device count once
+        if free >= min_free and device not in candidates:
+            candidates[device] = (free, entry)
+    ranked = sorted(candidates.values(), key=lambda c: c[0], reverse=True)
+    return [entry for _, entry in ranked]
+
+
+def mount_of_device(device, mounts):
+    """
+    Args:
+        device (str): block device or one of its partitions
+        mounts (list): MountEntry of every mount, see read_mounts
+
+    Returns:
+        MountEntry: the first mount of the device
+
+    Raises:
+        DrivePlacementError: In case the device is not mounted
+
+    """
+    name = os.path.basename(os.path.realpath(device))
+    for entry in mounts:
+        if entry.device.startswith("/dev/") and name in block_names(entry.device):
+            return entry
+    raise exceptions.DrivePlacementError(f"{device} is not mounted")
+
+
+def resolve_targets(targets, subdir, min_free=0, mounts_file="/proc/mounts"):
+    """
+    Resolves the placement targets into the directories drives go in
+
+    Args:
+        targets (list|str): mount points, directories or block devices,
+            "auto" discovers the local filesystems
+        subdir (str): directory of the drives on every mount point
+        min_free (int): bytes a discovered filesystem needs free
+        mounts_file (str): mount table
+
+    Returns:
+        list: Target for every target, in the given order
+
+    Raises:
+        DrivePlacementError: In case a block device is not mounted or
+            nothing is discovered
+
+    """
+    mounts = read_mounts(mounts_file)
+    if targets == "auto":
+        entries = discover_mounts(mounts, min_free)
+        if not entries:
+            raise exceptions.DrivePlacementError(
+                f"No local filesystem with {min_free} bytes free for the drives"
+            )
+        directories = [
+            (os.path.join(entry.mount_point, subdir), entry.device)
+            for entry in entries
+        ]
+    else:
+        directories = []
+        for target in targets:
+            if target.startswith("/dev/"):
+                entry = mount_of_device(target, mounts)
+                directories.append((os.path.join(entry.mount_point, subdir), target))
+            else:
+                entry = find_mount(target, mounts)
+                directory = target
+                if os.path.realpath(target) == entry.mount_point:
+                    directory = os.path.join(target, subdir)
+                directories.append((directory, entry.device))
+    resolved = []
+    for directory, device in directories:
+        numa_node = device_numa_node(device) if device.startswith("/dev/") else None
+        free = free_bytes(find_mount(directory, mounts).mount_point)
+        log.info(
+            f"backingstore target {directory} on {device}: "
+            f"{free // 2**30}GB free, NUMA node {numa_node}"
+        )
+        resolved.append(Target(directory, device, free, numa_node))
+    return resolved
+
+
+def spread_drives(targets, count, prefix):
+    """
+    Spreads the drives round-robin over the targets
+
+    Args:
+        targets (list): Target of every directory, see resolve_targets
+        count (int): number of drives
+        prefix (str): prefix of every drive directory name
+
+    Returns:
+        list: (drive path, NUMA node of its device) for every drive
+
+    """
+    drives = []
+    for num in range(count):
+        target = targets[num % len(targets)]
+        drives.append(
+            (os.path.join(target.directory, f"{prefix}{num}"), target.numa_node)
+        )
+    return drives
+
+
+def pin_command(tool, numa_node):
+    """
+    Builds the command prefix pinning a process to a NUMA node
+
+    Args:
+        tool (str): taskset, numactl, or none for no pinning
+        numa_node (int): NUMA node, None for no pinning
+
+    Returns:
+        list: argv prefix, empty if the process is not pinned
+
+    Raises:
+        DrivePlacementError: In case the pinning tool is unknown or missing
+
+    """
+    if tool in (None, "none") or numa_node is None:
+        return []
+    if tool not in PINNING_TOOLS:
+        raise exceptions.DrivePlacementError(
+            f"Unknown pinning tool '{tool}', one of {PINNING_TOOLS} or none"
+        )
+    if shutil.which(tool) is None:
+        raise exceptions.DrivePlacementError(f"{tool} is not installed")
+    if tool == "numactl":
+        return ["numactl", f"--cpunodebind={numa_node}", f"--preferred={numa_node}"]
+    return ["taskset", "-c", node_cpus(numa_node)]
@@ -0,0 +1,295 @@
+"""
+This module provides readiness probes for the NooBaa services, so deployment
+steps can wait for a service to come up instead of sleeping a fixed time.
+"""
+
+import http.client
+import logging
+import os
+import re
+import shutil
+import socket
+import ssl
+import struct
+import time
+from urllib.parse import urlparse
+
+from common_ci_utils.command_runner import exec_cmd
+from framework import exceptions
+
+log = logging.getLogger(__name__)
+
+# SSLRequest message code, see PostgreSQL frontend/backend protocol
+PG_SSL_REQUEST_CODE = 80877103
+
+
+class Probe(object):
+    """
+    Base class for readiness probes
+    """
+
+    def check(self):
+        """
+        Checks once whether the target is ready
+
+        Returns:
+            bool: True if the target is ready, False otherwise
+
+        """
+        raise NotImplementedError
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class TCPProbe(Probe):
+    """
+    Probe which is ready once a TCP port accepts connections
+    """
+
+    def __init__(self, host, port, connect_timeout=2):
+        """
+        Args:
+            host (str): host to connect to
+            port (int): port to connect to
+            connect_timeout (float): timeout for a single connect attempt
+
+        """
+        self.host = host
+        self.port = int(port)
+        self.connect_timeout = connect_timeout
+
+    def check(self):
+        try:
+            with socket.create_connection(
+                (self.host, self.port), timeout=self.connect_timeout
+            ):
+                return True
+        except OSError:
+            return False
+
+    def __str__(self):
+        return f"tcp://{self.host}:{self.port}"
+
+
+class PostgresProbe(TCPProbe):
+    """
+    Probe which is ready once PostgreSQL accepts connections, similar to
+    pg_isready. Uses the pg_isready binary when available, otherwise sends
+    an SSLRequest and expects a valid single byte answer from the server.
+    """
+
+    def check(self):
+        if shutil.which("pg_isready"):
+            cmd = f"pg_isready -h {self.host} -p {self.port}"
+            return exec_cmd(cmd=cmd, timeout=self.connect_timeout + 5).returncode == 0
+        try:
+            with socket.create_connection(
+                (self.host, self.port), timeout=self.connect_timeout
+            ) as sock:
+                sock.sendall(struct.pack("!ii", 8, PG_SSL_REQUEST_CODE))
+                return sock.recv(1) in (b"S", b"N")
+        except OSError:
+            return False
+
+    def __str__(self):
+        return f"postgres://{self.host}:{self.port}"
+
+
+class HTTPProbe(Probe):
+    """
+    Probe which is ready once an HTTP(S) or WS(S) endpoint answers.
+    For ws/wss urls a websocket upgrade request is sent, any HTTP answer
+    below 500 means the server is up.
+    """
+
+    def __init__(self, url, connect_timeout=2, max_status=499):
+        """
+        Args:
+            url (str): endpoint url (http, https, ws or wss)
+            connect_timeout (float): timeout for a single request
+            max_status (int): highest HTTP status considered as ready
+
+        """
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.max_status = max_status
+
+    def check(self):
+        parsed = urlparse(self.url)
+        secure = parsed.scheme in ("https", "wss")
+        headers = {}
+        if parsed.scheme in ("ws", "wss"):
+            headers = {
+                "Connection": "Upgrade",
+                "Upgrade": "websocket",
+                "Sec-WebSocket-Version": "13",
+                "Sec-WebSocket-Key": "bm9vYmFhLXNhLWluZnJhLQ==",
+            }
+        if secure:
+            # NooBaa services use self signed certificates
+            context = ssl._create_unverified_context()
+            conn = http.client.HTTPSConnection(
+                parsed.hostname,
+                parsed.port,
+                timeout=self.connect_timeout,
+                context=context,
+            )
+        else:
+            conn = http.client.HTTPConnection(
+                parsed.hostname, parsed.port, timeout=self.connect_timeout
+            )
+        try:
+            conn.request("GET", parsed.path or "/", headers=headers)
+            return conn.getresponse().status <= self.max_status
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            conn.close()
+
+    def __str__(self):
+        return self.url
+
+
+class LogLineProbe(Probe):
+    """
+    Probe which is ready once a line matching the regex shows up in a log file.
+    The file is read incrementally between checks.
+    """
+
+    def __init__(self, path, pattern):
+        """
+        Args:
+            path (str): path to the log file
+            pattern (str): regex to search for
+
+        """
+        self.path = path
+        self.regex = re.compile(pattern)
+        self._offset = 0
+
+    def check(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # only consume complete lines, keep the partial one for the next check
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        for line in data[:end].decode(errors="replace").splitlines():
+            if self.regex.search(line):
+                return True
+        return False
+
+    def __str__(self):
+        return f"log {self.path} =~ /{self.regex.pattern}/"
+
+
+def build_probe(spec, host="localhost", **overrides):
+    """
+    Builds a probe from its config spec
+
+    Args:
+        spec (dict): probe spec, e.g: {"type": "wss", "port": 5443}
+            supported types: tcp, postgres, http, https, ws, wss, log
+        host (str): host the service runs on, unless the spec sets "host"
+        overrides: values which override the spec, e.g: port=9991
+
+    Returns:
+        Probe: probe object
+
+    """
+    spec = {**spec, **overrides}
+    host = spec.get("host", host)
+    probe_type = spec["type"]
+    connect_timeout = spec.get("connect_timeout", 2)
+    if probe_type == "tcp":
+        return TCPProbe(host, spec["port"], connect_timeout)
+    if probe_type == "postgres":
+        return PostgresProbe(host, spec.get("port", 5432), connect_timeout)
+    if probe_type in ("http", "https", "ws", "wss"):
+        url = f"{probe_type}://{host}:{spec['port']}{spec.get('path', '/')}"
+        return HTTPProbe(url, connect_timeout)
+    if probe_type == "log":
+        return LogLineProbe(spec["path"], spec["pattern"])
+    raise ValueError(f"Unknown readiness probe type: {probe_type}")
+
+
+def wait_for_ready(
+    probe, timeout=300, interval=0.5, max_interval=10, backoff_factor=2
+):
+    """
+    Polls the probe with exponential backoff until it is ready
+
+    Args:
+        probe (Probe): probe to check
+        timeout (float): seconds to wait before giving up
+        interval (float): seconds to wait after the first failed check
+        max_interval (float): upper bound for the wait between checks
+        backoff_factor (float): multiplier applied to the wait after each check
+
+    Returns:
+        float: seconds it took for the probe to become ready
+
+    Raises:
+        ReadinessTimeout: In case the probe is not ready within timeout
+
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    attempts = 0
+    while True:
+        attempts += 1
+        if probe.check():
+            elapsed = time.monotonic() - start
+            log.info(f"{probe} is ready after {elapsed:.2f}s ({attempts} checks)")
+            return elapsed
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise exceptions.ReadinessTimeout(
+                f"{probe} is not ready after {timeout}s ({attempts} checks)"
+            )
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff_factor, max_interval)
+
+
+def wait_for_all_ready(
+    probes, timeout=300, interval=0.5, max_interval=10, backoff_factor=2
+):
+    """
+    Polls many probes in one pass with exponential backoff until all are
+    ready, probes which are ready are not checked again
+
+    Args:
+        probes (list): probes to check
+        timeout (float): seconds to wait for all probes before giving up
+        interval (float): seconds to wait after the first failed round
+        max_interval (float): upper bound for the wait between rounds
+        backoff_factor (float): multiplier applied to the wait after each round
+
+    Returns:
+        float: seconds it took for all probes to become ready
+
+    Raises:
+        ReadinessTimeout: In case any probe is not ready within timeout
+
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    remaining_probes = list(probes)
+    while True:
+        remaining_probes = [probe for probe in remaining_probes if not probe.check()]
+        if not remaining_probes:
+            elapsed = time.monotonic() - start
+            log.info(f"{len(probes)} probes are ready after {elapsed:.2f}s")
+            return elapsed
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            not_ready = ", ".join(str(probe) for probe in remaining_probes)
+            raise exceptions.ReadinessTimeout(
+                f"{len(remaining_probes)} of {len(probes)} probes are not ready "
+                f"after {timeout}s: {not_ready}"
+            )
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff_factor, max_interval)
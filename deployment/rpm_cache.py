@@ -0,0 +1,287 @@
+"""
+This module holds an on-disk RPM cache. RPMs are stored by the sha256 of
+their content and indexed by URL, cached entries are revalidated with
+conditional requests (ETag/Last-Modified) and the least recently used
+entries are evicted once the cache grows over its size limit.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+import requests
+
+from deployment.downloader import RangedDownloader
+from framework import exceptions
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256sum(path):
+    """
+    Calculates sha256 of a file
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        str: hex digest
+
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RPMCache(object):
+    """
+    Content addressed RPM cache
+
+    Layout of the cache directory:
+        index.json                  url -> entry (sha256, etag, last_modified, ...)
+        objects/<sha256>/<rpm name> RPM content
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        max_size_mb=4096,
+        download_workers=1,
+        chunk_size_mb=16,
+        session=None,
+    ):
+        """
+        Args:
+            cache_dir (str): directory holding the cache
+            max_size_mb (int): max size of all cached RPMs in MB
+            download_workers (int): number of parallel ranges used to download
+                an RPM, 1 downloads it with a single stream
+            chunk_size_mb (int): size of a single range in MB
+            session (requests.Session): session used for the requests
+
+        """
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        self.partial_dir = os.path.join(self.cache_dir, "partial")
+        self.index_file = os.path.join(self.cache_dir, "index.json")
+        self.max_size = max_size_mb * 1024 * 1024
+        self.download_workers = download_workers
+        self.chunk_size = chunk_size_mb * 1024 * 1024
+        self.session = session or requests.Session()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked_index(self):
+        """
+        Holds an exclusive lock on the cache, so deployments running on the
+        same host don't corrupt the index
+
+        Yields:
+            dict: index, changes are saved on exit
+
+        """
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = {}
+                if os.path.exists(self.index_file):
+                    with open(self.index_file) as f:
+                        index = json.load(f)
+                yield index
+                tmp_index = f"{self.index_file}.tmp"
+                with open(tmp_index, "w") as f:
+                    json.dump(index, f, indent=2)
+                os.replace(tmp_index, self.index_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _object_path(self, entry):
+        return os.path.join(self.objects_dir, entry["sha256"], entry["file_name"])
+
+    def fetch(self, rpm_url, username=None, password=None, checksum=None):
+        """
+        Returns a local path of the RPM, downloading it only when it is not
+        cached or changed on the server
+
+        Args:
+            rpm_url (str): RPM URL to download
+            username (str): username (optional when authentication is required)
+            password (str): password (optional when authentication is required)
+            checksum (str): expected sha256 of the RPM (optional)
+
+        Returns:
+            str: Path to the verified RPM file
+
+        Raises:
+            RPMChecksumMismatch: In case the RPM doesn't match the checksum
+            requests.RequestException: In case rpm failed to download
+
+        """
+        auth = (username, password) if username and password else None
+        mismatch = None
+        with self._locked_index() as index:
+            entry, cached = self._revalidate(index, rpm_url, auth)
+            if checksum and cached and entry["sha256"] != checksum.lower():
+                log.warning(
+                    f"Cached RPM for {rpm_url} doesn't match the checksum, "
+                    "downloading it again"
+                )
+                self._remove_entry(index, rpm_url)
+                entry, cached = self._revalidate(index, rpm_url, auth)
+
+            rpm_path = self._object_path(entry)
+            if checksum and entry["sha256"] != checksum.lower():
+                # dropped, so the next run doesn't revalidate the same content
+                self._remove_entry(index, rpm_url)
+                mismatch = exceptions.RPMChecksumMismatch(
+                    f"sha256 of {rpm_path} is {entry['sha256']}, expected {checksum}"
+                )
+            else:
+                entry["last_used"] = time.time()
+                self._evict(index, keep=rpm_url)
+        if mismatch:
+            raise mismatch
+        return rpm_path
+
+    def _revalidate(self, index, rpm_url, auth=None):
+        """
+        Revalidates the cached RPM with a conditional request, downloading
+        it when it is not cached or changed on the server
+
+        Args:
+            index (dict): cache index
+            rpm_url (str): RPM URL
+            auth (tuple): (username, password), None without authentication
+
+        Returns:
+            tuple: (index entry of the RPM, True if the cached RPM is used)
+
+        """
+        entry = index.get(rpm_url)
+        if entry and not self._is_valid(entry):
+            log.warning(f"Cached RPM for {rpm_url} is corrupted, dropping it")
+            self._remove_entry(index, rpm_url)
+            entry = None
+
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.session.get(rpm_url, auth=auth, headers=headers, stream=True)
+        with response:
+            if entry and response.status_code == 304:
+                log.info(f"Using cached RPM for {rpm_url}")
+                return entry, True
+            response.raise_for_status()
+            entry = self._store(rpm_url, response, auth)
+            index[rpm_url] = entry
+        return entry, False
+
+    def _is_valid(self, entry):
+        """
+        Verifies the cached object still matches its content address
+        """
+        path = self._object_path(entry)
+        return os.path.exists(path) and sha256sum(path) == entry["sha256"]
+
+    def _store(self, rpm_url, response, auth=None):
+        """
+        Downloads the RPM of the response into the cache, with parallel
+        resumable ranges when the server supports them
+
+        Returns:
+            dict: index entry of the stored RPM
+
+        """
+        file_name = os.path.basename(rpm_url.split("?")[0])
+        # Artifactory publishes the checksum of the artifact
+        expected = response.headers.get("X-Checksum-Sha256")
+        ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        if self.download_workers > 1 and ranges:
+            response.close()
+            # stable name per URL, so an interrupted download is resumed
+            url_hash = hashlib.sha256(rpm_url.encode()).hexdigest()
+            tmp_path = os.path.join(self.partial_dir, f"{url_hash}.part")
+            downloader = RangedDownloader(
+                rpm_url,
+                tmp_path,
+                auth=auth,
+                workers=self.download_workers,
+                chunk_size=self.chunk_size,
+                session=self.session,
+            )
+            sha256 = downloader.download(checksum=expected)
+            size = os.path.getsize(tmp_path)
+        else:
+            digest = hashlib.sha256()
+            size = 0
+            with tempfile.NamedTemporaryFile(dir=self.partial_dir, delete=False) as tmp:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    tmp.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            tmp_path = tmp.name
+            sha256 = digest.hexdigest()
+            if expected and expected.lower() != sha256:
+                os.remove(tmp_path)
+                raise exceptions.RPMChecksumMismatch(
+                    f"sha256 of {rpm_url} is {sha256}, server reported {expected}"
+                )
+
+        entry = {
+            "sha256": sha256,
+            "file_name": file_name,
+            "size": size,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        rpm_path = self._object_path(entry)
+        os.makedirs(os.path.dirname(rpm_path), exist_ok=True)
+        os.replace(tmp_path, rpm_path)
+        log.info(f"Downloaded RPM package to {rpm_path} ({size} bytes)")
+        return entry
+
+    def _remove_entry(self, index, url):
+        """
+        Removes the entry, the object is deleted once no URL refers to it
+        """
+        entry = index.pop(url)
+        if not any(e["sha256"] == entry["sha256"] for e in index.values()):
+            shutil.rmtree(
+                os.path.join(self.objects_dir, entry["sha256"]), ignore_errors=True
+            )
+
+    def _evict(self, index, keep):
+        """
+        Evicts least recently used entries till the cache fits its size limit
+
+        Args:
+            index (dict): cache index
+            keep (str): URL which must stay cached
+
+        """
+        objects = {e["sha256"]: e["size"] for e in index.values()}
+        total = sum(objects.values())
+        by_age = sorted(index, key=lambda url: index[url].get("last_used", 0))
+        for url in by_age:
+            if total <= self.max_size:
+                break
+            if url == keep:
+                continue
+            sha256 = index[url]["sha256"]
+            log.info(f"Evicting cached RPM {url}")
+            self._remove_entry(index, url)
+            if sha256 not in {e["sha256"] for e in index.values()}:
+                total -= objects[sha256]
@@ -0,0 +1,223 @@
+"""
+This module holds a minimal S3 client for exercising the deployed endpoint.
+Requests are signed with AWS Signature Version 4 by a requests auth plugin,
+so they go through the pooled HTTPClient without any S3 SDK.
+"""
+
+import datetime
+import hashlib
+import hmac
+import logging
+import xml.etree.ElementTree as ET
+from urllib.parse import quote, urlsplit
+
+from requests.auth import AuthBase
+
+from deployment.http_client import HTTPClient
+
+log = logging.getLogger(__name__)
+
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+class SigV4Auth(AuthBase):
+    """
+    Signs requests with AWS Signature Version 4, the payload is not hashed
+    (UNSIGNED-PAYLOAD) to keep the client out of the measured path
+    """
+
+    def __init__(self, access_key, secret_key, region="us-east-1", service="s3"):
+        """
+        Args:
+            access_key (str): S3 access key
+            secret_key (str): S3 secret key
+            region (str): signing region
+            service (str): signing service
+
+        """
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.service = service
+        self._signing_keys = {}
+
+    def signing_key(self, date):
+        """
+        Derives the signing key of a day, derived keys are cached
+
+        Args:
+            date (str): day in YYYYMMDD format
+
+        Returns:
+            bytes: signing key
+
+        """
+        key = self._signing_keys.get(date)
+        if key is None:
+            key = _hmac(f"AWS4{self.secret_key}".encode(), date)
+            for part in (self.region, self.service, "aws4_request"):
+                key = _hmac(key, part)
+            self._signing_keys = {date: key}
+        return key
+
+    def __call__(self, request):
+        url = urlsplit(request.url)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+        host = url.hostname
+        if url.port and url.port != DEFAULT_PORTS.get(url.scheme):
+            host = f"{host}:{url.port}"
+        request.headers["Host"] = host
+        request.headers["x-amz-date"] = amz_date
+        request.headers["x-amz-content-sha256"] = UNSIGNED_PAYLOAD
+
+        query = []
+        for pair in url.query.split("&") if url.query else []:
+            name, _, value = pair.partition("=")
+            query.append((name, value))
+        canonical_query = "&".join(f"{name}={value}" for name, value in sorted(query))
+        signed = {
+            "host": host,
+            "x-amz-content-sha256": UNSIGNED_PAYLOAD,
+            "x-amz-date": amz_date,
+        }
+        canonical_headers = "".join(f"{name}:{signed[name]}\n" for name in signed)
+        signed_headers = ";".join(signed)
+        canonical_request = "\n".join(
+            [
+                request.method,
+                url.path or "/",
+                canonical_query,
+                canonical_headers,
+                signed_headers,
+                UNSIGNED_PAYLOAD,
+            ]
+        )
+        scope = f"{date}/{self.region}/{self.service}/aws4_request"
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                scope,
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            ]
+        )
+        signature = hmac.new(
+            self.signing_key(date), string_to_sign.encode(), hashlib.sha256
+        ).hexdigest()
+        request.headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return request
+
+
+class S3Client(object):
+    """
+    Path style S3 client over a pooled HTTP session
+    """
+
+    def __init__(
+        self, endpoint, access_key, secret_key, region="us-east-1", pool_size=16
+    ):
+        """
+        Args:
+            endpoint (str): S3 endpoint URL, e.g: "http://localhost:6001"
+            access_key (str): S3 access key
+            secret_key (str): S3 secret key
+            region (str): signing region
+            pool_size (int): max number of kept alive connections
+
+        """
+        self.endpoint = endpoint.rstrip("/")
+        # failures are measured, not retried
+        self.session = HTTPClient(
+            auth=SigV4Auth(access_key, secret_key, region),
+            pool_size=pool_size,
+            retries=0,
+        )
+
+    def url(self, bucket, key=""):
+        """
+        Returns:
+            str: path style URL of the bucket or object, already URI encoded
+                as signed
+
+        """
+        path = quote(f"/{bucket}/{key}" if key else f"/{bucket}", safe="/-_.~")
+        return f"{self.endpoint}{path}"
+
+    def _request(self, method, url, **kwargs):
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code >= 300:
+            raise RuntimeError(
+                f"{method} {url} failed with {response.status_code}: "
+                f"{response.text[:500]}"
+            )
+        return response
+
+    def create_bucket(self, bucket):
+        """
+        Creates the bucket, an existing bucket owned by us is fine
+        """
+        response = self.session.put(self.url(bucket))
+        if response.status_code >= 300 and "BucketAlreadyOwnedByYou" not in (
+            response.text
+        ):
+            raise RuntimeError(
+                f"creating bucket {bucket} failed with {response.status_code}: "
+                f"{response.text[:500]}"
+            )
+
+    def put_object(self, bucket, key, data):
+        """
+        Uploads an object
+
+        Returns:
+            int: uploaded bytes
+
+        """
+        self._request("PUT", self.url(bucket, key), data=data)
+        return len(data)
+
+    def get_object(self, bucket, key, chunk_size=1024 * 1024):
+        """
+        Downloads an object and discards its content
+
+        Returns:
+            int: downloaded bytes
+
+        """
+        size = 0
+        with self._request("GET", self.url(bucket, key), stream=True) as response:
+            for chunk in response.iter_content(chunk_size):
+                size += len(chunk)
+        return size
+
+    def list_objects(self, bucket, prefix="", max_keys=1000):
+        """
+        Lists one page of objects
+
+        Returns:
+            list: keys of the listed objects
+
+        """
+        query = f"list-type=2&max-keys={max_keys}"
+        if prefix:
+            query += f"&prefix={quote(prefix, safe='-_.~')}"
+        response = self._request("GET", f"{self.url(bucket)}?{query}")
+        root = ET.fromstring(response.content)
+        return [key.text for key in root.iter(f"{S3_NAMESPACE}Key")]
+
+    def delete_object(self, bucket, key):
+        """
+        Deletes an object
+        """
+        self._request("DELETE", self.url(bucket, key))
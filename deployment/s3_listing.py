@@ -0,0 +1,153 @@
+"""
+This module lists S3 buckets with ListObjectsV2. Pages are followed with
+continuation tokens and each page is parsed incrementally, so listing a
+bucket with many objects keeps a constant memory footprint.
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import requests
+
+log = logging.getLogger(__name__)
+
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+REGEX_SPECIAL_CHARS = set(".^$*+?{}[]|()")
+LITERAL_ESCAPES = REGEX_SPECIAL_CHARS | set("\\/-")
+
+
+def literal_prefix(pattern):
+    """
+    Returns the literal prefix of a regex, which can be used to narrow an
+    S3 listing server side, e.g: "noobaa-core-" for "noobaa-core-.*\\.rpm"
+
+    Args:
+        pattern (str): regex pattern
+
+    Returns:
+        str: literal prefix of the pattern
+
+    """
+    if "|" in pattern:
+        # alternatives don't share a prefix
+        return ""
+    prefix = []
+    i = 1 if pattern.startswith("^") else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and pattern[i + 1 : i + 2] in LITERAL_ESCAPES:
+            # escaped special chars are literals, \d, \w, ... are classes
+            literal, i = pattern[i + 1], i + 2
+        elif char == "\\" or char in REGEX_SPECIAL_CHARS:
+            break
+        else:
+            literal, i = char, i + 1
+        quantifier = pattern[i : i + 1]
+        if quantifier in ("*", "?", "{"):
+            # the literal is optional or repeated
+            break
+        prefix.append(literal)
+        if quantifier == "+":
+            break
+    return "".join(prefix)
+
+
+def list_objects_v2(bucket_url, prefix=None, start_after=None, session=None):
+    """
+    Lists all objects of a bucket, following continuation tokens
+
+    Args:
+        bucket_url (str): bucket URL, e.g: https://bucket.s3.amazonaws.com
+        prefix (str): list only keys starting with the prefix
+        start_after (str): list only keys after this key
+        session (requests.Session): session used for the requests
+
+    Yields:
+        tuple: (key, last modified) of every object
+
+    Raises:
+        requests.HTTPError: In case a page failed to be fetched
+
+    """
+    session = session or requests.Session()
+    params = {"list-type": "2"}
+    if prefix:
+        params["prefix"] = prefix
+    if start_after:
+        params["start-after"] = start_after
+    pages = 0
+    while True:
+        response = session.get(bucket_url, params=params, stream=True)
+        pages += 1
+        page = {}
+        with response:
+            # inside the with, so an error response releases its connection
+            response.raise_for_status()
+            response.raw.decode_content = True
+            yield from _parse_page(response.raw, page)
+        if page.get("IsTruncated") != "true" or not page.get("NextContinuationToken"):
+            log.debug(f"Listed {bucket_url} in {pages} pages")
+            return
+        params["continuation-token"] = page["NextContinuationToken"]
+        params.pop("start-after", None)
+
+
+def _parse_page(stream, page):
+    """
+    Parses a ListObjectsV2 page incrementally
+
+    Args:
+        stream (file): file like object with the XML page
+        page (dict): filled with the pagination fields of the page
+            (IsTruncated, NextContinuationToken)
+
+    Yields:
+        tuple: (key, last modified) of every object
+
+    """
+    key = last_modified = None
+    root = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if root is None:
+            root = elem
+            continue
+        if event != "end":
+            continue
+        tag = elem.tag[len(S3_NAMESPACE) :]
+        if tag == "Key":
+            key = elem.text
+        elif tag == "LastModified":
+            last_modified = elem.text
+        elif tag in ("IsTruncated", "NextContinuationToken"):
+            page[tag] = elem.text
+        elif tag == "Contents":
+            yield key, last_modified
+            key = last_modified = None
+            # drop the parsed objects, only one object is held in memory
+            root.clear()
+
+
+def find_latest(objects, regex):
+    """
+    Finds the latest modified object matching the regex, keeping only the
+    best candidate in memory
+
+    Args:
+        objects (iterable): (key, last modified) tuples
+        regex (re.Pattern): pattern the key has to match
+
+    Returns:
+        str: key of the latest object, None if no object matches
+
+    """
+    latest_key = None
+    latest_date = datetime.min
+    for key, last_modified in objects:
+        if not regex.match(key):
+            continue
+        last_modified_date = datetime.strptime(last_modified, "%Y-%m-%dT%H:%M:%S.%fZ")
+        if last_modified_date > latest_date:
+            latest_key = key
+            latest_date = last_modified_date
+    return latest_key
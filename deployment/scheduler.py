@@ -0,0 +1,151 @@
+"""
+This module runs deployment steps declared as a dependency graph (DAG).
+Independent steps run concurrently on a thread pool, each step starts
+only once all the steps it depends on completed successfully.
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from framework import exceptions
+from framework.tracing import bind_context, tracer
+
+log = logging.getLogger(__name__)
+
+
+class Step(object):
+    """
+    A single node of the dependency graph
+    """
+
+    def __init__(self, name, func, depends_on=()):
+        """
+        Args:
+            name (str): unique name of the step, e.g: "web ready"
+            func (callable): callable without arguments which runs the step
+            depends_on (iterable): names of the steps this step depends on
+
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+
+class DependencyScheduler(object):
+    """
+    Runs steps concurrently honoring their dependencies and fails fast
+    """
+
+    def __init__(self, max_workers=8):
+        """
+        Args:
+            max_workers (int): max number of steps running at the same time
+
+        """
+        self.max_workers = max_workers
+        self.steps = {}
+
+    def add_step(self, name, func, depends_on=()):
+        """
+        Adds a step to the graph
+
+        Args:
+            name (str): unique name of the step
+            func (callable): callable without arguments which runs the step
+            depends_on (iterable): names of the steps this step depends on
+
+        """
+        if name in self.steps:
+            raise ValueError(f"Step '{name}' is already defined")
+        self.steps[name] = Step(name, func, depends_on)
+
+    def validate(self):
+        """
+        Validates that all dependencies exist and that the graph has no cycles
+
+        Raises:
+            ValueError: In case the graph is not a valid DAG
+
+        """
+        for step in self.steps.values():
+            for dep in step.depends_on:
+                if dep not in self.steps:
+                    raise ValueError(
+                        f"Step '{step.name}' depends on unknown step '{dep}'"
+                    )
+        # Kahn's algorithm, whatever is left is part of a cycle
+        indegree = {name: len(step.depends_on) for name, step in self.steps.items()}
+        ready = [name for name, count in indegree.items() if count == 0]
+        visited = 0
+        while ready:
+            name = ready.pop()
+            visited += 1
+            for dependent in self._dependents(name):
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+        if visited != len(self.steps):
+            cycle = sorted(name for name, count in indegree.items() if count)
+            raise ValueError(f"Dependency cycle between steps: {cycle}")
+
+    def _dependents(self, name):
+        return [step.name for step in self.steps.values() if name in step.depends_on]
+
+    def run(self):
+        """
+        Runs all the steps
+
+        Returns:
+            dict: step name to its duration in seconds
+
+        Raises:
+            StepFailed: In case any step failed, no new steps are started
+                after the first failure
+
+        """
+        self.validate()
+        pending = {name: set(step.depends_on) for name, step in self.steps.items()}
+        durations = {}
+        running = {}
+        failure = None
+
+        def _timed(step):
+            start = time.monotonic()
+            with tracer.span(step.name, step=True):
+                step.func()
+            return time.monotonic() - start
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if failure is None:
+                    for name in [n for n, deps in pending.items() if not deps]:
+                        del pending[name]
+                        log.info(f"Starting step '{name}'")
+                        future = executor.submit(
+                            bind_context(_timed, self.steps[name])
+                        )
+                        running[future] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        log.error(f"Step '{name}' failed: {error!r}")
+                        failure = failure or (name, error)
+                        continue
+                    durations[name] = future.result()
+                    log.info(f"Step '{name}' completed in {durations[name]:.2f}s")
+                    for deps in pending.values():
+                        deps.discard(name)
+
+        if failure:
+            name, error = failure
+            raise exceptions.StepFailed(
+                f"Step '{name}' failed: {error!r}\n"
+                f"Completed steps: {sorted(durations)}\n"
+                f"Not started steps: {sorted(pending)}"
+            ) from error
+        return durations
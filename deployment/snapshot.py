@@ -0,0 +1,347 @@
+"""
+This module snapshots the bootstrapped state of a DB mode deployment.
+The storage directory, PostgreSQL data directory and backingstore drives
+are archived into a compressed, checksummed tarball keyed by the RPM NEVRA
+and a hash of the deployment config, so identical systems are restored
+instead of bootstrapped again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+
+from deployment.rpm_cache import sha256sum
+from deployment.supervisor import process_start_time
+from framework import exceptions
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# compressor, its arguments and the archive extension, first available wins
+COMPRESSORS = (
+    ("zstd", ["-T0", "-q"], "tar.zst"),
+    ("pigz", [], "tar.gz"),
+    ("gzip", [], "tar.gz"),
+)
+# suffixes of the extracted copy and of the replaced copy of every path
+STAGING_SUFFIX = ".restore"
+REPLACED_SUFFIX = ".replaced"
+# characters of a path escaped in the regex and replacement of a tar
+# --transform expression
+BRE_SPECIAL = "\\.[]*^$,"
+REPLACEMENT_SPECIAL = "\\&,"
+
+
+def snapshot_key(nevra, config_hash):
+    """
+    Returns:
+        str: snapshot key of the RPM and config
+
+    """
+    return f"{nevra}-{config_hash[:16]}"
+
+
+def top_level_paths(paths):
+    """
+    Drops the paths nested in other paths
+
+    Args:
+        paths (list): absolute paths
+
+    Returns:
+        list: sorted paths none of which is inside another
+
+    """
+    result = []
+    for path in sorted(os.path.normpath(path) for path in paths):
+        if not any(path == p or path.startswith(p + os.sep) for p in result):
+            result.append(path)
+    return result
+
+
+def within(path, paths):
+    return any(path == p or path.startswith(p + os.sep) for p in paths)
+
+
+def processes_using(paths):
+    """
+    Finds the processes running in or holding files open under the paths,
+    e.g: a postgres server of a data directory
+
+    Args:
+        paths (list): absolute paths
+
+    Returns:
+        list: pids of the processes, other than this one
+
+    """
+    paths = [os.path.realpath(path) for path in paths]
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            links = [os.readlink(f"/proc/{entry}/cwd")] + [
+                os.readlink(f"/proc/{entry}/fd/{fd}")
+                for fd in os.listdir(f"/proc/{entry}/fd")
+            ]
+        except OSError:
+            continue
+        if any(within(link, paths) for link in links):
+            pids.append(int(entry))
+    return pids
+
+
+def postmaster_pid(path):
+    """
+    Args:
+        path (str): directory which may be a PostgreSQL data directory
+
+    Returns:
+        int: pid of the live postgres server of the directory, None if there
+            is none
+
+    """
+    try:
+        with open(os.path.join(path, "postmaster.pid")) as f:
+            pid = int(f.readline())
+    except (OSError, ValueError):
+        return None
+    return pid if process_start_time(pid) is not None else None
+
+
+def staging_transform(path):
+    """
+    Builds the tar --transform expression extracting a path of the archive
+    next to itself, symlink targets are left as they are
+
+    Args:
+        path (str): absolute path stored in the archive
+
+    Returns:
+        str: transform expression
+
+    """
+    name = path.lstrip(os.sep)
+    regex = "".join(f"\\{c}" if c in BRE_SPECIAL else c for c in name)
+    staged = "".join(f"\\{c}" if c in REPLACEMENT_SPECIAL else c for c in name)
+    return f"s,^{regex}\\(/.*\\)\\?$,{staged}{STAGING_SUFFIX}\\1,S"
+
+
+class SnapshotStore(object):
+    """
+    Directory of snapshot archives and their manifests
+    """
+
+    def __init__(self, snapshot_dir, keep=3, timeout=1800):
+        """
+        Args:
+            snapshot_dir (str): directory of the snapshots
+            keep (int): number of most recent snapshots kept
+            timeout (float): seconds to wait for archiving or extracting
+
+        """
+        self.snapshot_dir = os.path.abspath(os.path.expanduser(snapshot_dir))
+        self.keep = keep
+        self.timeout = timeout
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    def _manifest_path(self, key):
+        return os.path.join(self.snapshot_dir, f"{key}.json")
+
+    def find(self, key):
+        """
+        Returns:
+            dict: manifest of the snapshot, None if there is no snapshot
+
+        """
+        path = self._manifest_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            manifest = json.load(f)
+        if not os.path.exists(os.path.join(self.snapshot_dir, manifest["archive"])):
+            return None
+        return manifest
+
+    def create(self, key, paths, metadata=None):
+        """
+        Archives the paths, the archive is hashed while it is written
+
+        Args:
+            key (str): snapshot key
+            paths (list): absolute paths to archive
+            metadata (dict): extra information stored in the manifest
+
+        Returns:
+            dict: manifest of the snapshot
+
+        """
+        compressor, args, extension = next(
+            c for c in COMPRESSORS if shutil.which(c[0])
+        )
+        paths = top_level_paths(paths)
+        archive = f"{key}.{extension}"
+        archive_path = os.path.join(self.snapshot_dir, archive)
+        tmp_path = f"{archive_path}.tmp"
+        start = time.monotonic()
+        # paths are stored relative to /, so they are restored in place
+        tar = subprocess.Popen(
+            ["tar", "-C", "/", "-cf", "-"] + [p.lstrip(os.sep) for p in paths],
+            stdout=subprocess.PIPE,
+        )
+        compress = subprocess.Popen(
+            [compressor, *args, "-c"], stdin=tar.stdout, stdout=subprocess.PIPE
+        )
+        tar.stdout.close()
+        digest = hashlib.sha256()
+        size = 0
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: compress.stdout.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        compress.stdout.close()
+        if tar.wait(self.timeout) != 0 or compress.wait(self.timeout) != 0:
+            os.remove(tmp_path)
+            raise RuntimeError(
+                f"Archiving {paths} failed, tar exited with {tar.returncode}, "
+                f"{compressor} with {compress.returncode}"
+            )
+        os.replace(tmp_path, archive_path)
+        manifest = {
+            "key": key,
+            "archive": archive,
+            "compressor": compressor,
+            "sha256": digest.hexdigest(),
+            "size": size,
+            "paths": paths,
+            "created_at": time.time(),
+            **(metadata or {}),
+        }
+        with open(self._manifest_path(key), "w") as f:
+            json.dump(manifest, f, indent=2)
+        log.info(
+            f"Snapshot {key} of {paths} created in {time.monotonic() - start:.1f}s, "
+            f"{size / 1024 / 1024:.1f}MB"
+        )
+        self.prune()
+        return manifest
+
+    def restore(self, manifest):
+        """
+        Verifies the archive, extracts its paths next to the current ones
+        and swaps them in, the current content of the paths is kept until
+        every path is extracted and swapped
+
+        Args:
+            manifest (dict): manifest of the snapshot
+
+        Raises:
+            SnapshotPathsInUse: In case a process runs in or holds files
+                under the paths, e.g: the postgres server
+            RuntimeError: In case the archive is corrupted or can't be
+                extracted
+
+        """
+        archive_path = os.path.join(self.snapshot_dir, manifest["archive"])
+        paths = manifest["paths"]
+        start = time.monotonic()
+        live = [pid for pid in map(postmaster_pid, paths) if pid is not None]
+        live += processes_using(paths)
+        if live:
+            raise exceptions.SnapshotPathsInUse(
+                f"Processes {sorted(set(live))} use {paths}, stop them to restore"
+            )
+        if sha256sum(archive_path) != manifest["sha256"]:
+            raise RuntimeError(f"Snapshot archive {archive_path} is corrupted")
+        for path in paths:
+            if os.path.lexists(f"{path}{REPLACED_SUFFIX}"):
+                raise RuntimeError(
+                    f"{path}{REPLACED_SUFFIX} is left from an interrupted "
+                    f"restore, move it back to {path} or remove it"
+                )
+            if os.path.isdir(f"{path}{STAGING_SUFFIX}"):
+                shutil.rmtree(f"{path}{STAGING_SUFFIX}")
+        decompress = subprocess.Popen(
+            [manifest["compressor"], "-d", "-c", archive_path],
+            stdout=subprocess.PIPE,
+        )
+        transforms = [f"--transform={staging_transform(path)}" for path in paths]
+        tar = subprocess.Popen(
+            ["tar", "-C", "/", *transforms, "-xpf", "-"], stdin=decompress.stdout
+        )
+        decompress.stdout.close()
+        tar.wait(self.timeout)
+        decompress.wait(self.timeout)
+        if tar.returncode != 0 or decompress.returncode != 0:
+            self._remove_staging(paths)
+            raise RuntimeError(
+                f"Extracting snapshot {archive_path} failed, tar exited with "
+                f"{tar.returncode}, {manifest['compressor']} with "
+                f"{decompress.returncode}"
+            )
+        self._swap_in(paths)
+        log.info(
+            f"Snapshot {manifest['key']} restored in "
+            f"{time.monotonic() - start:.1f}s"
+        )
+
+    def _remove_staging(self, paths):
+        for path in paths:
+            if os.path.isdir(f"{path}{STAGING_SUFFIX}"):
+                shutil.rmtree(f"{path}{STAGING_SUFFIX}")
+
+    def _swap_in(self, paths):
+        """
+        Renames the extracted copies over the paths, all of them are rolled
+        back if one fails
+
+        Args:
+            paths (list): absolute paths of the snapshot
+
+        """
+        swapped = []
+        try:
+            for path in paths:
+                replaced = os.path.lexists(path)
+                if replaced:
+                    os.rename(path, f"{path}{REPLACED_SUFFIX}")
+                try:
+                    os.rename(f"{path}{STAGING_SUFFIX}", path)
+                except OSError:
+                    if replaced:
+                        os.rename(f"{path}{REPLACED_SUFFIX}", path)
+                    raise
+                swapped.append((path, replaced))
+        except OSError:
+            for path, replaced in reversed(swapped):
+                os.rename(path, f"{path}{STAGING_SUFFIX}")
+                if replaced:
+                    os.rename(f"{path}{REPLACED_SUFFIX}", path)
+            self._remove_staging(paths)
+            raise
+        for path, replaced in swapped:
+            if replaced:
+                shutil.rmtree(f"{path}{REPLACED_SUFFIX}")
+
+    def prune(self):
+        """
+        Removes all but the most recent snapshots
+        """
+        manifests = []
+        for name in os.listdir(self.snapshot_dir):
+            if name.endswith(".json"):
+                with open(os.path.join(self.snapshot_dir, name)) as f:
+                    manifests.append(json.load(f))
+        manifests.sort(key=lambda manifest: manifest["created_at"], reverse=True)
+        for manifest in manifests[self.keep :]:
+            log.info(f"Removing old snapshot {manifest['key']}")
+            for name in (manifest["archive"], f"{manifest['key']}.json"):
+                path = os.path.join(self.snapshot_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
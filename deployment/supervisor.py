@@ -0,0 +1,480 @@
+"""
+This module supervises the detached NooBaa service processes. The
+supervisor owns the child handles, restarts services which exit
+unexpectedly with a backoff and tears the whole process tree down. The
+output of the services goes straight to per-service log files, so they
+outlive the deployer; a supervisor kept in the foreground drains it into
+rotating log files and an in-memory ring buffer instead.
+"""
+
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+log = logging.getLogger(__name__)
+
+# pid file of a supervisor keeping the services in the foreground
+SUPERVISOR_PID_FILE = "supervisor.pid"
+# bytes read from the end of a log file for its last lines
+TAIL_BYTES = 64 * 1024
+# DB mode services, dependents before the services they depend on
+DB_STOP_ORDER = ("backingstore", "s3", "hosted_agents", "bg", "web", "db")
+
+
+def child_pids(pid):
+    """
+    Returns all descendants of a process, read from /proc
+
+    Args:
+        pid (int): process id
+
+    Returns:
+        list: pids of all descendants, parents before their children
+
+    """
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command may contain spaces, fields after it are fixed
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    descendants = []
+    queue = [pid]
+    while queue:
+        for child in children.get(queue.pop(0), []):
+            descendants.append(child)
+            queue.append(child)
+    return descendants
+
+
+def process_start_time(pid):
+    """
+    Returns:
+        str: start time of the process in clock ticks since boot, None if
+            the process doesn't exist or is a zombie
+
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return None if fields[0] == "Z" else fields[19]
+
+
+def read_pid_file(path):
+    """
+    Reads a pid file written by the supervisor
+
+    Args:
+        path (str): path of the pid file
+
+    Returns:
+        int: pid of the process, None if it is gone or the pid was reused
+
+    """
+    try:
+        with open(path) as f:
+            pid, start_time = f.read().split()
+    except (OSError, ValueError):
+        return None
+    pid = int(pid)
+    return pid if process_start_time(pid) == start_time else None
+
+
+def terminate_tree(pid, timeout=10):
+    """
+    Terminates a process and all its descendants, killing what is left
+    after timeout
+
+    Args:
+        pid (int): process id
+        timeout (float): seconds to wait for a graceful exit
+
+    """
+    pids = [pid] + child_pids(pid)
+    for p in pids:
+        try:
+            os.kill(p, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(process_start_time(p) is None for p in pids):
+            return
+        time.sleep(0.1)
+    for p in pids:
+        try:
+            os.kill(p, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def stop_order(name):
+    """
+    Returns:
+        int: position of a service in DB_STOP_ORDER, unknown services last
+
+    """
+    base = name.split("-", 1)[0]
+    return DB_STOP_ORDER.index(base) if base in DB_STOP_ORDER else len(DB_STOP_ORDER)
+
+
+def stop_recorded_services(pid_dir, timeout=10, names=None):
+    """
+    Stops the services recorded in the pid files of a supervisor, e.g:
+    services started by an earlier deployment, in reverse dependency order.
+    The pid file of a foreground supervisor is left alone.
+
+    Args:
+        pid_dir (str): directory of the pid files, the service log directory
+        timeout (float): seconds to wait for each service to exit
+        names (iterable): services to stop, e.g: ["backingstore-9991"],
+            all recorded services by default
+
+    """
+    if not os.path.isdir(pid_dir):
+        return
+    recorded = [
+        name[: -len(".pid")]
+        for name in os.listdir(pid_dir)
+        if name.endswith(".pid") and name != SUPERVISOR_PID_FILE
+    ]
+    names = recorded if names is None else set(names).intersection(recorded)
+    for name in sorted(names, key=stop_order):
+        pid_file = os.path.join(pid_dir, f"{name}.pid")
+        pid = read_pid_file(pid_file)
+        if pid is not None:
+            log.info(f"Stopping service '{name}' with pid {pid}")
+            terminate_tree(pid, timeout=timeout)
+        if os.path.exists(pid_file):
+            os.remove(pid_file)
+
+
+class ManagedProcess(object):
+    """
+    A supervised service process and its output
+    """
+
+    def __init__(
+        self,
+        name,
+        launch,
+        log_file,
+        max_log_bytes,
+        log_backups,
+        ring_size,
+        pid_file,
+        capture=False,
+    ):
+        """
+        Args:
+            name (str): service name
+            launch (callable): starts the service with stdout=<pipe or file>
+                and returns its Popen, stderr merged into stdout
+            log_file (str): path of the service log file
+            pid_file (str): path of the file recording the pid and start time,
+                for stopping the service from another process
+            max_log_bytes (int): size at which the log file is rotated
+            log_backups (int): number of rotated log files to keep
+            ring_size (int): number of last output lines kept in memory
+            capture (bool): If True, the output is piped and drained by this
+                process, otherwise the service writes the log file itself
+
+        """
+        self.name = name
+        self.launch = launch
+        self.log_file = log_file
+        self.pid_file = pid_file
+        self.capture = capture
+        self.popen = None
+        self.restarts = 0
+        self.started_at = None
+        self.next_restart = None
+        self.failed = False
+        self.lines = deque(maxlen=ring_size)
+        self.output = logging.getLogger(f"{__name__}.{name}")
+        self.output.propagate = False
+        self.output.setLevel(logging.INFO)
+        if capture and not self.output.handlers:
+            handler = RotatingFileHandler(
+                log_file, maxBytes=max_log_bytes, backupCount=log_backups
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.output.addHandler(handler)
+
+    @property
+    def pid(self):
+        return self.popen.pid if self.popen else None
+
+    def start(self):
+        """
+        Launches the process and starts draining its pipe, or with its
+        output appended to the log file
+        """
+        if self.capture:
+            self.popen = self.launch(stdout=subprocess.PIPE)
+        else:
+            with open(self.log_file, "ab") as f:
+                self.popen = self.launch(stdout=f)
+        self.started_at = time.monotonic()
+        with open(self.pid_file, "w") as f:
+            f.write(f"{self.popen.pid} {process_start_time(self.popen.pid)}\n")
+        log.info(f"service '{self.name}' started with pid {self.popen.pid}")
+        for stream in (self.popen.stdout, self.popen.stderr):
+            if stream is not None:
+                threading.Thread(
+                    target=self._drain,
+                    args=(stream,),
+                    name=f"drain-{self.name}",
+                    daemon=True,
+                ).start()
+
+    def _drain(self, stream):
+        """
+        Reads the pipe till EOF, so the child never blocks on a full pipe
+        """
+        with stream:
+            for raw_line in iter(stream.readline, b""):
+                line = raw_line.decode(errors="replace").rstrip("\n")
+                self.lines.append(line)
+                self.output.info(line)
+
+    def tail(self, count=20):
+        """
+        Returns the last lines of output
+
+        Args:
+            count (int): number of lines
+
+        Returns:
+            list: last output lines
+
+        """
+        if self.capture:
+            return list(self.lines)[-count:]
+        try:
+            with open(self.log_file, "rb") as f:
+                f.seek(max(0, os.fstat(f.fileno()).st_size - TAIL_BYTES))
+                data = f.read()
+        except OSError:
+            return []
+        return data.decode(errors="replace").splitlines()[-count:]
+
+    def is_running(self):
+        return self.popen is not None and self.popen.poll() is None
+
+    def stop(self, timeout=10):
+        """
+        Terminates the process tree, killing what is left after timeout
+
+        Args:
+            timeout (float): seconds to wait for a graceful exit
+
+        """
+        if self.popen is None:
+            return
+        terminate_tree(self.popen.pid, timeout=timeout)
+        self.popen.wait()
+        if os.path.exists(self.pid_file):
+            os.remove(self.pid_file)
+        log.info(f"service '{self.name}' stopped")
+
+
+class Supervisor(object):
+    """
+    Owns the service processes, restarts the ones which exit unexpectedly
+    """
+
+    def __init__(
+        self,
+        log_dir,
+        max_log_bytes=50 * 1024 * 1024,
+        log_backups=3,
+        ring_size=1000,
+        max_restarts=5,
+        restart_backoff=1,
+        max_restart_backoff=60,
+        poll_interval=1,
+        capture=False,
+    ):
+        """
+        Args:
+            log_dir (str): directory of the per-service log files
+            max_log_bytes (int): size at which a log file is rotated
+            log_backups (int): number of rotated log files to keep
+            ring_size (int): number of last output lines kept per service
+            max_restarts (int): restarts of a service before giving up on it
+            restart_backoff (float): seconds before the first restart, doubled
+                for every following restart
+            max_restart_backoff (float): upper bound of the restart backoff
+            poll_interval (float): seconds between liveness checks
+            capture (bool): If True, the output is drained into rotating log
+                files and ring buffers, for a supervisor which stays in the
+                foreground; otherwise the services write their log files
+                directly and keep running after this process exits
+
+        """
+        self.log_dir = os.path.abspath(os.path.expanduser(log_dir))
+        self.max_log_bytes = max_log_bytes
+        self.log_backups = log_backups
+        self.ring_size = ring_size
+        self.max_restarts = max_restarts
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.poll_interval = poll_interval
+        self.capture = capture
+        self.processes = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._monitor = None
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def start(self, name, launch):
+        """
+        Launches and supervises a service
+
+        Args:
+            name (str): unique service name, e.g: "web", "backingstore-9991"
+            launch (callable): starts the service and returns its Popen
+
+        Returns:
+            ManagedProcess: the supervised process
+
+        """
+        process = ManagedProcess(
+            name,
+            launch,
+            os.path.join(self.log_dir, f"{name}.log"),
+            self.max_log_bytes,
+            self.log_backups,
+            self.ring_size,
+            os.path.join(self.log_dir, f"{name}.pid"),
+            capture=self.capture,
+        )
+        process.start()
+        with self._lock:
+            self.processes[name] = process
+            if self._monitor is None:
+                self._monitor = threading.Thread(
+                    target=self._watch, name="supervisor", daemon=True
+                )
+                self._monitor.start()
+        return process
+
+    def _watch(self):
+        """
+        Detects exited services and restarts them with a backoff
+        """
+        while not self._stopping.wait(self.poll_interval):
+            with self._lock:
+                processes = list(self.processes.values())
+            for process in processes:
+                if process.failed or process.is_running():
+                    continue
+                now = time.monotonic()
+                if process.next_restart is None:
+                    code = process.popen.returncode
+                    output = "\n".join(process.tail())
+                    log.error(
+                        f"service '{process.name}' exited with {code}, "
+                        f"last output:\n{output}"
+                    )
+                    if process.restarts >= self.max_restarts:
+                        log.error(f"giving up on restarting service '{process.name}'")
+                        process.failed = True
+                        continue
+                    backoff = min(
+                        self.restart_backoff * 2**process.restarts,
+                        self.max_restart_backoff,
+                    )
+                    process.next_restart = now + backoff
+                if now < process.next_restart:
+                    continue
+                with self._lock:
+                    # stop_all may have started tearing down meanwhile
+                    if self._stopping.is_set():
+                        return
+                    process.restarts += 1
+                    process.next_restart = None
+                    log.info(
+                        f"restarting service '{process.name}' "
+                        f"({process.restarts}/{self.max_restarts})"
+                    )
+                    process.start()
+
+    def failed_services(self):
+        """
+        Returns:
+            list: names of services which exhausted their restarts
+
+        """
+        with self._lock:
+            return [name for name, p in self.processes.items() if p.failed]
+
+    def tail(self, name, count=20):
+        """
+        Returns the last output lines of a service
+
+        Args:
+            name (str): service name
+            count (int): number of lines
+
+        Returns:
+            list: last output lines
+
+        """
+        return self.processes[name].tail(count)
+
+    def stop_all(self, order=None, timeout=10):
+        """
+        Stops supervising and tears down all service process trees
+
+        Args:
+            order (list): service names to stop first, in this order,
+                the remaining services are stopped afterwards
+            timeout (float): seconds to wait for each service to exit
+
+        """
+        with self._lock:
+            self._stopping.set()
+            names = list(self.processes)
+        ordered = [name for name in order or [] if name in names]
+        ordered += [name for name in reversed(names) if name not in ordered]
+        for name in ordered:
+            self.processes[name].stop(timeout=timeout)
+
+    def wait(self):
+        """
+        Keeps supervising in the foreground till SIGINT/SIGTERM, then tears
+        down all services
+        """
+        stop = threading.Event()
+        previous = {
+            sig: signal.signal(sig, lambda *_: stop.set())
+            for sig in (signal.SIGINT, signal.SIGTERM)
+        }
+        log.info(
+            f"supervising {len(self.processes)} services, logs in {self.log_dir}"
+        )
+        pid_file = os.path.join(self.log_dir, SUPERVISOR_PID_FILE)
+        with open(pid_file, "w") as f:
+            f.write(f"{os.getpid()} {process_start_time(os.getpid())}\n")
+        try:
+            stop.wait()
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            self.stop_all()
+            os.remove(pid_file)
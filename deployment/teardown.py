@@ -0,0 +1,377 @@
+"""
+This module tears a NooBaa Standalone deployment down. The services are
+stopped in reverse dependency order, the created artifacts are removed and
+the ledger forgets the undone steps. The installed packages can be kept, so
+a following deployment skips the RPM download and install.
+"""
+
+import json
+import logging
+import os
+import signal
+import time
+
+from common_ci_utils.command_runner import exec_cmd
+from common_ci_utils.service_manager import is_service_running, stop_service
+from deployment.deployment import (
+    install_file,
+    is_rpm_installed,
+    rpm_transaction_lock,
+)
+from deployment.ledger import StepLedger
+from deployment.nsfs_tuning import ENV_MARKER, TUNED_RECORD, untuned_settings
+from deployment.pg_tuning import find_data_dir
+from deployment.placement import resolve_targets, spread_drives
+from deployment.supervisor import (
+    DB_STOP_ORDER,
+    SUPERVISOR_PID_FILE,
+    process_start_time,
+    read_pid_file,
+    stop_recorded_services,
+    terminate_tree,
+)
+from framework import config, exceptions
+
+log = logging.getLogger(__name__)
+
+NOOBAA_RPM = "noobaa-core"
+NSFS_SERVICE = "noobaa"
+# commands of the DB mode service processes
+SERVICE_COMMANDS = ("node", "npm", "postgres", "postmaster")
+
+
+def script_signatures(package_json, scripts=DB_STOP_ORDER):
+    """
+    Args:
+        package_json (str): path of the noobaa-core package.json
+        scripts (tuple): names of the DB mode scripts
+
+    Returns:
+        list: argv of npm running every script and the paths in the script
+            commands, e.g: src/server/web_server.js
+
+    """
+    with open(package_json) as f:
+        commands = json.load(f).get("scripts", {})
+    signatures = []
+    for name in scripts:
+        signatures += [["npm", "run", name], ["npm", "run-script", name]]
+        signatures += [
+            [token] for token in commands.get(name, "").split() if "/" in token
+        ]
+    return signatures
+
+
+def in_unit(pid, unit):
+    """
+    Returns:
+        bool: True if the process belongs to the systemd unit
+
+    """
+    try:
+        with open(f"/proc/{pid}/cgroup") as f:
+            return f"/{unit}.service" in f.read()
+    except OSError:
+        return False
+
+
+def contains(argv, fragment):
+    """
+    Returns:
+        bool: True if the fragment is a contiguous part of the argv
+
+    """
+    return any(
+        argv[i : i + len(fragment)] == fragment
+        for i in range(len(argv) - len(fragment) + 1)
+    )
+
+
+def find_db_mode_pids(
+    core_dir, data_dir, signatures, commands=SERVICE_COMMANDS, unit=NSFS_SERVICE
+):
+    """
+    Finds the DB mode service processes a deployment didn't record the pids
+    of: postgres running in the data directory, and node or npm running a
+    DB mode script from the noobaa-core directory. The processes of the
+    NSFS systemd unit, which also runs node from noobaa-core, are left alone.
+
+    Args:
+        core_dir (str): noobaa-core directory
+        data_dir (str): PostgreSQL data directory, None if unknown
+        signatures (list): argv fragments of the DB mode scripts, see
+            script_signatures
+        commands (tuple): process names to consider, so shells of users
+            browsing the directories are left alone
+        unit (str): systemd unit whose processes are never matched
+
+    Returns:
+        list: pids of the DB mode processes
+
+    """
+    own = {os.getpid(), os.getppid()}
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) in own or in_unit(entry, unit):
+            continue
+        try:
+            with open(f"/proc/{entry}/comm") as f:
+                if f.read().strip() not in commands:
+                    continue
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                argv = f.read().decode(errors="replace").split("\0")
+            cwd = os.readlink(f"/proc/{entry}/cwd")
+        except OSError:
+            continue
+        if data_dir and (cwd == data_dir or cwd.startswith(data_dir + os.sep)):
+            pids.append(int(entry))
+        elif (cwd == core_dir or cwd.startswith(core_dir + os.sep)) and any(
+            contains(argv, signature) for signature in signatures
+        ):
+            pids.append(int(entry))
+    return pids
+
+
+class Teardown(object):
+    """
+    Stops the services and removes the artifacts of a deployment
+    """
+
+    def __init__(self, keep_packages=False, timeout=10):
+        """
+        Args:
+            keep_packages (bool): If True, the noobaa-core RPM and the postgres
+                packages stay installed for a warm redeploy
+            timeout (float): seconds to wait for each service to exit
+
+        """
+        self.keep_packages = keep_packages
+        self.timeout = timeout
+        self.pid_dir = os.path.abspath(
+            os.path.expanduser(config.DEPLOYMENT["service_log_dir"])
+        )
+        self.ledger = StepLedger(config.DEPLOYMENT["ledger_file"])
+
+    def postgres_data_dir(self):
+        """
+        Returns:
+            str: PostgreSQL data directory, None if it can't be found
+
+        """
+        if config.ENV_DATA.get("postgres_data_dir"):
+            return config.ENV_DATA["postgres_data_dir"]
+        package_json = config.ENV_DATA["package_json"]
+        return find_data_dir(package_json) if os.path.exists(package_json) else None
+
+    def stop_supervisor(self):
+        """
+        Stops a foreground supervisor, which stops its own services, so it
+        doesn't restart the services stopped by the teardown
+        """
+        pid_file = os.path.join(self.pid_dir, SUPERVISOR_PID_FILE)
+        pid = read_pid_file(pid_file)
+        if pid is None:
+            return
+        log.info(f"Stopping the supervisor with pid {pid}")
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.timeout * (len(DB_STOP_ORDER) + 1)
+        while time.monotonic() < deadline and process_start_time(pid) is not None:
+            time.sleep(0.1)
+        if process_start_time(pid) is not None:
+            log.warning(f"Supervisor with pid {pid} didn't exit, killing it")
+            os.kill(pid, signal.SIGKILL)
+
+    def stop_db_services(self):
+        """
+        Stops the DB mode services in reverse dependency order, then the
+        leftover processes running the DB mode scripts or postgres of the
+        data directory
+        """
+        self.stop_supervisor()
+        stop_recorded_services(self.pid_dir, timeout=self.timeout)
+
+        package_json = config.ENV_DATA["package_json"]
+        data_dir = self.postgres_data_dir()
+        leftovers = find_db_mode_pids(
+            os.path.realpath(config.ENV_DATA["noobaa_core_dir"]),
+            data_dir and os.path.realpath(data_dir),
+            script_signatures(package_json) if os.path.exists(package_json) else [],
+        )
+        for pid in leftovers:
+            if process_start_time(pid) is not None:
+                log.info(f"Stopping leftover process {pid}")
+                terminate_tree(pid, timeout=self.timeout)
+
+    def stop_nsfs_service(self):
+        """
+        Stops the NSFS systemd service
+        """
+        if is_service_running(name=NSFS_SERVICE, use_sudo=True):
+            log.info(f"Stopping service '{NSFS_SERVICE}'")
+            stop_service(name=NSFS_SERVICE, use_sudo=True)
+
+    def backing_store_drives(self):
+        """
+        Returns:
+            list: backingstore drive directory, or the drives spread over
+                backing_store_targets which exist
+
+        """
+        targets = config.DEPLOYMENT["backing_store_targets"]
+        if not targets:
+            return [config.DEPLOYMENT["backing_store_drive_path"]]
+        try:
+            resolved = resolve_targets(
+                targets, config.DEPLOYMENT["backing_store_subdir"]
+            )
+        except exceptions.DrivePlacementError as ex:
+            log.warning(f"Backingstore drives not found, they are kept: {ex}")
+            return []
+        drives = spread_drives(
+            resolved,
+            config.DEPLOYMENT["backing_stores"],
+            config.DEPLOYMENT["backing_store_drive_prefix"],
+        )
+        return [path for path, _ in drives if os.path.exists(path)]
+
+    def db_artifacts(self):
+        """
+        Returns:
+            list: paths created by the DB mode deployment
+
+        """
+        paths = [
+            config.ENV_DATA["storage_dir"],
+            *self.backing_store_drives(),
+            config.ENV_DATA["env_file"],
+            config.ENV_DATA["config_local"],
+        ]
+        data_dir = self.postgres_data_dir()
+        if data_dir:
+            paths.append(data_dir)
+        else:
+            log.warning("PostgreSQL data directory not found, it is kept")
+        return paths
+
+    def nsfs_artifacts(self):
+        """
+        Returns:
+            list: symbolic links and the generated .env of the NSFS deployment,
+                files which were replaced by something else are kept
+
+        """
+        env = os.path.join(config.ENV_DATA["noobaa_conf_dir"], ".env")
+        links = {
+            env: config.ENV_DATA["nsfs_env"],
+            os.path.join(
+                config.ENV_DATA["bin_dir"], config.ENV_DATA["node_cmd"]
+            ): config.ENV_DATA["noobaa_core_dir"],
+        }
+        paths = [
+            link
+            for link, target in links.items()
+            if os.path.islink(link)
+            and os.path.realpath(link).startswith(os.path.realpath(target))
+        ]
+        if os.path.isfile(env) and not os.path.islink(env):
+            with open(env) as f:
+                if ENV_MARKER in f.read():
+                    paths.append(env)
+        return paths
+
+    def untune_nsfs_config(self):
+        """
+        Reverts the settings the tuning added to or replaced in config.json,
+        a config.json created by the tuning is removed
+
+        Returns:
+            list: the generated config.json and the record of the tuning
+
+        """
+        conf_dir = config.ENV_DATA["noobaa_conf_dir"]
+        config_json = os.path.join(conf_dir, "config.json")
+        record_path = os.path.join(conf_dir, TUNED_RECORD)
+        if not os.path.exists(record_path):
+            return []
+        with open(record_path) as f:
+            record = json.load(f)
+        if not os.path.exists(config_json):
+            return [record_path]
+        with open(config_json) as f:
+            settings = untuned_settings(json.load(f), record)
+        if settings is None:
+            return [config_json, record_path]
+        log.info(f"Reverting the tuned settings of {config_json}")
+        install_file(json.dumps(settings, indent=2), config_json)
+        return [record_path]
+
+    def remove(self, paths):
+        """
+        Removes the paths, with sudo as most of them are owned by root
+
+        Args:
+            paths (list): files, directories or symbolic links
+
+        """
+        paths = [path for path in paths if os.path.lexists(path)]
+        if not paths:
+            return
+        log.info(f"Removing {', '.join(paths)}")
+        exec_cmd(cmd=f"rm -rf {' '.join(paths)}", use_sudo=True)
+
+    def remove_packages(self, db):
+        """
+        Removes the noobaa-core RPM, and the postgres packages with DB
+
+        Args:
+            db (bool): If True, the postgres packages are removed too
+
+        """
+        packages = [NOOBAA_RPM]
+        if db:
+            packages += [str(p) for p in config.ENV_DATA.get("db_packages", [])]
+        packages = [p for p in packages if is_rpm_installed(p)]
+        if not packages:
+            return
+        log.info(f"Removing packages {', '.join(packages)}")
+        with rpm_transaction_lock:
+            exec_cmd(cmd=f"yum remove -y {' '.join(packages)}", use_sudo=True)
+
+    def reset_ledger(self, db):
+        """
+        Drops the ledger records of the undone steps
+
+        Args:
+            db (bool): If True, the DB mode steps are dropped too
+
+        """
+        steps = []
+        if db:
+            steps += ["db init", "db create", "backingstores"]
+        if not self.keep_packages:
+            steps += ["rpm install"] + (["postgres install"] if db else [])
+        for step in steps:
+            self.ledger.invalidate(step)
+
+    def run(self, db=True, nsfs=True):
+        """
+        Tears the deployment down
+
+        Args:
+            db (bool): If True, the DB mode deployment is torn down
+            nsfs (bool): If True, the NSFS deployment is torn down
+
+        """
+        if nsfs:
+            self.stop_nsfs_service()
+            self.remove(self.nsfs_artifacts() + self.untune_nsfs_config())
+        if db:
+            self.stop_db_services()
+            self.remove(self.db_artifacts())
+        if not self.keep_packages:
+            self.remove_packages(db)
+        self.reset_ledger(db)
+        log.info(
+            "Teardown completed"
+            + (", packages are kept for a warm redeploy" if self.keep_packages else "")
+        )
@@ -0,0 +1,170 @@
+"""
+This module holds the transports commands are run on a host through.
+Remote hosts are reached over SSH with the common_ci_utils Connection,
+the local transport runs commands in a subprocess, e.g: for trying a
+multi-host inventory on a single machine.
+"""
+
+import abc
+import logging
+import os
+import shutil
+import subprocess
+
+from framework import exceptions
+
+log = logging.getLogger(__name__)
+
+
+class Transport(abc.ABC):
+    """
+    Base class for transports, commands are run through a shell.
+    A transport missing exec_cmd or upload_file can't be constructed.
+    """
+
+    def __init__(self, host):
+        """
+        Args:
+            host (str): hostname or IP of the host
+
+        """
+        self.host = host
+
+    @abc.abstractmethod
+    def exec_cmd(self, cmd):
+        """
+        Executes a command on the host
+
+        Args:
+            cmd (str): shell command
+
+        Returns:
+            tuple: return code, stdout and stderr of the command
+
+        """
+
+    def run(self, cmd):
+        """
+        Executes a command on the host which has to succeed
+
+        Args:
+            cmd (str): shell command
+
+        Returns:
+            str: stdout of the command
+
+        Raises:
+            RemoteCommandFailed: In case the command exits with non zero code
+
+        """
+        retcode, stdout, stderr = self.exec_cmd(cmd)
+        if retcode != 0:
+            raise exceptions.RemoteCommandFailed(
+                f"'{cmd}' failed on {self.host} with {retcode}: {stderr}"
+            )
+        return stdout
+
+    @abc.abstractmethod
+    def upload_file(self, localpath, remotepath):
+        """
+        Copies a local file to the host
+
+        Args:
+            localpath (str): local file
+            remotepath (str): target path on the host, including the file name
+
+        """
+
+    def close(self):
+        """
+        Releases the connection to the host
+        """
+
+    def __str__(self):
+        return f"{type(self).__name__}({self.host})"
+
+
+class LocalTransport(Transport):
+    """
+    Runs commands on this machine in a subprocess
+    """
+
+    def __init__(self, host="localhost", timeout=3600):
+        """
+        Args:
+            host (str): address the host is reached at by the other hosts
+            timeout (float): seconds a command may run
+
+        """
+        super().__init__(host)
+        self.timeout = timeout
+
+    def exec_cmd(self, cmd):
+        log.debug(f"Executing cmd: {cmd} locally for {self.host}")
+        result = subprocess.run(
+            ["bash", "-c", cmd],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            timeout=self.timeout,
+        )
+        return (
+            result.returncode,
+            result.stdout.decode().strip("\n"),
+            result.stderr.decode(errors="replace").strip("\n"),
+        )
+
+    def upload_file(self, localpath, remotepath):
+        if os.path.realpath(localpath) != os.path.realpath(remotepath):
+            shutil.copyfile(localpath, remotepath)
+
+
+class SSHTransport(Transport):
+    """
+    Runs commands on a remote host over SSH, the connection is opened on
+    first use and shared by all the commands
+    """
+
+    def __init__(self, host, user=None, private_key=None, password=None):
+        """
+        Args:
+            host (str): hostname or IP of the host
+            user (str): username to connect with
+            private_key (str): private key to connect with
+            password (str): password, used when there is no private key
+
+        """
+        super().__init__(host)
+        if not (private_key or password):
+            raise exceptions.InventoryError(
+                f"Host {host} needs a private_key or password for SSH"
+            )
+        self.user = user
+        self.private_key = private_key
+        self.password = password
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            # paramiko is loaded only by deployments with SSH hosts
+            from common_ci_utils.connection import Connection
+
+            self._connection = Connection(
+                self.host,
+                user=self.user,
+                private_key=self.private_key,
+                password=self.password,
+            )
+        return self._connection
+
+    def exec_cmd(self, cmd):
+        return self.connection.exec_cmd(cmd)
+
+    def upload_file(self, localpath, remotepath):
+        self.connection.upload_file(localpath, remotepath)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
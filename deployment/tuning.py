@@ -0,0 +1,216 @@
+"""
+This module computes NooBaa performance settings from the host resources.
+The CPU count, memory, NUMA layout and number of backingstore drives are
+combined with a named profile into the values rendered into the .env and
+config-local.js files, every value keeps the reason it was chosen for.
+"""
+
+import glob
+import logging
+import os
+from collections import OrderedDict, namedtuple
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+# libuv caps its thread pool at 1024 threads
+UV_THREADPOOL_MAX = 1024
+
+HostInfo = namedtuple("HostInfo", ["cpus", "memory", "numa_nodes", "drives"])
+
+TuningValue = namedtuple("TuningValue", ["value", "reason"])
+
+PROFILES = {
+    # large objects, maximal aggregate bandwidth
+    "throughput": {
+        "cpus_per_fork": 2,
+        "max_forks": 32,
+        "threads_per_drive": 16,
+        "read_cache_fraction": 1 / 8,
+        "avg_chunk": 256 * MB,
+        "max_data_frags": 8,
+        "erasure_coding": True,
+    },
+    # fewer, less loaded endpoints and small chunks for fast first bytes
+    "latency": {
+        "cpus_per_fork": 4,
+        "max_forks": 16,
+        "threads_per_drive": 8,
+        "read_cache_fraction": 1 / 16,
+        "avg_chunk": 16 * MB,
+        "max_data_frags": 4,
+        "erasure_coding": True,
+    },
+    # many concurrent small requests, erasure coding costs more than it saves
+    "small-object": {
+        "cpus_per_fork": 1,
+        "max_forks": 64,
+        "threads_per_drive": 32,
+        "read_cache_fraction": 1 / 16,
+        "avg_chunk": 4 * MB,
+        "max_data_frags": 0,
+        "erasure_coding": False,
+    },
+}
+
+# memory kept for postgres, the core services and the page cache
+RESERVED_MEMORY_FRACTION = 1 / 4
+# memory an endpoint fork needs besides its read cache
+FORK_MEMORY = 256 * MB
+EC_PARITY_FRAGS = 2
+
+
+def detect_host(drives):
+    """
+    Inspects the host resources
+
+    Args:
+        drives (int): number of backingstore drives
+
+    Returns:
+        HostInfo: CPUs usable by this process, memory in bytes, NUMA nodes
+            and drives
+
+    """
+    cpus = len(os.sched_getaffinity(0))
+    memory = 0
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                memory = int(line.split()[1]) * 1024
+                break
+    numa_nodes = len(glob.glob("/sys/devices/system/node/node[0-9]*")) or 1
+    return HostInfo(cpus, memory, numa_nodes, drives)
+
+
+def _human(size):
+    if size % GB == 0:
+        return f"{size // GB}GB"
+    return f"{size // MB}MB"
+
+
+def compute_tuning(host, profile="throughput", overrides=None):
+    """
+    Computes the tuning values for the host
+
+    Args:
+        host (HostInfo): host resources
+        profile (str): throughput, latency or small-object
+        overrides (dict): values set explicitly, they win over the profile
+
+    Returns:
+        OrderedDict: setting name to TuningValue
+
+    Raises:
+        ValueError: In case the profile is unknown
+
+    """
+    if profile not in PROFILES:
+        raise ValueError(
+            f"Unknown tuning profile '{profile}', expected one of {sorted(PROFILES)}"
+        )
+    p = PROFILES[profile]
+    tuning = OrderedDict()
+
+    usable_memory = int(host.memory * (1 - RESERVED_MEMORY_FRACTION))
+    forks = max(1, min(host.cpus // p["cpus_per_fork"], p["max_forks"]))
+    reason = (
+        f"{host.cpus} CPUs / {p['cpus_per_fork']} per fork "
+        f"(max {p['max_forks']}) for the {profile} profile"
+    )
+    read_cache_total = int(host.memory * p["read_cache_fraction"])
+    fork_memory = FORK_MEMORY + read_cache_total // forks
+    if forks * fork_memory > usable_memory:
+        forks = max(1, usable_memory // fork_memory)
+        reason += f", limited by {_human(usable_memory)} usable memory"
+    if forks > host.numa_nodes and forks % host.numa_nodes:
+        forks -= forks % host.numa_nodes
+        reason += f", rounded down to spread over {host.numa_nodes} NUMA nodes"
+    tuning["ENDPOINT_FORKS"] = TuningValue(forks, reason)
+
+    threads = max(4, min(host.drives * p["threads_per_drive"], UV_THREADPOOL_MAX))
+    tuning["UV_THREADPOOL_SIZE"] = TuningValue(
+        threads,
+        f"{host.drives} drives x {p['threads_per_drive']} threads per drive "
+        f"for blocking fs I/O (libuv max {UV_THREADPOOL_MAX})",
+    )
+
+    read_cache = max(64 * MB, min(read_cache_total // forks, GB))
+    tuning["IO_CHUNK_READ_CACHE_SIZE"] = TuningValue(
+        read_cache,
+        f"{p['read_cache_fraction']:.3g} of {_human(host.memory)} memory "
+        f"shared by {forks} forks, between 64MB and 1GB per fork",
+    )
+
+    tuning["CHUNK_SPLIT_AVG_CHUNK"] = TuningValue(
+        p["avg_chunk"], f"{_human(p['avg_chunk'])} chunks for the {profile} profile"
+    )
+
+    max_data = host.drives - EC_PARITY_FRAGS
+    if not p["erasure_coding"]:
+        tuning["CHUNK_CODER_EC_IS_DEFAULT"] = TuningValue(
+            False, f"erasure coding is off for the {profile} profile"
+        )
+        data_frags, reason = EC_PARITY_FRAGS, "unused, erasure coding is off"
+    elif max_data < EC_PARITY_FRAGS:
+        tuning["CHUNK_CODER_EC_IS_DEFAULT"] = TuningValue(
+            False,
+            f"erasure coding is off, {host.drives} drives can't hold "
+            f"{EC_PARITY_FRAGS}+{EC_PARITY_FRAGS} fragments",
+        )
+        data_frags, reason = EC_PARITY_FRAGS, "unused, erasure coding is off"
+    else:
+        data_frags = min(max_data, p["max_data_frags"])
+        tuning["CHUNK_CODER_EC_IS_DEFAULT"] = TuningValue(
+            True, f"{host.drives} drives hold {data_frags}+{EC_PARITY_FRAGS}"
+        )
+        reason = (
+            f"{host.drives} drives - {EC_PARITY_FRAGS} parity, "
+            f"max {p['max_data_frags']} for the {profile} profile"
+        )
+    tuning["CHUNK_CODER_EC_DATA_FRAGS"] = TuningValue(data_frags, reason)
+    tuning["CHUNK_CODER_EC_PARITY_FRAGS"] = TuningValue(
+        EC_PARITY_FRAGS, "tolerates the loss of 2 drives"
+    )
+    tuning["CHUNK_CODER_EC_TOLERANCE_THRESHOLD"] = TuningValue(
+        EC_PARITY_FRAGS, "same as the parity fragments"
+    )
+
+    for name, value in (overrides or {}).items():
+        tuning[name] = TuningValue(value, "overridden in config")
+    return tuning
+
+
+def tuning_values(tuning):
+    """
+    Returns:
+        dict: setting name to value, for rendering the templates
+
+    """
+    return {name: item.value for name, item in tuning.items()}
+
+
+def explain(host, profile, tuning):
+    """
+    Formats the tuning values and why each one was chosen
+
+    Args:
+        host (HostInfo): host resources
+        profile (str): tuning profile
+        tuning (OrderedDict): tuning values
+
+    Returns:
+        str: human readable explanation
+
+    """
+    lines = [
+        f"Tuning profile '{profile}' for {host.cpus} CPUs, "
+        f"{_human(host.memory)} memory, {host.numa_nodes} NUMA nodes, "
+        f"{host.drives} drives:"
+    ]
+    width = max(len(name) for name in tuning)
+    for name, item in tuning.items():
+        lines.append(f"  {name:<{width}} = {item.value!s:<12} # {item.reason}")
+    return "\n".join(lines)
@@ -1,9 +1,19 @@
 import os
 
-from common_ci_utils.models import Config
-
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_CONFIG_PATH = os.path.join(THIS_DIR, "default_config.yaml")
 
-config = Config(DEFAULT_CONFIG_PATH=DEFAULT_CONFIG_PATH)
+
+def __getattr__(name):
+    """
+    Creates the config on first access, so importing framework doesn't load
+    the default config, e.g: for --help
+    """
+    if name == "config":
+        from common_ci_utils.models import Config
+
+        global config
+        config = Config(DEFAULT_CONFIG_PATH=DEFAULT_CONFIG_PATH)
+        return config
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,7 +6,6 @@ import argparse
 import framework
 import os
 import sys
-import yaml
 
 # Directories
 TOP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -30,6 +29,36 @@ def process_arguments(arguments):
         help="RPM location to download and install",
     )
 
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Redo all deployment steps, even the ones which are up to date",
+    )
+
+    parser.add_argument(
+        "--inventory",
+        help="Inventory assigning the DB mode roles to hosts, deploys all of "
+        "them instead of this host",
+    )
+
+    parser.add_argument(
+        "--explain-tuning",
+        action="store_true",
+        help="Print the performance tuning computed for this host and exit",
+    )
+
+    parser.add_argument(
+        "--restore-snapshot",
+        action="store_true",
+        help="Restore the DB mode snapshot of the RPM and config instead of "
+        "bootstrapping, the snapshot is created when missing",
+    )
+    parser.add_argument(
+        "--create-snapshot",
+        action="store_true",
+        help="Snapshot the DB mode state after bootstrapping",
+    )
+
     # Create a mutually exclusive group for nsfs and db
     group = parser.add_mutually_exclusive_group()
 
@@ -50,9 +79,13 @@ def process_arguments(arguments):
     db_installation = args.db
     rpm = args.rpm
 
-    # Check if neither nsfs nor db is specified
-    if not (nsfs_installation or db_installation):
-        parser.error("One of --nsfs or --db must be specified.")
+    # Check if neither nsfs nor db is specified, --explain-tuning deploys nothing
+    if not (nsfs_installation or db_installation or args.inventory):
+        if not args.explain_tuning:
+            parser.error("One of --nsfs or --db must be specified.")
+    if nsfs_installation and args.inventory:
+        parser.error("--inventory is supported with --db only.")
+    db_installation = db_installation or bool(args.inventory)
 
     # load nsfs_installation and db_installation values to config
     framework.config.ENV_DATA["nsfs_installation"] = nsfs_installation
@@ -60,11 +93,152 @@ def process_arguments(arguments):
 
     load_config(args.conf)
 
+    if args.explain_tuning:
+        framework.config.DEPLOYMENT["explain_tuning"] = True
+
+    if args.restore_snapshot:
+        framework.config.DEPLOYMENT["restore_snapshot"] = True
+    if args.create_snapshot:
+        framework.config.DEPLOYMENT["create_snapshot"] = True
+
+    if args.force:
+        framework.config.DEPLOYMENT["ledger_force"] = True
+
+    if args.inventory:
+        framework.config.DEPLOYMENT["inventory"] = args.inventory
+
     # load rpm to config if rpm parameter is passed
     if rpm:
         framework.config.ENV_DATA["noobaa_sa"] = rpm
 
 
+def process_bench_arguments(arguments):
+    """
+    This function process the arguments which are passed to noobaa-sa-bench,
+    they override the RUN bench_* config values
+
+    Args:
+        arguments (list): List of arguments
+
+    """
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument("--conf", action="append", default=[])
+    parser.add_argument("--endpoint", help="S3 endpoint URL")
+    parser.add_argument("--bucket", help="Bucket to run the benchmark in")
+    parser.add_argument("--sizes", help="Object sizes, e.g: 4KB,1MB,64MB")
+    parser.add_argument("--concurrency", help="Concurrency sweep, e.g: 1,8,32")
+    parser.add_argument("--mix", help="Operation mix, e.g: put=1,get=4,list=1")
+    parser.add_argument("--duration", type=float, help="Seconds of every run")
+    parser.add_argument("--baseline", help="Report to compare the results with")
+    parser.add_argument(
+        "--tolerance", type=float, help="Allowed relative regression, e.g: 0.1"
+    )
+    parser.add_argument("--output", help="Path of the JSON report")
+
+    args, unknown = parser.parse_known_args(args=arguments)
+    load_config(args.conf)
+
+    run = framework.config.RUN
+    if args.endpoint:
+        run["bench_endpoint"] = args.endpoint
+    if args.bucket:
+        run["bench_bucket"] = args.bucket
+    if args.sizes:
+        run["bench_sizes"] = args.sizes.split(",")
+    if args.concurrency:
+        run["bench_concurrency"] = [int(c) for c in args.concurrency.split(",")]
+    if args.mix:
+        run["bench_mix"] = args.mix
+    if args.duration:
+        run["bench_duration"] = args.duration
+    if args.baseline:
+        run["bench_baseline"] = args.baseline
+    if args.tolerance is not None:
+        run["bench_tolerance"] = args.tolerance
+    if args.output:
+        run["bench_report_file"] = args.output
+
+    # the credentials are not options, so they don't show up in ps
+    run["bench_access_key"] = run.get("bench_access_key") or os.environ.get(
+        "AWS_ACCESS_KEY_ID"
+    )
+    run["bench_secret_key"] = run.get("bench_secret_key") or os.environ.get(
+        "AWS_SECRET_ACCESS_KEY"
+    )
+    if not (run["bench_access_key"] and run["bench_secret_key"]):
+        parser.error(
+            "S3 credentials are missing, set AWS_ACCESS_KEY_ID and "
+            "AWS_SECRET_ACCESS_KEY or RUN bench_access_key and bench_secret_key "
+            "in a --conf file."
+        )
+
+
+def process_teardown_arguments(arguments):
+    """
+    This function process the arguments which are passed to noobaa-sa-teardown
+
+    Args:
+        arguments (list): List of arguments
+
+    """
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument("--conf", action="append", default=[])
+    parser.add_argument(
+        "--keep-packages",
+        action="store_true",
+        help="Keep the noobaa-core RPM and postgres packages installed, so "
+        "the next deployment skips downloading and installing them",
+    )
+    parser.add_argument(
+        "--nsfs",
+        action="store_true",
+        help="Tear down NooBaa Standalone with NSFS only",
+    )
+    parser.add_argument(
+        "--db",
+        action="store_true",
+        help="Tear down NooBaa Standalone with db only",
+    )
+
+    args, unknown = parser.parse_known_args(args=arguments)
+
+    # tear down both installations unless one is specified
+    framework.config.ENV_DATA["nsfs_installation"] = args.nsfs or not args.db
+    framework.config.ENV_DATA["db_installation"] = args.db or not args.nsfs
+
+    load_config(args.conf)
+
+    if args.keep_packages:
+        framework.config.DEPLOYMENT["teardown_keep_packages"] = True
+
+
+def process_metrics_arguments(arguments):
+    """
+    This function process the arguments which are passed to noobaa-sa-metrics,
+    they override the REPORTING metrics_* config values
+
+    Args:
+        arguments (list): List of arguments
+
+    """
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument("--conf", action="append", default=[])
+    parser.add_argument("--port", type=int, help="Local port of /metrics and /json")
+    parser.add_argument("--interval", type=float, help="Seconds between samples")
+    parser.add_argument("--output", help="Path of the JSON dump written at exit")
+
+    args, unknown = parser.parse_known_args(args=arguments)
+    load_config(args.conf)
+
+    reporting = framework.config.REPORTING
+    if args.port:
+        reporting["metrics_port"] = args.port
+    if args.interval:
+        reporting["metrics_interval"] = args.interval
+    if args.output:
+        reporting["metrics_file"] = args.output
+
+
 def load_config(config_files):
     """
     This function load the config files in the order defined in config_files
@@ -74,6 +248,8 @@ def load_config(config_files):
         config_files (list): config file paths
 
     """
+    import yaml
+
     for config_file in config_files:
         with open(os.path.abspath(os.path.expanduser(config_file))) as file_stream:
             custom_config_data = yaml.safe_load(file_stream)
@@ -87,3 +263,27 @@ def load_args(argv=None):
     arguments = argv or sys.argv[1:]
     process_arguments(arguments)
     framework.config.ENV_DATA["template_dir"] = TEMPLATE_DIR
+
+
+def load_bench_args(argv=None):
+    """
+    This function loads the noobaa-sa-bench arguments
+    """
+    arguments = argv or sys.argv[1:]
+    process_bench_arguments(arguments)
+
+
+def load_teardown_args(argv=None):
+    """
+    This function loads the noobaa-sa-teardown arguments
+    """
+    arguments = argv or sys.argv[1:]
+    process_teardown_arguments(arguments)
+
+
+def load_metrics_args(argv=None):
+    """
+    This function loads the noobaa-sa-metrics arguments
+    """
+    arguments = argv or sys.argv[1:]
+    process_metrics_arguments(arguments)
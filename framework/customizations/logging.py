@@ -3,13 +3,23 @@ This module loads the default logging conf to the logging system.
 """
 
 import os
-import time
-import logging.config
 
 
 current_directory = os.path.abspath(os.path.dirname(__file__))
 logging_conf = os.path.join(current_directory, "logging.conf")
+_configured = False
 
-# Create a unique log filename with a timestamp
-log_filename = time.strftime("%Y%m%d%H%M%S")
-logging.config.fileConfig(fname=logging_conf, disable_existing_loggers=False)
+
+def configure_logging():
+    """
+    Loads the default logging conf, once per process. The conf creates a
+    log file with a timestamp in its name, so it is loaded by the entry
+    points instead of at import.
+    """
+    global _configured
+    if _configured:
+        return
+    import logging.config
+
+    logging.config.fileConfig(fname=logging_conf, disable_existing_loggers=False)
+    _configured = True
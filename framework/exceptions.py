@@ -3,3 +3,47 @@
 
 class rpmNotFoundError(Exception):
     pass
+
+
+class ReadinessTimeout(Exception):
+    pass
+
+
+class StepFailed(Exception):
+    pass
+
+
+class PortAllocationFailed(Exception):
+    pass
+
+
+class RPMChecksumMismatch(Exception):
+    pass
+
+
+class PostgresTuningFailed(Exception):
+    pass
+
+
+class InventoryError(Exception):
+    pass
+
+
+class RemoteCommandFailed(Exception):
+    pass
+
+
+class NSFSProvisioningFailed(Exception):
+    pass
+
+
+class DrivePlacementError(Exception):
+    pass
+
+
+class SnapshotPathsInUse(Exception):
+    pass
+
+
+class RangesNotSupported(Exception):
+    pass
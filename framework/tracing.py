@@ -0,0 +1,179 @@
+"""
+This module provides lightweight tracing of the deployment phases.
+Nested spans record wall clock and CPU time, and the collected spans are
+written as a JSON report which is also a valid Chrome trace file
+(chrome://tracing, Perfetto).
+
+cpu_time is the CPU time of the thread running the span. The CPU time of
+subprocesses comes from the process-wide children counters, so
+process_children_cpu_time holds the CPU of every subprocess waited for by
+any thread while the span ran, spans running in parallel share it.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import count
+
+log = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span(object):
+    """
+    A single timed phase
+    """
+
+    def __init__(self, span_id, name, parent_id, attrs):
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.thread_id = threading.get_ident()
+        self.start = None
+        self.wall_time = None
+        self.cpu_time = None
+        self.process_children_cpu_time = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "id": self.span_id,
+            "name": self.name,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "process_children_cpu_time": self.process_children_cpu_time,
+            "thread_id": self.thread_id,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+class Tracer(object):
+    """
+    Collects spans from all threads
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.start = time.time()
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Times the enclosed block as a span nested in the current span
+
+        Args:
+            name (str): name of the phase, e.g: "rpm download"
+            attrs: extra attributes recorded with the span
+
+        Yields:
+            Span: the span, attributes can be added while it runs
+
+        """
+        parent = _current_span.get()
+        span = Span(
+            next(self._ids), name, parent.span_id if parent else None, attrs
+        )
+        token = _current_span.set(span)
+        span.start = time.time()
+        start = time.perf_counter()
+        # thread CPU time of this span, CPU time of the subprocesses waited
+        # for by any thread of the process
+        cpu_start = time.thread_time()
+        children_start = os.times()
+        try:
+            yield span
+        except BaseException as ex:
+            span.error = repr(ex)
+            raise
+        finally:
+            children_end = os.times()
+            span.wall_time = time.perf_counter() - start
+            span.cpu_time = time.thread_time() - cpu_start
+            span.process_children_cpu_time = (
+                children_end.children_user
+                + children_end.children_system
+                - children_start.children_user
+                - children_start.children_system
+            )
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+            log.debug(f"span '{name}' took {span.wall_time:.3f}s")
+
+    def chrome_trace_events(self, spans):
+        """
+        Converts spans to Chrome trace complete events
+
+        Args:
+            spans (list): spans to convert
+
+        Returns:
+            list: trace events
+
+        """
+        pid = os.getpid()
+        return [
+            {
+                "name": span.name,
+                "cat": "deployment",
+                "ph": "X",
+                "ts": (span.start - self.start) * 1e6,
+                "dur": span.wall_time * 1e6,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {
+                    **span.attrs,
+                    "cpu_time": span.cpu_time,
+                    "process_children_cpu_time": span.process_children_cpu_time,
+                    "error": span.error,
+                },
+            }
+            for span in spans
+        ]
+
+    def write_report(self, path):
+        """
+        Writes all spans to a JSON file loadable as a Chrome trace
+
+        Args:
+            path (str): path of the report
+
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        report = {
+            "traceEvents": self.chrome_trace_events(spans),
+            "displayTimeUnit": "ms",
+            "spans": [span.to_dict() for span in spans],
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        log.info(f"Deployment trace report written to {path}")
+
+
+def bind_context(func, *args, **kwargs):
+    """
+    Binds func to the current span, so spans opened by func in another
+    thread are nested under it, e.g: executor.submit(bind_context(f))
+
+    Returns:
+        callable: function running func in a copy of the current context
+
+    """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func, *args, **kwargs)
+
+
+tracer = Tracer()
@@ -23,6 +23,9 @@ setup(
     entry_points={
         "console_scripts": [
             "noobaa-sa-install=deployment.main:noobaa_sa_install",
+            "noobaa-sa-bench=deployment.main:noobaa_sa_bench",
+            "noobaa-sa-teardown=deployment.main:noobaa_sa_teardown",
+            "noobaa-sa-metrics=deployment.main:noobaa_sa_metrics",
         ],
     },
 )